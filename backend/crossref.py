@@ -21,20 +21,33 @@
 from __future__ import unicode_literals
 
 import datetime
+from itertools import imap
+from itertools import izip
 import json
+from multiprocessing.pool import ThreadPool
+from Queue import Full
+from Queue import Queue
+import threading
+import time
 
 import requests
 from requests.exceptions import RequestException
 
+from backend.doicache import doi_metadata_store
+from backend.httpclient import http_client
+from backend.romeo import count_publisher_alias
 from backend.romeo import fetch_journal
 from backend.romeo import fetch_publisher
+from backend.queues import wait_for_interactive_tasks
 from backend.utils import urlopen_retry
 from backend.doiprefixes import free_doi_prefixes
+from dissemin.settings import BULK_CURSOR_MAX_PAUSE
 from dissemin.settings import DOI_PROXY_DOMAIN
 from dissemin.settings import DOI_PROXY_SUPPORTS_BATCH
 from dissemin.settings import CROSSREF_USER_AGENT
 from dissemin.settings import CROSSREF_MAILTO
 from django.db import DataError
+from django.utils import timezone
 from django.utils.http import urlencode
 from papers.baremodels import BareName
 from papers.baremodels import BareOaiRecord
@@ -43,6 +56,8 @@ from papers.doi import doi_to_crossref_identifier
 from papers.doi import doi_to_url
 from papers.doi import to_doi
 from papers.errors import MetadataSourceException
+from papers.models import HarvestState
+from papers.models import oai_sources
 from papers.models import OaiSource
 from papers.models import Paper
 from papers.name import normalize_name_words
@@ -52,7 +67,7 @@ from papers.utils import jpath
 from papers.utils import tolerant_datestamp_to_datetime
 from papers.utils import valid_publication_date
 from papers.utils import validate_orcid
-from publishers.models import AliasPublisher
+from publishers.models import alias_counter
 from backend.pubtype_translations import CROSSREF_PUBTYPE_ALIASES
 
 ######## HOW THIS MODULE WORKS ###########
@@ -92,15 +107,32 @@ from backend.pubtype_translations import CROSSREF_PUBTYPE_ALIASES
 # The metadata from Crossref is fetched via the OAI-PMH proxy (proaixy)
 # so the OAI module uses this module to convert the metadata.
 #
+# 4. Local metadata store
+#
+# The metadata fetched for individual DOIs is kept in our database
+# (see backend.doicache) so that refreshing a profile does not fetch
+# the same DOIs over and over again. It is also used as a fallback
+# when the DOI proxy is down.
+#
 
 # Number of results per page we ask the CrossRef search interface
 nb_results_per_request = 50
 # Same but when fetching metadata for a list of dois
 nb_dois_per_batch = 25
+# Number of such batches fetched concurrently
+nb_concurrent_doi_batches = 4
 # Maximum number of pages we request
 max_crossref_batches_per_researcher = 10
+# Number of pages of a search fetched concurrently
+nb_concurrent_search_pages = 4
 # Maximum timeout for the CrossRef interface (sometimes it is a bit lazy)
 crossref_timeout = 15
+# Maximum number of results per page served by the CrossRef REST API
+crossref_max_rows = 1000
+# Number of pages the harvester downloads in advance
+crossref_prefetched_pages = 2
+# Number of records ingested between two checkpoints of the harvest state
+crossref_checkpoint_interval = 5000
 
 
 # Licenses considered OA, as stored by CrossRef
@@ -181,23 +213,33 @@ def get_publication_date(metadata):
         date = parse_crossref_date(metadata['deposited'])
     return date
 
-def create_publication(paper, metadata):
+def create_publication(paper, metadata, fields=None):
     """
-    Creates a BareOaiRecord entry based on the DOI metadata (as returned by the JSON format
+    Creates a BareOaiRecord entry based on the DOI metadata (as returned by the JSON format
     from CrossRef).
 
     :param paper: the paper the publication object refers to
     :param metadata: the CrossRef metadata (parsed from JSON)
+    :param fields: the output of :func:`get_publication_fields` for this
+        metadata, if it has already been computed
     :returns: None if the metadata is invalid or the data does not fit in the database schema, otherwise the pair of the paper and the publication.
     """
     try:
-        return _create_publication(paper, metadata)
+        return _create_publication(paper, metadata, fields)
     except DataError as e:
         print "create_publication: ignored DataError:"
         print e
 
 
-def _create_publication(paper, metadata):
+def get_publication_fields(metadata):
+    """
+    Extracts the fields of a publication from DOI metadata.
+    This does not access the database, so it can be run in worker
+    processes (see :mod:`backend.crossrefdump`).
+
+    :returns: a dict of fields, to be completed by
+        :func:`create_publication`, or None if the metadata is invalid
+    """
     if not metadata:
         return
     if not metadata.get('container-title'):
@@ -237,6 +279,32 @@ def _create_publication(paper, metadata):
     if doi_prefix in free_doi_prefixes or any(map(is_oa_license, licenses)):
         pdf_url = splash_url
 
+    return {
+        'issn': issn,
+        'journal_title': title,
+        'issue': issue,
+        'volume': volume,
+        'pubdate': pubdate,
+        'pages': pages,
+        'doi': doi,
+        'pubtype': pubtype,
+        'publisher_name': publisher_name,
+        'pdf_url': pdf_url,
+        'splash_url': splash_url,
+        'identifier': doi_to_crossref_identifier(doi),
+    }
+
+
+def _create_publication(paper, metadata, fields=None):
+    if fields is None:
+        fields = get_publication_fields(metadata)
+    if fields is None:
+        return
+    fields = fields.copy()
+    issn = fields.pop('issn')
+    title = fields['journal_title']
+    publisher_name = fields['publisher_name']
+
     # Lookup journal
     search_terms = {'jtitle': title}
     if issn:
@@ -246,30 +314,109 @@ def _create_publication(paper, metadata):
     publisher = None
     if journal:
         publisher = journal.publisher
-        AliasPublisher.increment(publisher_name, journal.publisher)
+        count_publisher_alias(publisher_name, journal.publisher)
     else:
         publisher = fetch_publisher(publisher_name)
 
     barepub = BareOaiRecord(
             paper=paper,
-            journal_title=title,
-            issue=issue,
-            volume=volume,
-            pubdate=pubdate,
-            pages=pages,
-            doi=doi,
-            pubtype=pubtype,
-            publisher_name=publisher_name,
             journal=journal,
             publisher=publisher,
-            pdf_url=pdf_url,
-            splash_url=splash_url,
-            source=OaiSource.objects.get(identifier='crossref'),
-            identifier=doi_to_crossref_identifier(doi))
+            source=oai_sources.get('crossref'),
+            **fields)
     rec = paper.add_oairecord(barepub)
     paper.update_availability()
     return paper, rec
 
+
+def create_bare_paper(metadata, extra_orcids=None):
+    """
+    Creates a bare paper (without its publication) from DOI metadata.
+    This does not access the database.
+
+    :param extra_orcids: an optional orcids list, which will be unified
+        with the orcids extracted from the metadata. This is useful for the ORCID interface.
+    :raises ValueError: if the metadata is not sufficient to create a paper
+    """
+    # Normalize metadata
+    if metadata is None or not isinstance(metadata, dict):
+        raise ValueError('Invalid metadata format, expecting a dict')
+    if not metadata.get('author'):
+        raise ValueError('No author provided')
+
+    if not metadata.get('title'):
+        raise ValueError('No title')
+
+    # the upstream function ensures that there is a non-empty title
+    if not to_doi(metadata.get('DOI')):
+        raise ValueError("No DOI, skipping")
+
+    pubdate = get_publication_date(metadata)
+
+    if pubdate is None:
+        raise ValueError('No pubdate')
+
+    title = metadata['title']
+    # CrossRef metadata stores titles in lists
+    if isinstance(title, list):
+        title = title[0]
+    subtitle = metadata.get('subtitle')
+    if subtitle:
+        if isinstance(subtitle, list):
+            subtitle = subtitle[0]
+        title += ': '+subtitle
+
+    name_pairs = map(convert_to_name_pair, metadata['author'])
+    if None in name_pairs:
+        raise ValueError('Invalid author')
+    authors = [BareName.create_bare(first, last) for first, last in
+               name_pairs]
+
+    def get_affiliation(author_elem):
+        for dct in author_elem.get('affiliation', []):
+            if 'name' in dct:
+                return dct['name']
+
+    def get_orcid(author_elem):
+        orcid = validate_orcid(author_elem.get('ORCID'))
+        if orcid:
+            return orcid
+
+    new_orcids = map(get_orcid, metadata['author'])
+    if extra_orcids:
+        # remove the extra_orcids if they already exist on different authors
+        set_of_extra_orcids = set(x for x in extra_orcids if x != None)
+        new_orcids = [(x if x not in set_of_extra_orcids else None)
+                for x in new_orcids]
+        # now do the union
+        orcids = [new or old for (old, new) in zip(
+            extra_orcids, new_orcids)]
+    else:
+        orcids = new_orcids
+    affiliations = map(get_affiliation, metadata['author'])
+
+    return BarePaper.create(title, authors, pubdate,
+                            visible=True, affiliations=affiliations, orcids=orcids)
+
+
+def add_publication(paper, metadata, fields=None):
+    """
+    Adds the publication described by DOI metadata to a bare paper
+    created by :func:`create_bare_paper`.
+
+    :returns: the paper
+    """
+    result = create_publication(paper, metadata, fields)
+
+    if result is None:  # Creating the publication failed!
+        # Make sure the paper only appears if it is still associated
+        # with another source.
+        paper.update_visible()
+    else:
+        paper = result[0]
+
+    return paper
+
 # Fetching utilities
 
 
@@ -281,6 +428,10 @@ def fetch_metadata_by_DOI(doi):
     """
     if doi is None:
         return
+    fresh, stale = doi_metadata_store.get_many([doi])
+    if doi.lower() in fresh:
+        return fresh[doi.lower()]
+
     addheaders = {'Accept': 'application/citeproc+json'}
     try:
         request = 'http://'+DOI_PROXY_DOMAIN+'/'+doi
@@ -289,19 +440,27 @@ def fetch_metadata_by_DOI(doi):
                                  headers=addheaders,
                                  retries=0)
         parsed = json.loads(response)
-        return parsed
     except ValueError as e:
         raise MetadataSourceException('Error while fetching DOI metadata:\nInvalid JSON response.\n' +
                                       'Error: '+str(e))
+    except MetadataSourceException:
+        # the proxy is unreachable: outdated metadata is better than nothing
+        if doi.lower() in stale:
+            return stale[doi.lower()]
+        raise
+    doi_metadata_store.put_many([parsed])
+    return parsed
 
 
 def fetch_dois(doi_list):
     """
     Fetch the metadata of a list of DOIs from CrossRef,
     by batch if the server supports it, otherwise incrementally.
+
+    :returns: a generator of metadata (or None), in the same order as the DOIs
     """
     if DOI_PROXY_SUPPORTS_BATCH:
-        return fetch_dois_by_batch(doi_list)
+        return iter_dois_by_batch(doi_list)
     else:
         return fetch_dois_incrementally(doi_list)
 
@@ -330,7 +489,7 @@ def make_crossref_call(endpoint, params=None, headers=None):
         headers = {}
     params['mailto'] = CROSSREF_MAILTO
     headers['User-Agent'] = CROSSREF_USER_AGENT
-    return requests.get('https://api.crossref.org'+endpoint,
+    return http_client.get('https://api.crossref.org'+endpoint,
             params=params, headers=headers)
 
 def fetch_dois_by_batch(doi_list):
@@ -338,6 +497,80 @@ def fetch_dois_by_batch(doi_list):
     Fetch a list of DOIs by batch (useful when refreshing the list of publications
     of a given researcher, as the records have most likely been already cached before
     by the proxy)
+
+    :returns: the list of metadata (or None), in the same order as the DOIs
+    """
+    return list(iter_dois_by_batch(doi_list))
+
+
+def iter_dois_by_batch(doi_list, workers=nb_concurrent_doi_batches):
+    """
+    Streaming version of :func:`fetch_dois_by_batch`: the metadata is
+    yielded in the same order as the DOIs, as soon as the batch it belongs
+    to has been fetched. Batches are fetched concurrently by `workers`
+    threads.
+
+    The local DOI metadata store is queried first: only the DOIs which
+    are missing from it (or stale) are fetched from CrossRef and the proxy.
+
+    If a batch cannot be fetched from these services, the error is logged
+    and the stream goes on: the stale metadata of its DOIs is returned
+    when available, and None otherwise (as for DOIs which do not exist).
+    No exception is raised partway through the stream.
+    """
+    if len(doi_list) == 0:
+        return
+
+    # The metadata store is only accessed from this thread
+    # (each thread would otherwise open its own database connection)
+    fresh, stale = doi_metadata_store.get_many(doi_list)
+    batches = [doi_list[i:i+nb_dois_per_batch]
+               for i in range(0, len(doi_list), nb_dois_per_batch)]
+    to_fetch = []
+    for batch in batches:
+        missing = []
+        for doi in batch:
+            if doi.lower() not in fresh and doi not in missing:
+                missing.append(doi)
+        to_fetch.append(missing)
+
+    def fetch_batch(dois):
+        try:
+            return fetch_dois_from_proxy(dois), None
+        except MetadataSourceException as e:
+            return None, e
+
+    nb_threads = min(workers, len([dois for dois in to_fetch if dois]))
+    pool = None
+    if nb_threads > 1:
+        pool = ThreadPool(nb_threads)
+    try:
+        fetched_batches = (pool.imap if pool else imap)(fetch_batch, to_fetch)
+        for batch, missing, (results, error) in izip(
+                batches, to_fetch, fetched_batches):
+            fetched = {}
+            if error is not None:
+                print "DOI proxy unavailable, serving stale metadata only:"
+                print error
+            elif missing:
+                doi_metadata_store.put_many(results)
+                for doi, item in zip(missing, results):
+                    if item:
+                        fetched[doi.lower()] = item
+
+            for doi in batch:
+                key = doi.lower()
+                yield fresh.get(key) or fetched.get(key) or stale.get(key)
+    finally:
+        if pool:
+            pool.terminate()
+
+
+def fetch_dois_from_proxy(doi_list):
+    """
+    Fetch a list of DOIs from CrossRef, and from our DOI proxy
+    for the DOIs not issued by CrossRef. This bypasses the local
+    metadata store (use :func:`fetch_dois_by_batch` instead).
     """
     def results_list_to_dict(results):
         dct = {}
@@ -349,8 +582,8 @@ def fetch_dois_by_batch(doi_list):
     if len(doi_list) == 0:
         return []
     elif len(doi_list) > nb_dois_per_batch:
-        first_dois = fetch_dois_by_batch(doi_list[:nb_dois_per_batch])
-        last_dois = fetch_dois_by_batch(doi_list[nb_dois_per_batch:])
+        first_dois = fetch_dois_from_proxy(doi_list[:nb_dois_per_batch])
+        last_dois = fetch_dois_from_proxy(doi_list[nb_dois_per_batch:])
         return first_dois + last_dois
 
     # Given how we are joining the DOIs, they cannot contain commas
@@ -369,8 +602,8 @@ def fetch_dois_by_batch(doi_list):
         # We fetch them using our proxy (cached content negociation)
         missing_dois = list(set(doi_list) - set(dct.keys()))
         if missing_dois:
-            req = requests.post('http://'+DOI_PROXY_DOMAIN +
-                                '/batch', {'dois': json.dumps(missing_dois)})
+            req = http_client.post('http://'+DOI_PROXY_DOMAIN +
+                                   '/batch', {'dois': json.dumps(missing_dois)})
             req.raise_for_status()
             missing_dois_dct = results_list_to_dict(req.json())
             dct.update(missing_dois_dct)
@@ -390,6 +623,227 @@ def fetch_dois_by_batch(doi_list):
             'Failed to retrieve batch metadata from the proxy: '+str(e))
 
 
+def query_works(params):
+    """
+    Queries the /works endpoint of the CrossRef REST API.
+
+    :returns: a pair: the parsed response and its size (in bytes)
+    :raises MetadataSourceException: if the query failed
+    """
+    params = params.copy()
+    params['mailto'] = CROSSREF_MAILTO
+
+    try:
+        r = make_crossref_call('/works', params=params)
+        r.raise_for_status()
+        js = r.json()
+        if js['status'] == 'failed':
+            raise MetadataSourceException(
+            'Querying Crossrsef with {} failed.'.format(r.url))
+        return js, len(r.content)
+    except ValueError as e:
+        raise MetadataSourceException(
+            'Error while fetching CrossRef results:\nInvalid response.\n' +
+            'Parameters were: %s\nJSON parser error was: %s' % (urlencode(params), unicode(e)))
+    except requests.exceptions.RequestException as e:
+        raise MetadataSourceException('Error while fetching CrossRef results:\nError was: '+str(e))
+
+
+def iter_works_by_filter(filters, rows=nb_results_per_request,
+                         max_pages=max_crossref_batches_per_researcher,
+                         workers=nb_concurrent_search_pages):
+    """
+    Iterates over the CrossRef records matching some filters, for
+    searches returning a limited number of records (such as the works
+    of a researcher). Use :class:`CrossRefHarvester` for larger ones.
+
+    The first page gives the number of results: the following pages
+    are then fetched concurrently by `workers` threads (by offset), and
+    their records are yielded as soon as each page arrives, so not
+    necessarily in the order of the results.
+
+    :param filters: filters as specified by the REST API (as a dictionary)
+    :param rows: the number of records per page
+    :param max_pages: the maximum number of pages fetched
+    """
+    params = {
+        'filter': ','.join(k+':'+v for k, v in filters.items()),
+        'rows': rows,
+    }
+
+    def fetch_page(offset):
+        page_params = params.copy()
+        page_params['offset'] = offset
+        js, nbytes = query_works(page_params)
+        return jpath('message/items', js, default=[]), js
+
+    items, js = fetch_page(0)
+    for item in items:
+        yield item
+
+    total = jpath('message/total-results', js, default=0)
+    offsets = range(rows, min(total, rows * max_pages), rows)
+    if not offsets:
+        return
+    pool = ThreadPool(min(workers, len(offsets)))
+    try:
+        for items, js in pool.imap_unordered(fetch_page, offsets):
+            for item in items:
+                yield item
+    finally:
+        pool.terminate()
+
+
+class CrossRefHarvester(object):
+    """
+    Iterates over all the CrossRef records matching some filters,
+    using the deep paging (cursor) mechanism of their REST API.
+
+    Pages are downloaded by a background thread, so that the next
+    pages are already being fetched while the current one is being
+    processed.
+
+    The harvester can be checkpointed: :attr:`cursor` is the cursor
+    of the page currently being iterated over, so a new harvester
+    started at that cursor re-yields at most one page of records.
+    Throughput counters (:attr:`records`, :attr:`bytes`,
+    :meth:`records_per_second`, :meth:`bytes_per_second`) can be used
+    to tune the page size.
+    """
+
+    def __init__(self, filters=None, cursor='*', rows=crossref_max_rows,
+                 prefetch=crossref_prefetched_pages, sort=None):
+        """
+        :param filters: filters as specified by the REST API (as a dictionary)
+        :param cursor: the cursor where to start the fetching
+        :param rows: the number of records to request per page
+            (at most :data:`crossref_max_rows`)
+        :param prefetch: the number of pages to download in advance
+        :param sort: if provided, the records are returned in ascending
+            order for this field (for instance, 'updated')
+        """
+        self.params = {}
+        if filters:
+            self.params['filter'] = ','.join(
+                k+":"+v for k, v in filters.items())
+        if sort:
+            self.params['sort'] = sort
+            self.params['order'] = 'asc'
+        self.rows = min(rows, crossref_max_rows)
+        self.prefetch = max(prefetch, 1)
+        self.cursor = cursor
+        self.next_cursor = cursor
+        self.pages = 0
+        self.records = 0
+        self.bytes = 0
+        self.start_time = None
+
+    def __iter__(self):
+        for page in self.iter_pages():
+            for item in page:
+                yield item
+
+    def iter_pages(self):
+        """
+        Yields the lists of records returned for each page.
+        """
+        queue = Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        fetcher = threading.Thread(target=self._fetch_pages,
+                                   args=(self.next_cursor, queue, stop))
+        fetcher.daemon = True
+        self.start_time = time.time()
+        fetcher.start()
+        try:
+            while True:
+                page = queue.get()
+                if page is None:
+                    break
+                elif isinstance(page, Exception):
+                    raise page
+                cursor, next_cursor, items, nbytes = page
+                self.cursor = cursor
+                self.next_cursor = next_cursor
+                self.pages += 1
+                self.records += len(items)
+                self.bytes += nbytes
+                yield items
+                print('Next cursor: %s (%s)' % (next_cursor, self.report()))
+        finally:
+            stop.set()
+
+    def _fetch_pages(self, cursor, queue, stop):
+        """
+        Downloads pages and pushes them to the queue
+        until the last one, or until we are told to stop.
+        """
+        def push(item):
+            while not stop.is_set():
+                try:
+                    queue.put(item, timeout=1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        try:
+            while cursor and not stop.is_set():
+                next_cursor, items, nbytes = self.fetch_page(cursor)
+                if not items:
+                    break
+                if not push((cursor, next_cursor, items, nbytes)):
+                    return
+                cursor = next_cursor
+        except Exception as e:
+            # re-raised in the consuming thread
+            push(e)
+            return
+        push(None)
+
+    def fetch_page(self, cursor):
+        """
+        Fetches the page starting at the given cursor.
+
+        :returns: a triple: the cursor of the next page, the list of items
+            of this page, and the size of the response (in bytes)
+        """
+        params = self.params.copy()
+        params['rows'] = self.rows
+        params['cursor'] = cursor
+
+        js, nbytes = query_works(params)
+        items = jpath('message/items', js, default=[])
+        return jpath('message/next-cursor', js), items, nbytes
+
+    def elapsed(self):
+        """
+        Number of seconds since the harvest started
+        """
+        if self.start_time is None:
+            return 0.
+        return time.time() - self.start_time
+
+    def records_per_second(self):
+        elapsed = self.elapsed()
+        if not elapsed:
+            return 0.
+        return self.records / elapsed
+
+    def bytes_per_second(self):
+        elapsed = self.elapsed()
+        if not elapsed:
+            return 0.
+        return self.bytes / elapsed
+
+    def report(self):
+        """
+        Human-readable summary of the throughput of the harvest
+        """
+        return '%d records, %.1f records/s, %.1f kB/s' % (
+            self.records, self.records_per_second(),
+            self.bytes_per_second() / 1024)
+
+
 class CrossRefAPI(object):
     """
     Fetches papers from CrossRef
@@ -418,142 +872,177 @@ class CrossRefAPI(object):
             with the orcids extracted from the metadata. This is useful for the ORCID interface.
         :returns: the paper, created if needed
         """
-        # Normalize metadata
-        if metadata is None or not isinstance(metadata, dict):
-            raise ValueError('Invalid metadata format, expecting a dict')
-        if not metadata.get('author'):
-            raise ValueError('No author provided')
-
-        if not metadata.get('title'):
-            raise ValueError('No title')
-
-        # the upstream function ensures that there is a non-empty title
-        if not to_doi(metadata.get('DOI')):
-            raise ValueError("No DOI, skipping")
-
-        pubdate = get_publication_date(metadata)
-
-        if pubdate is None:
-            raise ValueError('No pubdate')
-
-        title = metadata['title']
-        # CrossRef metadata stores titles in lists
-        if isinstance(title, list):
-            title = title[0]
-        subtitle = metadata.get('subtitle')
-        if subtitle:
-            if isinstance(subtitle, list):
-                subtitle = subtitle[0]
-            title += ': '+subtitle
-
-        name_pairs = map(convert_to_name_pair, metadata['author'])
-        if None in name_pairs:
-            raise ValueError('Invalid author')
-        authors = [BareName.create_bare(first, last) for first, last in
-                   name_pairs]
-
-        def get_affiliation(author_elem):
-            for dct in author_elem.get('affiliation', []):
-                if 'name' in dct:
-                    return dct['name']
-
-        def get_orcid(author_elem):
-            orcid = validate_orcid(author_elem.get('ORCID'))
-            if orcid:
-                return orcid
-
-        new_orcids = map(get_orcid, metadata['author'])
-        if extra_orcids:
-            # remove the extra_orcids if they already exist on different authors
-            set_of_extra_orcids = set(x for x in extra_orcids if x != None)
-            new_orcids = [(x if x not in set_of_extra_orcids else None)
-                    for x in new_orcids]
-            # now do the union
-            orcids = [new or old for (old, new) in zip(
-                extra_orcids, new_orcids)]
-        else:
-            orcids = new_orcids
-        affiliations = map(get_affiliation, metadata['author'])
+        paper = create_bare_paper(metadata, extra_orcids)
+        return add_publication(paper, metadata)
 
-        paper = BarePaper.create(title, authors, pubdate,
-                                 visible=True, affiliations=affiliations, orcids=orcids)
+    def save_doi_metadata_bulk(self, items):
+        """
+        Saves a page of CrossRef records at once. This is the bulk
+        counterpart of :meth:`save_doi_metadata` followed by
+        :meth:`Paper.from_bare`: existing papers and records are looked up
+        for the whole page with a constant number of queries
+        (see :meth:`Paper.bulk_from_bare`).
 
-        result = create_publication(paper, metadata)
+        Invalid records are skipped.
 
-        if result is None:  # Creating the publication failed!
-            # Make sure the paper only appears if it is still associated
-            # with another source.
-            paper.update_visible()
-        else:
-            paper = result[0]
-
-        return paper
+        :param items: a list of CrossRef records (parsed from JSON)
+        :returns: the list of papers saved
+        """
+        bare_papers = []
+        for metadata in items:
+            try:
+                bare_papers.append(self.save_doi_metadata(metadata))
+            except ValueError as e:
+                print(e)
+        return Paper.bulk_from_bare(bare_papers)
 
     ##### CrossRef search API #######
 
-    def fetch_all_records(self, filters=None,cursor="*"):
+    def fetch_all_records(self, filters=None, cursor="*",
+                          rows=crossref_max_rows):
         """
         Fetches all Crossref records from their API, starting at a given date.
 
         :param filters: filters as specified by the REST API (as a dictionary)
         :param cursor: the initial cursor where to start the fetching
             (useful to resume failed ingestions)
+        :param rows: the number of records to request per page
         """
-        if filters is None:
-            filters = {}
-        params = {}
-        if filters:
-            params['filter'] = ','.join(k+":"+v for k, v in filters.items())
-
-        rows = 20
-        next_cursor = cursor
-        while next_cursor:
-            params['rows'] = rows
-            params['cursor'] = next_cursor
-            params['mailto'] = CROSSREF_MAILTO
+        return iter(CrossRefHarvester(filters=filters, cursor=cursor,
+                                      rows=rows))
 
-            try:
-                r = make_crossref_call('/works', params=params)
-                r.raise_for_status()
-                js = r.json()
-                if js['status'] == 'failed':
-                    raise MetadataSourceException(
-                    'Querying Crossrsef with {} failed.'.format(r.url))
-                found = False
-                for item in jpath('message/items', js, default=[]):
-                    found = True
-                    yield item
-                if not found:
-                    break
-                next_cursor = jpath('message/next-cursor', js)
-                print('Next cursor: '+next_cursor) # to ease recovery
-            except ValueError as e:
-                raise MetadataSourceException(
-                    'Error while fetching CrossRef results:\nInvalid response.\n' +
-                    'Parameters were: %s\nJSON parser error was: %s' % (urlencode(params), unicode(e)))
-            except requests.exceptions.RequestException as e:
-                raise MetadataSourceException('Error while fetching CrossRef results:\nError was: '+str(e))
+    def fetch_all_papers(self, filters, rows=nb_results_per_request,
+                         max_pages=max_crossref_batches_per_researcher):
+        """
+        Fetches the CrossRef records matching a search with a limited
+        number of results, such as {'orcid': orcid_id}. The pages are
+        fetched concurrently (see :func:`iter_works_by_filter`).
 
+        :param filters: filters as specified by the REST API (as a dictionary)
+        :param rows: the number of records per page
+        :param max_pages: the maximum number of pages fetched
+        :returns: a generator of CrossRef records
+        """
+        return iter_works_by_filter(filters, rows=rows, max_pages=max_pages)
 
-    def fetch_and_save_new_records(self, starting_cursor='*'):
+    def fetch_and_save_new_records(self, resume=False,
+                                   checkpoint_every=crossref_checkpoint_interval,
+                                   max_records=None, max_duration=None):
         """
         Fetches and stores all new Crossref records updated since the
         last update time of the associated OaiSource.
+
+        The progress of the ingestion is saved in the :class:`HarvestState`
+        named 'crossref' every `checkpoint_every` records (and when the
+        ingestion is interrupted), so that it can be resumed later.
+
+        :param resume: continue the last interrupted ingestion from its
+            last checkpoint (if there is one) instead of starting a new one
+        :param checkpoint_every: the number of records between two checkpoints
+        :param max_records: stop after processing (about) that many records
+        :param max_duration: stop after that time (a timedelta)
+        :returns: True if the ingestion completed, False if it was stopped
+            by `max_records` or `max_duration` (it can then be resumed)
         """
         source = OaiSource.objects.get(identifier='crossref')
-        last_updated = source.last_update
+        state = HarvestState.get_by_name('crossref')
+        if resume and state.resumable:
+            print('Resuming CrossRef ingestion at cursor %s (%d records already processed)' %
+                  (state.cursor, state.records))
+        else:
+            state.start(from_date=source.last_update,
+                        until_date=timezone.now())
+
+        deadline = None
+        if max_duration is not None:
+            deadline = timezone.now() + max_duration
+        processed = 0
+        since_checkpoint = 0
+        # cursor of the page following the last one saved
+        saved_cursor = state.cursor
+        progress_date = None
+        try:
+            for page, next_cursor in self.iter_harvest_pages(state):
+                papers = self.save_doi_metadata_bulk(page)
+                Paper.update_index_bulk(papers)
+
+                saved_cursor = next_cursor
+                processed += len(page)
+                since_checkpoint += len(page)
+                progress_date = parse_crossref_date(page[-1].get('deposited'))
+                # (the cursor of the next page must not expire meanwhile)
+                wait_for_interactive_tasks(max_pause=BULK_CURSOR_MAX_PAUSE)
+                if since_checkpoint >= checkpoint_every:
+                    alias_counter.flush()
+                    state.checkpoint(saved_cursor, since_checkpoint, progress_date)
+                    since_checkpoint = 0
+
+                if ((max_records is not None and processed >= max_records) or
+                    (deadline is not None and timezone.now() > deadline)):
+                    alias_counter.flush()
+                    state.checkpoint(saved_cursor, since_checkpoint, progress_date)
+                    state.interrupt()
+                    return False
+        except BaseException:
+            state.checkpoint(saved_cursor, since_checkpoint, progress_date)
+            state.interrupt()
+            raise
+
+        alias_counter.flush()
+        state.checkpoint(saved_cursor, since_checkpoint, progress_date)
+        state.finish()
+        source.last_update = state.until_date
+        source.save()
+        return True
 
-        to_update = self.fetch_all_records(filters={'from-update-date':last_updated.date().isoformat()},
-                cursor=starting_cursor)
-        for record in to_update:
+    def iter_harvest_pages(self, state):
+        """
+        Yields the pages of CrossRef records covered by a harvest,
+        starting from its last checkpoint, as pairs
+        (list of records, cursor of the next page).
+
+        CrossRef cursors expire after a few minutes of inactivity:
+        if the checkpointed cursor is rejected, the harvest restarts
+        from the update date of the last record processed (records are
+        fetched by increasing update date, at a day granularity,
+        so a few records may be processed twice).
+        """
+        harvester = self.harvester_for_window(
+            state.from_date.date(), state.until_date.date(), state.cursor)
+        pages = harvester.iter_pages()
+        try:
+            page = next(pages)
+        except StopIteration:
+            return
+        except MetadataSourceException as e:
+            if not state.cursor or not state.progress_date:
+                raise
+            print('Cursor rejected by CrossRef, restarting from %s:\n%s' %
+                  (state.progress_date.isoformat(), unicode(e)))
+            harvester = self.harvester_for_window(
+                state.progress_date, state.until_date.date(), None)
+            pages = harvester.iter_pages()
             try:
-                bare_paper = self.save_doi_metadata(record)
-                p = Paper.from_bare(bare_paper)
-                p.update_index()
-            except ValueError as e:
-                print(e)
+                page = next(pages)
+            except StopIteration:
+                return
 
-        source.last_update = datetime.datetime.now()
-        source.save()
+        while True:
+            yield page, harvester.next_cursor
+            try:
+                page = next(pages)
+            except StopIteration:
+                return
+
+    def harvester_for_window(self, from_date, until_date, cursor):
+        """
+        A harvester for the records updated between two dates (inclusive),
+        by increasing update date.
+        """
+        return CrossRefHarvester(
+            filters={'from-update-date':from_date.isoformat(),
+                     'until-update-date':until_date.isoformat()},
+            cursor=cursor or '*',
+            sort='updated')
 
 
@@ -0,0 +1,238 @@
+# -*- encoding: utf-8 -*-
+
+# Dissemin: open access policy enforcement tool
+# Copyright (C) 2014 Antonin Delpeuch
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+from __future__ import unicode_literals
+
+import gzip
+from io import BytesIO
+import json
+from multiprocessing import cpu_count
+from multiprocessing import Pool
+import tarfile
+import threading
+import time
+
+from backend.crossref import add_publication
+from backend.crossref import create_bare_paper
+from backend.crossref import get_publication_fields
+from backend.queues import wait_for_interactive_tasks
+from backend.romeo import resolution_cache_report
+from django.db import connections
+from papers.models import Paper
+from publishers.models import alias_counter
+
+######## CrossRef dumps ###########
+#
+# CrossRef distributes snapshots of its metadata, which are much faster
+# to load than harvesting their REST API. We support two formats:
+#
+# - JSON-lines files (possibly gzipped): one CrossRef record per line;
+# - tarballs of JSON files (such as the public data files), where each
+#   file is either a single record, or a list of records under 'items'
+#   (possibly itself in a 'message', as in the responses of the API).
+#   Members of the tarball can also be (gzipped) JSON-lines files.
+#
+# Parsing the JSON and converting the records to bare papers is done by
+# a pool of worker processes, which do not access the database. The main
+# process resolves journals and publishers and saves the papers in bulk.
+#
+
+# Number of lines of JSON-lines files sent to a worker at once
+dump_chunk_size = 500
+# Number of papers saved at once
+dump_batch_size = 1000
+# Number of chunks read in advance, per worker
+dump_chunks_per_worker = 4
+# Number of records between two progress reports
+dump_report_interval = 10000
+
+
+def iter_dump_chunks(filename, chunk_size=dump_chunk_size):
+    """
+    Reads a dump from the disk, yielding lists of JSON documents
+    (as strings) to be parsed by :func:`parse_dump_chunk`.
+    """
+    if tarfile.is_tarfile(filename):
+        with tarfile.open(filename, 'r:*') as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                name = member.name
+                content = tar.extractfile(member).read()
+                if name.endswith('.gz'):
+                    name = name[:-3]
+                    content = gzip.GzipFile(fileobj=BytesIO(content)).read()
+                if name.endswith('.jsonl'):
+                    for chunk in iter_line_chunks(BytesIO(content), chunk_size):
+                        yield chunk
+                elif name.endswith('.json'):
+                    yield [content]
+    else:
+        opener = gzip.open if filename.endswith('.gz') else open
+        with opener(filename, 'rb') as f:
+            for chunk in iter_line_chunks(f, chunk_size):
+                yield chunk
+
+
+def iter_line_chunks(f, chunk_size):
+    chunk = []
+    for line in f:
+        line = line.strip()
+        if not line:
+            continue
+        chunk.append(line)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def dump_items(js):
+    """
+    The CrossRef records contained in a JSON document of a dump.
+    """
+    if 'message' in js:
+        js = js['message']
+    if 'items' in js:
+        return js['items']
+    return [js]
+
+
+def parse_dump_chunk(documents):
+    """
+    Converts JSON documents from a dump to bare papers.
+    This runs in the worker processes and does not access the database.
+
+    :returns: a pair: the list of (bare paper, publication fields)
+        and the number of invalid records
+    """
+    results = []
+    invalid = 0
+    for document in documents:
+        try:
+            js = json.loads(document)
+        except ValueError:
+            invalid += 1
+            continue
+        for metadata in dump_items(js):
+            try:
+                paper = create_bare_paper(metadata)
+                results.append((paper, get_publication_fields(metadata)))
+            except (ValueError, KeyError, TypeError):
+                invalid += 1
+    return results, invalid
+
+
+class CrossRefDumpLoader(object):
+    """
+    Loads a CrossRef dump into the database.
+    """
+
+    def __init__(self, workers=None, chunk_size=dump_chunk_size,
+                 batch_size=dump_batch_size):
+        """
+        :param workers: the number of worker processes parsing the
+            dump (defaults to the number of CPUs)
+        :param chunk_size: the number of lines sent to a worker at once
+        :param batch_size: the number of papers saved at once
+        """
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.records = 0
+        self.invalid = 0
+        self.saved = 0
+        self.start_time = None
+
+    def load(self, filename):
+        """
+        Loads the dump stored in the given file.
+        """
+        # Database connections should not be shared with the workers
+        # (they do not use them, but would inherit them when forking)
+        for connection in connections.all():
+            if not connection.in_atomic_block:
+                connection.close()
+        workers = self.workers or cpu_count()
+        pool = Pool(workers)
+        # Pool.imap reads its input as fast as it can: we bound the
+        # number of chunks in memory with a semaphore.
+        in_flight = threading.BoundedSemaphore(
+            dump_chunks_per_worker * workers)
+        stop = threading.Event()
+
+        def chunks():
+            for chunk in iter_dump_chunks(filename, self.chunk_size):
+                # (not blocking, so that the pool can be terminated)
+                while not in_flight.acquire(False):
+                    if stop.is_set():
+                        return
+                    time.sleep(0.01)
+                yield chunk
+
+        self.start_time = time.time()
+        last_report = 0
+        batch = []
+        try:
+            for results, invalid in pool.imap(parse_dump_chunk, chunks()):
+                in_flight.release()
+                self.records += len(results) + invalid
+                self.invalid += invalid
+                batch.extend(results)
+                if len(batch) >= self.batch_size:
+                    self.save_batch(batch)
+                    batch = []
+                if self.records - last_report >= dump_report_interval:
+                    print(self.report())
+                    last_report = self.records
+            self.save_batch(batch)
+            alias_counter.flush()
+            pool.close()
+        finally:
+            stop.set()
+            pool.terminate()
+        print(self.report())
+        print(resolution_cache_report())
+
+    def save_batch(self, batch):
+        """
+        Saves a list of (bare paper, publication fields) produced by the workers.
+        """
+        if not batch:
+            return
+        wait_for_interactive_tasks()
+        papers = [add_publication(paper, None, fields)
+                  for paper, fields in batch]
+        saved = Paper.bulk_from_bare(papers)
+        Paper.update_index_bulk(saved)
+        self.saved += len(saved)
+
+    def records_per_second(self):
+        if not self.start_time:
+            return 0.
+        elapsed = time.time() - self.start_time
+        if not elapsed:
+            return 0.
+        return self.records / elapsed
+
+    def report(self):
+        return '%d records read, %d invalid, %d papers saved (%.1f records/s)' % (
+            self.records, self.invalid, self.saved, self.records_per_second())
@@ -0,0 +1,193 @@
+# -*- encoding: utf-8 -*-
+
+# Dissemin: open access policy enforcement tool
+# Copyright (C) 2014 Antonin Delpeuch
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+from __future__ import unicode_literals
+
+import json
+import zlib
+
+from bulk_update.helper import bulk_update
+from dissemin.settings import DOI_METADATA_CACHE_MAX_ENTRIES
+from dissemin.settings import DOI_METADATA_CACHE_TTL
+from django.db import IntegrityError
+from django.db import transaction
+from django.utils import timezone
+from papers.models import DoiMetadata
+
+# Number of DOIs stored between two checks of the size of the store
+# (counting the rows of a large table is not free)
+eviction_check_interval = 10000
+
+
+def compress_metadata(metadata):
+    """
+    Serializes citeproc metadata for storage
+    """
+    return zlib.compress(json.dumps(metadata))
+
+
+def decompress_metadata(blob):
+    """
+    Reverse of :func:`compress_metadata`. Returns None if
+    the blob cannot be decoded.
+    """
+    try:
+        return json.loads(zlib.decompress(bytes(blob)))
+    except (zlib.error, ValueError):
+        return None
+
+
+class DoiMetadataStore(object):
+    """
+    A persistent DOI → citeproc metadata store, kept in the
+    :class:`DoiMetadata` table so that it is shared by all the workers.
+
+    Entries older than `ttl` are considered stale: callers should
+    refresh them from CrossRef or the DOI proxy, but can still use them
+    when these services are unavailable.
+    When the store grows over `max_entries`, the least recently
+    accessed entries are evicted.
+
+    DOIs are case-insensitive, so they are stored in lowercase.
+    """
+
+    def __init__(self, ttl=DOI_METADATA_CACHE_TTL,
+                 max_entries=DOI_METADATA_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.stale = 0
+        self.misses = 0
+        self.stored_since_check = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def get_many(self, dois):
+        """
+        Looks up a list of DOIs in the store.
+
+        :param dois: the list of DOIs to look up (Nones are ignored)
+        :returns: a pair of dicts (fresh, stale), mapping the lowercase
+            DOIs found in the store to their metadata.
+        """
+        fresh = {}
+        stale = {}
+        keys = set(doi.lower() for doi in dois if doi)
+        if not self.enabled or not keys:
+            return fresh, stale
+
+        now = timezone.now()
+        fresh_ids = []
+        for pk, doi, blob, last_fetched in DoiMetadata.objects.filter(
+                doi__in=keys).values_list(
+                'pk', 'doi', 'compressed_json', 'last_fetched'):
+            metadata = decompress_metadata(blob)
+            if metadata is None:
+                continue
+            if now - last_fetched > self.ttl:
+                stale[doi] = metadata
+            else:
+                fresh[doi] = metadata
+                fresh_ids.append(pk)
+
+        if fresh_ids:
+            DoiMetadata.objects.filter(
+                pk__in=fresh_ids).update(last_accessed=now)
+
+        self.hits += len(fresh)
+        self.stale += len(stale)
+        self.misses += len(keys) - len(fresh) - len(stale)
+        return fresh, stale
+
+    def put_many(self, items):
+        """
+        Stores (or refreshes) metadata records in the store.
+
+        :param items: a list of citeproc records, indexed by their
+            'DOI' field (Nones and records without DOI are ignored)
+        """
+        if not self.enabled:
+            return
+        blobs = {}
+        for item in items:
+            if item and item.get('DOI'):
+                blobs[item['DOI'].lower()] = compress_metadata(item)
+        if not blobs:
+            return
+
+        now = timezone.now()
+        existing = list(DoiMetadata.objects.filter(
+            doi__in=blobs.keys()).only('pk', 'doi'))
+        for entry in existing:
+            entry.compressed_json = blobs.pop(entry.doi)
+            entry.last_fetched = now
+            entry.last_accessed = now
+        if existing:
+            bulk_update(existing, update_fields=[
+                'compressed_json', 'last_fetched', 'last_accessed'])
+
+        try:
+            with transaction.atomic():
+                DoiMetadata.objects.bulk_create([
+                    DoiMetadata(doi=doi, compressed_json=blob,
+                                last_fetched=now, last_accessed=now)
+                    for doi, blob in blobs.items()])
+        except IntegrityError:
+            # another worker stored the same DOIs in the meantime
+            pass
+
+        self.stored_since_check += len(existing) + len(blobs)
+        if self.stored_since_check >= eviction_check_interval:
+            self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently accessed entries so that
+        the store does not exceed `max_entries`.
+
+        :returns: the number of entries removed
+        """
+        self.stored_since_check = 0
+        excess = DoiMetadata.objects.count() - self.max_entries
+        if excess <= 0:
+            return 0
+        ids = list(DoiMetadata.objects.order_by(
+            'last_accessed').values_list('pk', flat=True)[:excess])
+        DoiMetadata.objects.filter(pk__in=ids).delete()
+        return len(ids)
+
+    def hit_ratio(self):
+        """
+        The proportion of lookups served from fresh entries.
+        """
+        total = self.hits + self.stale + self.misses
+        if not total:
+            return 0.
+        return float(self.hits) / total
+
+    def report(self):
+        return '%d hits, %d stale, %d misses (hit ratio: %.1f%%)' % (
+            self.hits, self.stale, self.misses, 100*self.hit_ratio())
+
+
+#! The store used by :mod:`backend.crossref`
+doi_metadata_store = DoiMetadataStore()
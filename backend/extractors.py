@@ -25,6 +25,10 @@ from papers.doi import to_doi
 from backend.doiprefixes import free_doi_prefixes
 
 class URLExtractor(object):
+    """
+    Extractors are shared by all the records of a source (and by the
+    threads ingesting them), so they do not keep any per-record state.
+    """
 
     def __init__(self):
         """
@@ -37,17 +41,26 @@ class URLExtractor(object):
         containing some keys among ['pdf', 'splash'] and
         whose values are respectively the PDF URL and splash URL
         """
-        self.header = header
-        self.metadata = metadata
-        return self._post_filter(self._urls())
+        return self._post_filter(header, metadata,
+                                 self._urls(header, metadata))
 
-    def _urls(self):
+    def extract_many(self, records):
+        """
+        Extracts the URLs of a list of (header, metadata) pairs.
+
+        :returns: the list of the dicts returned by :meth:`extract`,
+            in the same order
+        """
+        extract = self.extract
+        return [extract(header, metadata) for header, metadata in records]
+
+    def _urls(self, header, metadata):
         """
         Does the actual extraction job.
         """
         return dict()
 
-    def _post_filter(self, urls):
+    def _post_filter(self, header, metadata, urls):
         """
         Filters the URLs according to the record.
         Reimplement if you want to filter the results of a predefined filter.
@@ -60,19 +73,55 @@ class RegexExtractor(URLExtractor):
     def __init__(self, mappings):
         """
         mappings: list of (field,regex,resource_type,skeleton)
+
+        When several mappings match, the last one wins (and for a given
+        mapping, the last matching value of the field).
         """
         super(RegexExtractor, self).__init__()
         self.mappings = mappings
+        self.dispatch = self._compile(mappings)
 
-    def _urls(self):
+    @staticmethod
+    def _compile(mappings):
+        """
+        Builds the dispatch table of the extractor: for each field,
+        a combined pattern finding in one pass which of the mappings
+        of the field match a value, and these mappings.
+        Each regex is wrapped in a lookahead (which is allowed not to
+        match), so that they are all tried at the start of the value.
+        """
+        fields = []
+        by_field = {}
+        for index, (field, regex, resource_type, skeleton) in enumerate(mappings):
+            if field not in by_field:
+                fields.append(field)
+                by_field[field] = []
+            by_field[field].append((index, regex, skeleton))
+
+        dispatch = []
+        for field in fields:
+            combined = re.compile(''.join(
+                '(?:(?=(?P<m%d>%s))|)' % (index, regex.pattern)
+                for index, regex, skeleton in by_field[field]))
+            dispatch.append((field, combined,
+                             [('m%d' % index, index, regex, skeleton)
+                              for index, regex, skeleton in by_field[field]]))
+        return dispatch
+
+    def _urls(self, header, metadata):
+        # URL found by each mapping
+        found = {}
+        for field, combined, mappings in self.dispatch:
+            for val in metadata.get(field, []):
+                val = val.strip()
+                match = combined.match(val)
+                for group, index, regex, skeleton in mappings:
+                    if match.group(group) is not None:
+                        found[index] = regex.sub(skeleton, val)
 
         urls = dict()
-        for (field, regex, resource_type, skeleton) in self.mappings:
-            for val in self.metadata[field]:
-                val = val.strip()
-                match = regex.match(val)
-                if match:
-                    urls[resource_type] = regex.sub(skeleton, val)
+        for index in sorted(found):
+            urls[self.mappings[index][2]] = found[index]
         return urls
 
 
@@ -81,8 +130,8 @@ class CairnExtractor(RegexExtractor):
     def __init__(self, mappings):
         super(CairnExtractor, self).__init__(mappings)
 
-    def _post_filter(self, urls):
-        if not 'free access' in self.metadata.get('accessRights'):
+    def _post_filter(self, header, metadata, urls):
+        if not 'free access' in metadata.get('accessRights', []):
             urls['pdf'] = None
         return urls
 
@@ -92,8 +141,8 @@ class OpenAireExtractor(RegexExtractor):
     def __init__(self, mappings):
         super(OpenAireExtractor, self).__init__(mappings)
 
-    def _post_filter(self, urls):
-        if 'info:eu-repo/semantics/openAccess' in self.metadata.get('rights', []):
+    def _post_filter(self, header, metadata, urls):
+        if 'info:eu-repo/semantics/openAccess' in metadata.get('rights', []):
             urls['pdf'] = urls.get('splash')
         return urls
 
@@ -107,15 +156,15 @@ class BaseExtractor(RegexExtractor):
     def __init__(self, mappings):
         super(BaseExtractor, self).__init__(mappings)
 
-    def _post_filter(self, urls):
-        if '1' in self.metadata.get('oa', []):
+    def _post_filter(self, header, metadata, urls):
+        if '1' in metadata.get('oa', []):
             urls['pdf'] = urls.get('splash')
 
         # Special case for PMC as their metadata includes other urls
-        pmc_match = pmc_id_re.match(self.header.identifier())
-        if pmc_match:
+        identifier = header.identifier()
+        if identifier.startswith('ftpubmed:') and pmc_id_re.match(identifier):
             pmc_url = None
-            for u in self.metadata.get('identifier',[]):
+            for u in metadata.get('identifier',[]):
                 # rationale : PMC urls are prioritary
                 # but PMID urls can be used when no PMC url is provided
                 # (because we know they link to PMC eventually, from the
@@ -127,8 +176,9 @@ class BaseExtractor(RegexExtractor):
             urls['pdf'] = pmc_url
 
         # Special case for DOIs
-        if urls.get('splash'):
-            doi = to_doi(urls.get('splash'))
+        splash = urls.get('splash')
+        if splash:
+            doi = to_doi(splash)
             if doi:
                 doi_prefix = doi.split('/')[0]
                 if doi_prefix in free_doi_prefixes:
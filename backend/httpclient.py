@@ -0,0 +1,282 @@
+# -*- encoding: utf-8 -*-
+
+# Dissemin: open access policy enforcement tool
+# Copyright (C) 2014 Antonin Delpeuch
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+The HTTP client shared by all the modules querying external services.
+
+It keeps one pool of keep-alive connections per host, throttles the
+requests sent to each host (see the HTTP_RATE_LIMITS setting), retries
+failed requests with a jittered exponential backoff, and records
+latency and error metrics for each host.
+"""
+
+from __future__ import unicode_literals
+
+from collections import defaultdict
+import os
+import random
+import threading
+import time
+from urlparse import urlparse
+
+import requests
+import requests.exceptions
+from requests.adapters import HTTPAdapter
+
+from dissemin.settings import HTTP_RATE_LIMITS
+
+# Maximum number of connections kept open to each host
+http_pool_size = 10
+# Default timeout for requests (in seconds)
+http_timeout = 15
+# Default number of retries for failed requests
+http_max_retries = 2
+# Delay before the first retry (in seconds), doubled at each retry
+http_retry_delay = 1
+# Maximum delay between two retries (in seconds)
+http_max_retry_delay = 60
+# Status codes indicating that the request should be retried later
+http_retry_status_codes = set([429, 503])
+
+
+class TokenBucket(object):
+    """
+    A thread-safe token bucket: at most `capacity` requests can be made
+    at once, and the bucket refills at `rate` tokens per second.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = self.capacity
+        self.last_refill = time.time()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Takes a token from the bucket.
+
+        :returns: the number of seconds to wait before using it
+        """
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.
+            return -self.tokens / self.rate
+
+    def acquire(self):
+        """
+        Blocks until a token is available.
+        """
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class HostStats(object):
+    """
+    Latency and error counters for one host.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.total_latency = 0.
+        self.max_latency = 0.
+        self.lock = threading.Lock()
+
+    def record(self, latency, error=False):
+        with self.lock:
+            self.requests += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            if error:
+                self.errors += 1
+
+    def mean_latency(self):
+        if not self.requests:
+            return 0.
+        return self.total_latency / self.requests
+
+    def __unicode__(self):
+        return '%d requests, %d errors, %d retries, latency: %.3fs mean, %.3fs max' % (
+            self.requests, self.errors, self.retries,
+            self.mean_latency(), self.max_latency)
+
+
+class HttpClient(object):
+    """
+    A pooled, rate-limited HTTP client.
+
+    It exposes the same `get` and `post` methods as :mod:`requests`,
+    with two additional keyword arguments: `retries` (the number of
+    times the request is retried after a timeout, a connection error,
+    or a 429 or 503 response) and `delay` (the delay before the first
+    retry, in seconds).
+    """
+
+    def __init__(self, rate_limits=None, pool_size=http_pool_size,
+                 timeout=http_timeout, max_retries=http_max_retries,
+                 retry_delay=http_retry_delay):
+        """
+        :param rate_limits: a dict mapping host names to pairs
+            (requests per second, burst size). Other hosts are
+            not throttled.
+        """
+        self.rate_limits = rate_limits or {}
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.sessions = {}
+        self.buckets = {}
+        self.stats = defaultdict(HostStats)
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+
+    def session(self, host):
+        """
+        The session (and hence the connection pool) used for a host.
+        """
+        with self.lock:
+            if os.getpid() != self.pid:
+                # connections cannot be shared with the parent process
+                # (for instance after a fork by Celery)
+                self.sessions = {}
+                self.pid = os.getpid()
+            session = self.sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1,
+                                      pool_maxsize=self.pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self.sessions[host] = session
+            return session
+
+    def divide_rate_limits(self, factor):
+        """
+        Divides the rate (and the burst size) allowed for each host by
+        `factor`. This is used by the worker processes of a pool, which
+        all have their own client but share the limits of the services
+        they query.
+        """
+        with self.lock:
+            self.rate_limits = {
+                host: (float(rate) / factor, max(1., float(capacity) / factor))
+                for host, (rate, capacity) in self.rate_limits.items()}
+            self.buckets = {}
+
+    def bucket(self, host):
+        """
+        The token bucket used to throttle requests to a host,
+        or None if it is not rate-limited.
+        """
+        if host not in self.rate_limits:
+            return None
+        with self.lock:
+            bucket = self.buckets.get(host)
+            if bucket is None:
+                rate, capacity = self.rate_limits[host]
+                bucket = TokenBucket(rate, capacity)
+                self.buckets[host] = bucket
+            return bucket
+
+    def backoff_delay(self, attempt, delay):
+        """
+        Jittered exponential backoff: the delay before retry number
+        `attempt` (starting at 0) is drawn uniformly in
+        [0, delay * 2^attempt], capped by `http_max_retry_delay`.
+        """
+        return random.uniform(0, min(http_max_retry_delay, delay * 2**attempt))
+
+    def request(self, method, url, retries=None, delay=None, **kwargs):
+        """
+        Performs an HTTP request, with retries.
+
+        :returns: a :class:`requests.Response`. Responses with error
+            codes are returned, not raised, except when they are
+            retried: the last response is then returned.
+        :raises: :class:`requests.exceptions.RequestException` when
+            the request fails
+        """
+        if retries is None:
+            retries = self.max_retries
+        if delay is None:
+            delay = self.retry_delay
+        kwargs.setdefault('timeout', self.timeout)
+        host = urlparse(url).netloc
+        stats = self.stats[host]
+        bucket = self.bucket(host)
+
+        attempt = 0
+        while True:
+            if bucket is not None:
+                bucket.acquire()
+            start = time.time()
+            wait = None
+            try:
+                response = self.session(host).request(method, url, **kwargs)
+            except (requests.exceptions.Timeout,
+                    requests.exceptions.ConnectionError):
+                stats.record(time.time() - start, error=True)
+                if attempt >= retries:
+                    raise
+            else:
+                retry = response.status_code in http_retry_status_codes
+                stats.record(time.time() - start,
+                             error=retry or response.status_code >= 500)
+                if not retry or attempt >= retries:
+                    return response
+                retry_after = response.headers.get('Retry-After', '')
+                if retry_after.isdigit():
+                    wait = min(http_max_retry_delay, int(retry_after))
+
+            if wait is None:
+                wait = self.backoff_delay(attempt, delay)
+            with stats.lock:
+                stats.retries += 1
+            print "Retrying in %.1f seconds..." % wait
+            print "URL: "+url
+            time.sleep(wait)
+            attempt += 1
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault('allow_redirects', True)
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self.request('POST', url, data=data, **kwargs)
+
+    def report(self):
+        """
+        Returns the metrics of all hosts queried so far, as a string.
+        """
+        return '\n'.join('%s: %s' % (host, unicode(stats))
+                         for host, stats in sorted(self.stats.items()))
+
+
+#! The client shared by all modules
+http_client = HttpClient(rate_limits=HTTP_RATE_LIMITS)
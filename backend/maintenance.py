@@ -32,6 +32,14 @@ from __future__ import unicode_literals
 
 from bulk_update.helper import bulk_update
 
+import gc
+import json
+import resource
+import threading
+import time
+from backend.extractors import REGISTERED_OAI_EXTRACTORS
+from backend.oai import OaiPaperSource
+from backend.oai import StreamedPage
 from papers.models import Name
 from papers.models import NameVariant
 from papers.models import Paper
@@ -43,6 +51,7 @@ from time import sleep
 import haystack
 from haystack.exceptions import SkipDocument
 from haystack.constants import ID
+from oaipmh.common import Header
 
 def update_index_for_model(model, batch_size=256, batches_per_commit=10, firstpk=0):
     """
@@ -256,3 +265,115 @@ def report_dubious_orcids():
                     a.orcid,
                 ])+'\n')
 
+
+def current_memory():
+    """
+    The resident memory of the current process, in kB (Linux only)
+    """
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 1024
+
+
+def peak_memory_increase(f):
+    """
+    Runs f while sampling the memory used by the process.
+
+    :returns: the peak increase of the resident memory, in kB
+    """
+    gc.collect()
+    start = current_memory()
+    peak = [start]
+    done = threading.Event()
+
+    def sample():
+        while not done.is_set():
+            peak[0] = max(peak[0], current_memory())
+            time.sleep(0.002)
+
+    sampler = threading.Thread(target=sample)
+    sampler.start()
+    try:
+        f()
+    finally:
+        done.set()
+        sampler.join()
+    return max(peak[0], current_memory()) - start
+
+
+def benchmark_oai_readers(filename, metadataPrefix='oai_dc', repeat=20):
+    """
+    Compares the throughput and the memory used to read the records of
+    a ListRecords page with pyoai and with :class:`backend.oai.StreamedPage`.
+
+    :param filename: a ListRecords response saved from an OAI-PMH endpoint
+        (devutils/sample_oai_page1.xml is a small example, larger pages
+        give more meaningful results)
+    :param metadataPrefix: the format of the records
+    :param repeat: the number of times the page is read
+    """
+    source = OaiPaperSource(endpoint='http://doai.io/oai')
+    client = source.client
+    with open(filename, 'rb') as f:
+        xml = f.read()
+
+    def read_with_pyoai():
+        records, token = client.buildRecords(metadataPrefix,
+            client.getNamespaces(), source.registry, client.parse(xml))
+        return sum(1 for header, metadata, about in records)
+
+    def read_streaming():
+        page = StreamedPage(xml, metadataPrefix, source.registry)
+        return sum(1 for header, metadata, about in page)
+
+    for name, reader in [('pyoai', read_with_pyoai),
+                         ('streaming', read_streaming)]:
+        memory = peak_memory_increase(reader)
+        start = time.time()
+        nb_records = 0
+        for i in range(repeat):
+            nb_records += reader()
+        rate = nb_records / (time.time() - start)
+        print "%s: %d records/s, peak memory increase: %d kB" % (
+            name, rate, memory)
+
+
+def benchmark_extractors(filename='devutils/sample_extractor_records.json',
+                         repeat=2000):
+    """
+    Measures the throughput of the URL extractors (see
+    :mod:`backend.extractors`), record by record and by batches.
+
+    :param filename: a JSON list of records, each with the identifier
+        of its source, its OAI identifier and its metadata (as a dict
+        of lists, like pyoai returns them)
+    :param repeat: the number of times the records are extracted
+    """
+    with open(filename, 'rb') as f:
+        samples = json.load(f)
+    by_source = {}
+    for sample in samples:
+        header = Header(None, sample['identifier'], None, [], False)
+        by_source.setdefault(sample['source'], []).append(
+            (header, sample['metadata']))
+
+    total = {'single': 0., 'batch': 0.}
+    nb_records = 0
+    for source, records in sorted(by_source.items()):
+        extractor = REGISTERED_OAI_EXTRACTORS[source]
+        start = time.time()
+        for i in range(repeat):
+            for header, metadata in records:
+                extractor.extract(header, metadata)
+        single = time.time() - start
+        start = time.time()
+        for i in range(repeat):
+            extractor.extract_many(records)
+        batch = time.time() - start
+        count = repeat * len(records)
+        print "%s: %d records/s, %d records/s by batches" % (
+            source, count / single, count / batch)
+        total['single'] += single
+        total['batch'] += batch
+        nb_records += count
+    print "all sources: %d records/s, %d records/s by batches" % (
+        nb_records / total['single'], nb_records / total['batch'])
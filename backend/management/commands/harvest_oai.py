@@ -0,0 +1,60 @@
+# -*- encoding: utf-8 -*-
+
+# Dissemin: open access policy enforcement tool
+# Copyright (C) 2014 Antonin Delpeuch
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+from __future__ import unicode_literals
+
+from backend.oaiharvester import configured_endpoints
+from backend.oaiharvester import endpoint_status
+from backend.oaiharvester import OaiHarvestScheduler
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = ('Harvests the OAI-PMH endpoints listed in '
+            'settings.OAI_HARVEST_ENDPOINTS, concurrently')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--status', action='store_true',
+            help='Only show how far behind each endpoint the harvests are')
+        parser.add_argument('--max-endpoints', type=int,
+            help='Number of endpoints harvested at once')
+        parser.add_argument('--max-writers', type=int,
+            help='Number of harvests writing to the database at once')
+        parser.add_argument('--batch-size', type=int,
+            help='Save the records by batches of that size')
+        parser.add_argument('--force', action='store_true',
+            help='Ingest all the records, even the unchanged ones')
+
+    def handle(self, *args, **options):
+        endpoints = configured_endpoints()
+        if options['status']:
+            for endpoint, state, lagging in endpoint_status(endpoints):
+                self.stdout.write('%s %s (%s), last success: %s, lag: %s' % (
+                    'LAGGING' if lagging else 'ok     ',
+                    endpoint.endpoint, state.status,
+                    state.last_success, state.lag()))
+            return
+
+        scheduler = OaiHarvestScheduler(endpoints,
+                                        max_endpoints=options['max_endpoints'],
+                                        max_writers=options['max_writers'],
+                                        batch_size=options['batch_size'])
+        scheduler.run(force=options['force'])
+        self.stdout.write(scheduler.report())
@@ -0,0 +1,59 @@
+# -*- encoding: utf-8 -*-
+
+# Dissemin: open access policy enforcement tool
+# Copyright (C) 2014 Antonin Delpeuch
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+from __future__ import unicode_literals
+
+from datetime import timedelta
+
+from backend.crossref import crossref_checkpoint_interval
+from backend.crossref import CrossRefAPI
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Ingests the CrossRef records updated since the last ingestion'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--resume', action='store_true',
+            help='Continue the last interrupted ingestion from its last checkpoint')
+        parser.add_argument('--checkpoint-every', type=int,
+            default=crossref_checkpoint_interval,
+            help='Number of records between two checkpoints')
+        parser.add_argument('--max-records', type=int,
+            help='Stop after processing that many records')
+        parser.add_argument('--max-minutes', type=int,
+            help='Stop after that many minutes')
+
+    def handle(self, *args, **options):
+        max_duration = None
+        if options['max_minutes']:
+            max_duration = timedelta(minutes=options['max_minutes'])
+
+        completed = CrossRefAPI().fetch_and_save_new_records(
+            resume=options['resume'],
+            checkpoint_every=options['checkpoint_every'],
+            max_records=options['max_records'],
+            max_duration=max_duration)
+
+        if completed:
+            self.stdout.write('CrossRef ingestion completed.')
+        else:
+            self.stdout.write('CrossRef ingestion stopped, '
+                              'run again with --resume to continue.')
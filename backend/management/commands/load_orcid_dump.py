@@ -0,0 +1,54 @@
+# -*- encoding: utf-8 -*-
+
+# Dissemin: open access policy enforcement tool
+# Copyright (C) 2014 Antonin Delpeuch
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+from __future__ import unicode_literals
+
+from backend.orciddump import orcid_dump_batch_size
+from backend.orciddump import orcid_dump_chunk_size
+from backend.orciddump import OrcidDumpLoader
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = ('Loads a dump of ORCID profiles (a directory of JSON files) '
+            'into the database')
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory')
+        parser.add_argument('--resume', action='store_true',
+            help='Continue the last interrupted import of this directory')
+        parser.add_argument('--no-papers', action='store_true',
+            help='Only create the researchers, without importing their works')
+        parser.add_argument('--use-doi', action='store_true',
+            help='Fetch the works with a DOI from CrossRef')
+        parser.add_argument('--workers', type=int,
+            help='Number of processes parsing the profiles (default: number of CPUs)')
+        parser.add_argument('--chunk-size', type=int, default=orcid_dump_chunk_size,
+            help='Number of profiles sent to a worker at once')
+        parser.add_argument('--batch-size', type=int, default=orcid_dump_batch_size,
+            help='Number of papers saved at once')
+
+    def handle(self, *args, **options):
+        loader = OrcidDumpLoader(workers=options['workers'],
+                                 chunk_size=options['chunk_size'],
+                                 batch_size=options['batch_size'],
+                                 fetch_papers=not options['no_papers'],
+                                 use_doi=options['use_doi'])
+        loader.load(options['directory'], resume=options['resume'])
@@ -0,0 +1,46 @@
+# -*- encoding: utf-8 -*-
+
+# Dissemin: open access policy enforcement tool
+# Copyright (C) 2014 Antonin Delpeuch
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+from __future__ import unicode_literals
+
+from backend.refresh import ResearcherRefreshScheduler
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = ('Enqueues the next chunk of background refreshes of researchers '
+            '(this is normally done by celery beat)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--status', action='store_true',
+            help='Only show the number of refreshes due and the ETA')
+        parser.add_argument('--chunk-size', type=int,
+            help='Maximum number of refreshes enqueued')
+        parser.add_argument('--max-running', type=int,
+            help='Maximum number of refreshes queued or running at once')
+
+    def handle(self, *args, **options):
+        scheduler = ResearcherRefreshScheduler(
+            chunk_size=options['chunk_size'],
+            max_running=options['max_running'])
+        if not options['status']:
+            researchers = scheduler.run()
+            self.stdout.write('%d refreshes enqueued' % len(researchers))
+        self.stdout.write(scheduler.report())
@@ -20,17 +20,42 @@
 
 from __future__ import unicode_literals
 
+from collections import deque
 from datetime import datetime
+from io import BytesIO
+from itertools import islice
 import json
-
+from multiprocessing import cpu_count
+from multiprocessing import Pool
+import Queue
+import re
+import threading
+import time
+from xml.sax.saxutils import unescape
+
+from backend.crossref import add_publication
+from backend.crossref import create_bare_paper
 from backend.crossref import CrossRefAPI
+from backend.crossref import get_publication_fields
 from backend.extractors import REGISTERED_OAI_EXTRACTORS
+from backend.httpclient import TokenBucket
+from backend.oaidigests import get_digests
+from backend.oaidigests import metadata_digest
+from backend.oaidigests import store_digests
 from backend.papersource import PaperSource
 from backend.pubtype_translations import OAI_PUBTYPE_TRANSLATIONS
+from backend.queues import wait_for_interactive_tasks
 from django.conf import settings
+from django.db import connections
+from django.db import DatabaseError
 from django.db import transaction
+from django.utils import timezone
+from lxml import etree
 from oaipmh import common
+import oaipmh.error
 from oaipmh.client import Client
+from oaipmh.datestamp import datestamp_to_datetime
+from oaipmh.datestamp import datetime_to_datestamp
 from oaipmh.error import DatestampError
 from oaipmh.error import NoRecordsMatchError
 from oaipmh.metadata import base_dc_reader
@@ -40,7 +65,10 @@ from oaipmh.metadata import oai_dc_reader
 from papers.baremodels import BareName
 from papers.baremodels import BareOaiRecord
 from papers.baremodels import BarePaper
-from papers.doi import to_doi
+from papers.doi import find_dois
+from papers.models import HarvestState
+from papers.models import oai_sources
+from papers.models import OaiRecord
 from papers.models import OaiSource
 from papers.models import Paper
 from papers.name import parse_comma_name
@@ -51,6 +79,38 @@ from papers.utils import valid_publication_date
 # Set exposed by proaixy to indicate the metadata source
 PROXY_SOURCE_PREFIX = "proaixy:source:"
 
+# Number of pages downloaded in advance by the pipelined ingestion
+oai_prefetched_pages = 4
+# Number of pages being translated at once, per worker
+oai_pages_per_worker = 2
+# Number of papers saved at once by the pipelined ingestion
+oai_batch_size = 500
+# Number of records between two rate reports
+oai_report_interval = 1000
+
+# Namespace of the OAI-PMH envelope
+OAI_NAMESPACE = 'http://www.openarchives.org/OAI/2.0/'
+# Namespaces of the metadata formats, used to find the format of
+# the records harvested with metadataPrefix=any (records without
+# any element in their metadata are in the citeproc format)
+METADATA_FORMAT_NAMESPACES = {
+    'http://www.openarchives.org/OAI/2.0/oai_dc/': 'oai_dc',
+    'http://oai.base-search.net/base_dc/': 'base_dc',
+}
+
+oai_error_re = re.compile(r'<(?:[\w-]+:)?error[^>]*code="(\w+)"')
+resumption_token_re = re.compile(
+    r'<(?:[\w-]+:)?resumptionToken[^>]*>([^<]*)</(?:[\w-]+:)?resumptionToken>')
+record_identifier_re = re.compile(
+    r'<(?:[\w-]+:)?header[^>]*>\s*<(?:[\w-]+:)?identifier>([^<]*)</')
+
+def oai_harvest_name(endpoint, metadataPrefix):
+    """
+    The name of the :class:`HarvestState` recording the progress
+    of the harvests of an endpoint in the given format.
+    """
+    return 'oai:%s:%s' % (endpoint, metadataPrefix)
+
 def get_proaixy_instance():
     proaixy = OaiPaperSource(endpoint='http://doai.io/oai')
     proaixy.add_translator(BASEDCTranslator())
@@ -80,6 +140,35 @@ class OaiTranslator(object):
         """
         raise NotImplementedError()
 
+    def prepare(self, header, metadata):
+        """
+        First half of the translation, used by the pipelined ingestion
+        (see :meth:`OaiPaperSource.process_pages`). This runs in worker
+        processes, so it should not query the database (the OAI sources
+        are served by :data:`papers.models.oai_sources`), and its result
+        should be picklable.
+
+        :returns: an object to be passed to :meth:`complete`, or None
+            if the record is invalid
+        """
+        return self.translate(header, metadata)
+
+    def complete(self, prepared):
+        """
+        Second half of the translation, run by the process saving the
+        papers.
+
+        :returns: a :class:`BarePaper` or None if creation failed
+        """
+        return prepared
+
+    def start_page(self):
+        """
+        Called before translating the records of a new page, to reset
+        what the translator remembers about the previous one.
+        """
+        pass
+
 
 class CiteprocReader(MetadataReader):
 
@@ -96,6 +185,128 @@ class CiteprocReader(MetadataReader):
 citeproc_reader = CiteprocReader()
 
 
+def oai_tag(name):
+    return '{%s}%s' % (OAI_NAMESPACE, name)
+
+
+def raise_oai_error(error):
+    """
+    Raises the pyoai exception corresponding to an OAI-PMH error element
+    (except for noRecordsMatch, which is not an error for us)
+    """
+    code = error.get('code') or 'unknown'
+    if code == 'noRecordsMatch':
+        return
+    exception = getattr(oaipmh.error,
+                        code[0].upper() + code[1:] + 'Error',
+                        oaipmh.error.UnknownError)
+    raise exception(error.text)
+
+
+class StreamedHeader(object):
+    """
+    The header of a record read by :class:`StreamedPage`
+    (it has the same interface as the headers of pyoai).
+    """
+
+    def __init__(self, element, metadata_format):
+        self._element = element
+        self._format = metadata_format
+        self._identifier = (element.findtext(oai_tag('identifier')) or '').strip()
+        datestamp = (element.findtext(oai_tag('datestamp')) or '').strip()
+        self._datestamp = datestamp_to_datetime(datestamp) if datestamp else None
+        self._setspec = [(s.text or '').strip()
+                         for s in element.findall(oai_tag('setSpec'))]
+        self._deleted = element.get('status') == 'deleted'
+
+    def element(self):
+        return self._element
+
+    def identifier(self):
+        return self._identifier
+
+    def datestamp(self):
+        return self._datestamp
+
+    def setSpec(self):
+        return self._setspec
+
+    def isDeleted(self):
+        return self._deleted
+
+    def format(self):
+        return self._format
+
+
+class StreamedPage(object):
+    """
+    A page returned by the ListRecords verb, read incrementally
+    with lxml's iterparse: pyoai builds the tree of the whole page
+    before reading the records, whereas the elements of the records
+    are freed here as soon as they have been processed, so the memory
+    used does not depend on the number of records in the page.
+
+    Iterating over the page yields (header, metadata, None) triples,
+    like pyoai. The resumption token of the page is available once
+    all the records have been read.
+    """
+
+    def __init__(self, xml, metadataPrefix, registry):
+        """
+        :param xml: the XML response, as a string or a file
+        :param metadataPrefix: the format of the records
+            ('any' to find it from each record)
+        :param registry: the :class:`MetadataRegistry` used to read
+            the metadata
+        """
+        self.xml = xml
+        self.metadata_prefix = metadataPrefix
+        self.registry = registry
+        #! the resumption token of the page, once it has been read
+        self.resumption_token = None
+
+    def __iter__(self):
+        source = self.xml
+        if isinstance(source, unicode):
+            source = source.encode('utf-8')
+        if isinstance(source, bytes):
+            source = BytesIO(source)
+        tags = (oai_tag('record'), oai_tag('resumptionToken'), oai_tag('error'))
+        for event, element in etree.iterparse(source, events=('end',),
+                                              tag=tags, huge_tree=True):
+            if element.tag == oai_tag('record'):
+                yield self.read_record(element)
+            elif element.tag == oai_tag('resumptionToken'):
+                self.resumption_token = (element.text or '').strip() or None
+            else:
+                raise_oai_error(element)
+            # free the elements read so far
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+    def read_record(self, element):
+        header_node = element.find(oai_tag('header'))
+        metadata_node = element.find(oai_tag('metadata'))
+        metadata_format = self.metadata_prefix
+        if metadata_format == 'any':
+            metadata_format = self.find_format(metadata_node)
+        header = StreamedHeader(header_node, metadata_format)
+        metadata = None
+        if (metadata_node is not None and metadata_format is not None and
+                not header.isDeleted()):
+            metadata = self.registry.readMetadata(metadata_format, metadata_node)
+        return header, metadata, None
+
+    def find_format(self, metadata_node):
+        if metadata_node is None:
+            return None
+        children = list(metadata_node)
+        if not children:
+            return 'citeproc'
+        return METADATA_FORMAT_NAMESPACES.get(etree.QName(children[0]).namespace)
+
+
 class CiteprocTranslator(object):
     """
     A translator for the JSON-based Citeproc format served by Crossref
@@ -113,6 +324,21 @@ class CiteprocTranslator(object):
         except ValueError:
             return
 
+    def prepare(self, header, metadata):
+        # journals and publishers are looked up in :meth:`complete`
+        try:
+            return (create_bare_paper(metadata),
+                    get_publication_fields(metadata))
+        except ValueError:
+            return
+
+    def complete(self, prepared):
+        paper, fields = prepared
+        return add_publication(paper, None, fields)
+
+    def start_page(self):
+        pass
+
 
 class OAIDCTranslator(object):
     """
@@ -120,9 +346,17 @@ class OAIDCTranslator(object):
     called oai_dc.
     """
 
+    def __init__(self):
+        #! DOIs found in the identifiers of the records of the current
+        # page (see :func:`papers.doi.find_dois`)
+        self.doi_memo = {}
+
     def format(self):
         return 'oai_dc'
 
+    def start_page(self):
+        self.doi_memo = {}
+
     def get_oai_authors(self, metadata):
         """
         Get the authors names out of a metadata record
@@ -191,7 +425,7 @@ class OAIDCTranslator(object):
         source = None
         if source_identifier:
             try:
-                source = OaiSource.objects.get(identifier=source_identifier)
+                source = oai_sources.get(source_identifier)
             except OaiSource.DoesNotExist:
                 pass
         return source
@@ -227,6 +461,12 @@ class OAIDCTranslator(object):
             print "Warning, OAI record "+header.identifier()+" skipped:\n"+unicode(e)
             paper.update_availability()
 
+    def prepare(self, header, metadata):
+        return self.translate(header, metadata)
+
+    def complete(self, prepared):
+        return prepared
+
     def add_oai_record(self, header, metadata, source, paper):
         """
         Add a record (from OAI-PMH) to the given paper
@@ -259,10 +499,9 @@ class OAIDCTranslator(object):
             pubtype = source.default_pubtype
 
         # Find the DOI, if any
-        doi = None
-        for url in metadata['identifier']+metadata['relation']+metadata['source']:
-            if not doi:
-                doi = to_doi(url)
+        dois = find_dois(metadata['identifier'] + metadata['relation'] +
+                         metadata['source'], self.doi_memo, first_only=True)
+        doi = dois[0] if dois else None
 
         record = BareOaiRecord(
                 source=source,
@@ -292,11 +531,27 @@ class CustomSourceOAIDCTranslator(OAIDCTranslator):
     (not assuming that the endpoint is proaixy)
     """
     def __init__(self, source):
+        super(CustomSourceOAIDCTranslator, self).__init__()
         self.source = source
 
     def get_source(self, header, record):
         return self.source
 
+class ThrottledClient(Client):
+    """
+    A pyoai client which does not send more than `rate` requests
+    per second to its endpoint.
+    """
+
+    def __init__(self, base_url, metadata_registry=None, rate=None):
+        super(ThrottledClient, self).__init__(base_url, metadata_registry)
+        self.bucket = TokenBucket(rate, 1) if rate else None
+
+    def makeRequest(self, **kw):
+        if self.bucket is not None:
+            self.bucket.acquire()
+        return super(ThrottledClient, self).makeRequest(**kw)
+
 class OaiPaperSource(PaperSource):  # TODO: this should not inherit from PaperSource
     """
     A paper source that fetches records from the OAI-PMH proxy
@@ -308,7 +563,8 @@ class OaiPaperSource(PaperSource):  # TODO: this should not inherit from PaperSo
     the metadata is served in.
     """
 
-    def __init__(self, endpoint, day_granularity=False, *args, **kwargs):
+    def __init__(self, endpoint, day_granularity=False, rate=None,
+                 write_slots=None, *args, **kwargs):
         """
         This sets up the paper source.
 
@@ -317,6 +573,11 @@ class OaiPaperSource(PaperSource):  # TODO: this should not inherit from PaperSo
         :param day_granularity: should we use day-granular timestamps
             to fetch from the proxy or full timestamps (default: False,
             full timestamps)
+        :param rate: the maximum number of requests per second sent
+            to the endpoint (not limited by default)
+        :param write_slots: a semaphore held while writing records
+            to the database, shared by harvests running concurrently
+            to bound the number of writers (see :mod:`backend.oaiharvester`)
 
         See the protocol reference for more information on timestamp
         granularity:
@@ -327,12 +588,17 @@ class OaiPaperSource(PaperSource):  # TODO: this should not inherit from PaperSo
         self.registry.registerReader('oai_dc', oai_dc_reader)
         self.registry.registerReader('base_dc', base_dc_reader)
         self.registry.registerReader('citeproc', citeproc_reader)
-        self.client = Client(endpoint, self.registry)
+        self.endpoint = endpoint
+        self.client = ThrottledClient(endpoint, self.registry, rate)
         self.client._day_granularity = day_granularity
         if settings.PROAIXY_API_KEY:
             self.client.extra_parameters = {
                 'key': settings.PROAIXY_API_KEY}
         self.translators = {}
+        self.write_slots = write_slots or threading.BoundedSemaphore(1)
+        #! DOIs found in the URLs of the records of the current page, when
+        # looking for duplicate records (see :meth:`OaiRecord.find_duplicate_records`)
+        self.doi_memo = {}
 
     # Translator management
 
@@ -348,25 +614,116 @@ class OaiPaperSource(PaperSource):  # TODO: this should not inherit from PaperSo
         """
         self.translators[translator.format()] = translator
 
+    def start_page(self):
+        """
+        Resets the memos of the paper source and of its translators,
+        which are kept for the records of one page.
+        """
+        self.doi_memo = {}
+        for translator in self.translators.values():
+            translator.start_page()
+
     # Record ingestion
 
+    def harvest_name(self, metadataPrefix):
+        """
+        The name of the :class:`HarvestState` recording the progress
+        of the harvests of this endpoint in the given format.
+        """
+        return oai_harvest_name(self.endpoint, metadataPrefix)
+
     def ingest(self, from_date=None, metadataPrefix='any',
-               resumptionToken=None):
+               resumptionToken=None, workers=None, streaming=False,
+               resume=True, batch_size=None, force=False):
         """
         Main method to fill Dissemin with papers!
 
+        The progress of the harvest is checkpointed after each page
+        (see :meth:`harvest_name`), so that a harvest which was interrupted
+        is resumed from its last completed page.
+
         :param from_date: only fetch papers modified after that date in
-                          the proxy (useful for incremental fetching)
+                          the proxy (useful for incremental fetching).
+                          Defaults to the end of the last completed harvest.
         :param metadataPrefix: restrict the ingest for this metadata
                           format
+        :param resumptionToken: start from this resumption token
+        :param workers: if set, the records are ingested by a pipeline
+                          (see :meth:`process_pages`) with that number of
+                          worker processes translating them
+        :param streaming: read the pages incrementally
+                          (see :class:`StreamedPage`) rather than with pyoai
+        :param resume: if the last harvest was interrupted, continue it
+                          (`from_date` is then ignored)
+        :param batch_size: save the records by batches of that size
+                          (see :meth:`process_records`)
+        :param force: ingest all the records, even those which have not
+                          changed since they were last ingested
+        """
+        state = HarvestState.get_by_name(self.harvest_name(metadataPrefix))
+        if resume and state.resumable and resumptionToken is None:
+            print('Resuming harvest %s (%d records in %d pages already processed)' %
+                  (state.name, state.records, state.pages))
+            resumptionToken = state.cursor
+        else:
+            if from_date is None:
+                from_date = state.last_success
+            state.start(from_date=from_date, until_date=timezone.now())
+
+        try:
+            try:
+                self.ingest_window(state, metadataPrefix, resumptionToken,
+                                   workers, streaming, batch_size, force)
+            except oaipmh.error.BadResumptionTokenError:
+                if not resumptionToken:
+                    raise
+                print('The resumption token has expired, restarting harvest %s' %
+                      state.name)
+                self.ingest_window(state, metadataPrefix, None,
+                                   workers, streaming, batch_size, force)
+        except BaseException:
+            state.interrupt()
+            raise
+        state.finish()
+
+    def ingest_window(self, state, metadataPrefix, resumptionToken=None,
+                      workers=None, streaming=False, batch_size=None,
+                      force=False):
+        """
+        Ingests the records of the time window of a harvest, from the
+        given resumption token (or from the start of the window),
+        checkpointing the harvest after each page.
         """
-	args = {'metadataPrefix':metadataPrefix}
-	if from_date:
-	    args['from_'] = from_date
-	if resumptionToken:
-	    args['resumptionToken'] = resumptionToken
-        records = self.client.listRecords(**args)
-        self.process_records(records)
+        pages = self.iter_raw_pages(from_date=state.from_date,
+                                    until_date=state.until_date,
+                                    metadataPrefix=metadataPrefix,
+                                    resumptionToken=resumptionToken)
+
+        def checkpoint(token, nb_records, nb_pages):
+            state.checkpoint(token, nb_records, nb_pages=nb_pages)
+
+        if workers:
+            self.process_pages(pages, metadataPrefix, workers, checkpoint,
+                               force)
+        elif batch_size:
+            # the pages of a batch are downloaded before it is saved, so
+            # their checkpoints wait for the transaction of the batch
+            pending = []
+
+            def save_checkpoints():
+                for args in pending:
+                    checkpoint(*args)
+                del pending[:]
+
+            self.process_records(self.iter_page_records(
+                pages, metadataPrefix, streaming,
+                lambda *args: pending.append(args)),
+                batch_size=batch_size, force=force,
+                after_batch=save_checkpoints)
+        else:
+            self.process_records(self.iter_page_records(
+                pages, metadataPrefix, streaming, checkpoint),
+                force=force)
 
     def create_paper_by_identifier(self, identifier, metadataPrefix):
         """
@@ -410,16 +767,33 @@ class OaiPaperSource(PaperSource):  # TODO: this should not inherit from PaperSo
         if paper is not None:
             try:
                 with transaction.atomic():
-                    saved = Paper.from_bare(paper)
+                    saved = Paper.from_bare(paper, self.doi_memo)
                 return saved
             except ValueError as e:
                 print "Ignoring invalid paper:"
                 print header.identifier()
                 print e
 
-    def process_records(self, listRecords):
+    def process_records(self, listRecords, batch_size=None, force=False,
+                        after_batch=None):
         """
         Save as :class:`Paper` all the records contained in this list
+
+        The records which have not changed since they were last ingested
+        are skipped (see :mod:`backend.oaidigests`).
+
+        :param batch_size: if set, the records are saved by batches of
+            that size, each batch in one transaction (and each record in a
+            savepoint, so that an invalid record is rolled back alone),
+            and the search index is updated after each batch.
+            Otherwise each record is saved in its own transaction.
+            (The records of a batch are read before taking a write slot,
+            so that slow endpoints do not hold the slots shared with
+            other harvests.)
+        :param force: ingest all the records, even the unchanged ones
+        :param after_batch: a function called in the transaction of each
+            batch once its records are saved (for instance to checkpoint
+            the harvest), including after the last, empty, batch
         """
         # check that we have at least one translator, otherwise
         # it's not really worth trying…
@@ -427,22 +801,465 @@ class OaiPaperSource(PaperSource):  # TODO: this should not inherit from PaperSo
             raise ValueError("No OAI translators have been set up: " +
                              "We cannot save any record.")
 
-        last_report = datetime.now()
-        processed_since_report = 0
+        # rate reporting
+        counts = {'records': 0, 'commits': 0, 'skipped': 0,
+                  'since': datetime.now()}
+
+        def count(nb_records, nb_commits, nb_skipped=0):
+            counts['records'] += nb_records
+            counts['commits'] += nb_commits
+            counts['skipped'] += nb_skipped
+            if counts['records'] >= 1000:
+                td = datetime.now() - counts['since']
+                rate = 'infty'
+                commit_rate = 'infty'
+                if td.seconds:
+                    rate = unicode(counts['records'] / td.seconds)
+                    commit_rate = unicode(counts['commits'] / td.seconds)
+                print("current rate: %s records/s, %s commits/s, %d unchanged records skipped" %
+                      (rate, commit_rate, counts['skipped']))
+                counts.update(records=0, commits=0, skipped=0,
+                              since=datetime.now())
+
+        records = iter(listRecords)
+        if not batch_size:
+            for record in records:
+                if record[1] is None: # deleted record
+                    count(1, 0)
+                    continue
+                header = record[0]
+                metadata = record[1]._map
+
+                identifier = header.identifier()
+                digest = metadata_digest(header, metadata)
+                if not force and get_digests([identifier]).get(identifier) == digest:
+                    count(1, 0, 1)
+                    continue
+                with self.write_slots:
+                    paper = self.process_record(header, metadata)
+                    if paper is not None:
+                        store_digests({identifier: digest})
+                count(1, 1)
+            return
+
+        while True:
+            papers = []
+            batch = list(islice(records, batch_size))
+            nb_records = len(batch)
+            batch = [(record_header, record_metadata._map)
+                     for record_header, record_metadata, about in batch
+                     if record_metadata is not None] # skip deleted records
+            digests = {record_header.identifier():
+                       metadata_digest(record_header, record_metadata)
+                       for record_header, record_metadata in batch}
+            with self.write_slots, transaction.atomic():
+                known_digests = {} if force else get_digests(digests.keys())
+                ingested = {}
+                skipped = 0
+                for header, metadata in batch:
+                    identifier = header.identifier()
+                    if known_digests.get(identifier) == digests[identifier]:
+                        skipped += 1
+                        continue
+                    try:
+                        with transaction.atomic():
+                            paper = self.process_record(header, metadata)
+                    except DatabaseError as e:
+                        print("Ignoring record %s: %s" %
+                              (identifier, unicode(e)))
+                        continue
+                    # records which were not saved are ingested again
+                    # next time (they might have been rejected for reasons
+                    # unrelated to their metadata, such as a missing source)
+                    if paper is not None:
+                        ingested[identifier] = digests[identifier]
+                        papers.append(paper)
+                store_digests(ingested)
+                if after_batch is not None:
+                    after_batch()
+            if not nb_records:
+                break
+            Paper.update_index_bulk(papers)
+            count(nb_records, 1, skipped)
+
+    # Pipelined ingestion
+
+    def iter_raw_pages(self, from_date=None, until_date=None,
+                       metadataPrefix='any', resumptionToken=None):
+        """
+        Downloads the pages of a ListRecords request, following the
+        resumption tokens, without parsing them (the tokens are
+        found with a regular expression).
+
+        :returns: a generator of pairs: the XML page and the resumption
+            token of the next page (None for the last page)
+        :raises: :class:`oaipmh.error.BadResumptionTokenError` when
+            the endpoint rejects a resumption token
+        """
+        if resumptionToken:
+            args = {'resumptionToken': resumptionToken}
+        else:
+            args = {'metadataPrefix': metadataPrefix}
+            if from_date:
+                args['from'] = self.datestamp(from_date)
+            if until_date:
+                args['until'] = self.datestamp(until_date)
+        while True:
+            xml = self.client.makeRequest(verb='ListRecords', **args)
+            error = oai_error_re.search(xml)
+            if error and error.group(1) == 'badResumptionToken':
+                raise oaipmh.error.BadResumptionTokenError(
+                    args.get('resumptionToken'))
+            match = resumption_token_re.search(xml)
+            token = match and unescape(match.group(1).strip())
+            yield xml, token or None
+            if not token:
+                break
+            args = {'resumptionToken': token}
+
+    def datestamp(self, date):
+        """
+        Formats a date as an OAI-PMH datestamp, with the granularity
+        of the endpoint. pyoai only accepts naive dates, so aware ones
+        (such as the dates of the harvests) are converted to UTC first.
+        """
+        if timezone.is_aware(date):
+            date = timezone.make_naive(date, timezone.utc)
+        return datetime_to_datestamp(date, self.client._day_granularity)
+
+    def parse_page(self, xml, metadataPrefix):
+        """
+        Parses a page returned by the ListRecords verb with pyoai.
+
+        :returns: the list of (header, metadata, about) triples
+        """
+        tree = self.client.parse(xml)
+        namespaces = self.client.getNamespaces()
+        for error in tree.xpath('/oai:OAI-PMH/oai:error', namespaces=namespaces):
+            raise_oai_error(error)
+            return []
+        records, token = self.client.buildRecords(
+            metadataPrefix, namespaces, self.registry, tree)
+        return records
+
+    def iter_page_records(self, pages, metadataPrefix, streaming=False,
+                          checkpoint=None):
+        """
+        Reads the records of pages returned by :meth:`iter_raw_pages`.
+
+        :param streaming: read the pages incrementally (see :class:`StreamedPage`)
+        :param checkpoint: a function called with the resumption token,
+            the number of records and the number of pages once all
+            the records of a page have been consumed
+        :returns: a generator of (header, metadata, about) triples
+        """
+        for xml, token in pages:
+            self.start_page()
+            if streaming:
+                records = StreamedPage(xml, metadataPrefix, self.registry)
+            else:
+                records = self.parse_page(xml, metadataPrefix)
+            nb_records = 0
+            for record in records:
+                nb_records += 1
+                yield record
+            if checkpoint is not None:
+                checkpoint(token, nb_records, 1)
+
+    def list_records_streaming(self, from_date=None, metadataPrefix='any',
+                               resumptionToken=None):
+        """
+        Streaming counterpart of pyoai's listRecords: the records
+        of each page are read incrementally (see :class:`StreamedPage`).
+        """
+        pages = self.iter_raw_pages(from_date=from_date,
+                                    metadataPrefix=metadataPrefix,
+                                    resumptionToken=resumptionToken)
+        return self.iter_page_records(pages, metadataPrefix, streaming=True)
+
+    @staticmethod
+    def page_identifiers(xml):
+        """
+        The identifiers of the records in a page returned by the
+        ListRecords verb, found without parsing it.
+        """
+        return [unescape(identifier.strip())
+                for identifier in record_identifier_re.findall(xml)]
 
-        for record in listRecords:
-            header = record[0]
-            metadata = record[1]._map
+    def translate_page(self, xml, metadataPrefix, known_digests=None):
+        """
+        Parses a page returned by the ListRecords verb and translates its
+        records with :meth:`OaiTranslator.prepare`. This does not query
+        the database (the OAI sources are looked up in the registry loaded
+        before forking), so it runs in the workers of :meth:`process_pages`.
+
+        :param known_digests: the digests stored for the records of the
+            page (see :meth:`page_identifiers`): the records which have
+            not changed are skipped before being translated
+        :returns: a triple: the list of (identifier, digest, metadata
+            format, prepared record or None), the number of records in
+            the page and the number of unchanged records skipped
+        """
+        known_digests = known_digests or {}
+        self.start_page()
+        records = self.parse_page(xml, metadataPrefix)
+        prepared = []
+        skipped = 0
+        for header, metadata, about in records:
+            if metadata is None: # deleted record
+                continue
+            translator = self.translators.get(header.format())
+            if translator is None:
+                print("Warning: unknown metadata format %s, skipping" %
+                      header.format())
+                continue
+            digest = metadata_digest(header, metadata._map)
+            if known_digests.get(header.identifier()) == digest:
+                skipped += 1
+                continue
+            result = translator.prepare(header, metadata._map)
+            prepared.append((header.identifier(), digest,
+                             header.format(), result))
+        return prepared, len(records), skipped
 
-            self.process_record(header, metadata)
+    def save_prepared(self, prepared, force=False):
+        """
+        Saves records prepared by :meth:`translate_page`, in bulk.
+        The records which have not changed since they were last ingested
+        are skipped, unless `force` is set (the digests are checked again,
+        as they may have been stored since the page was translated).
 
-            # rate reporting
-            processed_since_report += 1
-            if processed_since_report >= 1000:
-                td = datetime.now() - last_report
+        :returns: a pair: the list of papers saved and the number of
+            records skipped
+        """
+        known_digests = {} if force else get_digests(
+            [identifier for identifier, _, _, _ in prepared])
+        papers = []
+        # digest and OAI record identifiers of the papers, by record
+        pending = {}
+        skipped = 0
+        for identifier, digest, metadata_format, result in prepared:
+            if known_digests.get(identifier) == digest:
+                skipped += 1
+                continue
+            if result is None:
+                continue
+            paper = self.translators[metadata_format].complete(result)
+            if paper is not None:
+                papers.append(paper)
+                pending[identifier] = (digest, [record.identifier
+                    for record in paper.oairecords])
+        saved = Paper.bulk_from_bare(papers, self.doi_memo)
+        self.doi_memo = {}
+        # only remember the records which were saved: the others are
+        # ingested again next time
+        saved_records = set(OaiRecord.objects.filter(
+            identifier__in=[record_identifier
+                            for _, record_identifiers in pending.values()
+                            for record_identifier in record_identifiers]
+            ).values_list('identifier', flat=True))
+        store_digests({identifier: digest
+                       for identifier, (digest, record_identifiers)
+                       in pending.items()
+                       if saved_records.issuperset(record_identifiers)})
+        Paper.update_index_bulk(saved)
+        return saved, skipped
+
+    def process_pages(self, pages, metadataPrefix, workers=None,
+                      checkpoint=None, force=False):
+        """
+        Pipelined counterpart of :meth:`process_records`, with three stages
+        connected by bounded queues:
+
+        - a thread downloads the pages (see :meth:`iter_raw_pages`);
+        - a pool of worker processes parses and translates them
+          (see :meth:`translate_page`);
+        - the current thread saves the papers in batches
+          (see :meth:`save_prepared`).
+
+        :param pages: an iterator over the pages to ingest, as returned
+            by :meth:`iter_raw_pages`
+        :param metadataPrefix: the metadata format of the pages
+        :param workers: the number of worker processes (defaults to the
+            number of CPUs)
+        :param checkpoint: a function called with the resumption token,
+            the number of records and the number of pages once all the
+            pages up to that token have been saved
+        :param force: ingest all the records, even the unchanged ones
+        """
+        if not self.translators:
+            raise ValueError("No OAI translators have been set up: " +
+                             "We cannot save any record.")
+        workers = workers or cpu_count()
+        rates = PipelineRates()
+        page_queue = Queue.Queue(maxsize=oai_prefetched_pages)
+        stop = threading.Event()
+
+        def put(item):
+            # (not blocking, so that the fetcher stops with the pipeline)
+            while not stop.is_set():
+                try:
+                    page_queue.put(item, timeout=0.1)
+                    return True
+                except Queue.Full:
+                    pass
+            return False
+
+        def fetch():
+            try:
+                start = time.time()
+                for page in pages:
+                    rates.add('fetch', 1, time.time() - start)
+                    if not put(page):
+                        return
+                    start = time.time()
+                put(None)
+            except Exception as e:
+                put(e)
+
+        # Database connections should not be shared with the workers,
+        # which only use the OAI sources loaded before forking
+        for connection in connections.all():
+            if connection.in_atomic_block:
+                raise transaction.TransactionManagementError(
+                    'The pipelined ingestion cannot run in a transaction: '
+                    'its connection would be shared with the workers.')
+            connection.close()
+        oai_sources.load()
+        pool = Pool(workers, initializer=init_translation_worker,
+                    initargs=(self,))
+        fetcher = threading.Thread(target=fetch)
+        fetcher.daemon = True
+        fetcher.start()
+
+        in_flight = deque()
+        batch = []
+        # pages in the batch: resumption token of the last one,
+        # number of records and number of pages
+        batch_pages = [None, 0, 0]
+        last_report = 0
+
+        def save(batch):
+            # (the resumption token of the next page must not expire)
+            wait_for_interactive_tasks(
+                max_pause=settings.BULK_CURSOR_MAX_PAUSE)
+            start = time.time()
+            with self.write_slots:
+                saved, skipped = self.save_prepared(batch, force)
+                if checkpoint is not None and batch_pages[2]:
+                    checkpoint(*batch_pages)
+            rates.add('save', len(batch), time.time() - start)
+            rates.saved += len(saved)
+            rates.skipped += skipped
+            batch_pages[:] = [None, 0, 0]
+
+        try:
+            while True:
+                page = page_queue.get()
+                if isinstance(page, Exception):
+                    raise page
+                if page is not None:
+                    xml, token = page
+                    # (the workers do not query the database)
+                    known_digests = {} if force else get_digests(
+                        self.page_identifiers(xml))
+                    in_flight.append((token, pool.apply_async(
+                        translate_page_in_worker,
+                        (xml, metadataPrefix, known_digests))))
+                # collect the translated pages, in order
+                while in_flight and (page is None or
+                        len(in_flight) >= oai_pages_per_worker*workers or
+                        in_flight[0][1].ready()):
+                    token, result = in_flight.popleft()
+                    prepared, nb_records, skipped, elapsed = result.get()
+                    rates.add('translate', nb_records, elapsed)
+                    rates.skipped += skipped
+                    batch.extend(prepared)
+                    batch_pages[0] = token
+                    batch_pages[1] += nb_records
+                    batch_pages[2] += 1
+                    if len(batch) >= oai_batch_size:
+                        save(batch)
+                        batch = []
+                    if rates.records - last_report >= oai_report_interval:
+                        print(rates.report())
+                        last_report = rates.records
+                if page is None:
+                    break
+            save(batch)
+            pool.close()
+        finally:
+            stop.set()
+            pool.terminate()
+        print(rates.report())
+
+
+#! The paper source used by the workers of the pipelined ingestion
+# (inherited from the parent process when forking)
+worker_paper_source = None
+
+
+def init_translation_worker(paper_source):
+    global worker_paper_source
+    worker_paper_source = paper_source
+    oai_sources.freeze()
+
+
+def translate_page_in_worker(xml, metadataPrefix, known_digests):
+    start = time.time()
+    prepared, nb_records, skipped = worker_paper_source.translate_page(
+        xml, metadataPrefix, known_digests)
+    return prepared, nb_records, skipped, time.time() - start
+
+
+class PipelineRates(object):
+    """
+    Counts the items processed by each stage of the pipelined
+    ingestion, and the time spent in each of them, to report
+    the current rates.
+    """
+    stages = ['fetch', 'translate', 'save']
+    units = {'fetch': 'pages', 'translate': 'records', 'save': 'records'}
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = dict.fromkeys(self.stages, 0)
+        self.times = dict.fromkeys(self.stages, 0.)
+        #! number of records translated
+        self.records = 0
+        #! number of papers saved
+        self.saved = 0
+        #! number of unchanged records skipped
+        self.skipped = 0
+        self.last_report = time.time()
+
+    def add(self, stage, count, elapsed):
+        with self.lock:
+            self.counts[stage] += count
+            self.times[stage] += elapsed
+            if stage == 'translate':
+                self.records += count
+
+    def report(self):
+        """
+        The rates since the last report, per stage. The rate
+        of the translation stage is given per worker.
+        """
+        with self.lock:
+            now = time.time()
+            wall = now - self.last_report
+            rates = []
+            for stage in self.stages:
                 rate = 'infty'
-                if td.seconds:
-                    rate = unicode(processed_since_report / td.seconds)
-                print("current rate: %s records/s" % rate)
-                processed_since_report = 0
-                last_report = datetime.now()
+                if self.times[stage]:
+                    rate = '%.1f' % (self.counts[stage] / self.times[stage])
+                rates.append('%s: %s %s/s' % (stage, rate, self.units[stage]))
+            overall = 'infty'
+            if wall:
+                overall = '%.1f' % (self.counts['save'] / wall)
+            self.counts = dict.fromkeys(self.stages, 0)
+            self.times = dict.fromkeys(self.stages, 0.)
+            self.last_report = now
+        return ('current rate: %s records/s (%s), %d papers saved, '
+                '%d unchanged records skipped') % (
+            overall, ', '.join(rates), self.saved, self.skipped)
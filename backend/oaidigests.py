@@ -0,0 +1,125 @@
+# -*- encoding: utf-8 -*-
+
+# Dissemin: open access policy enforcement tool
+# Copyright (C) 2014 Antonin Delpeuch
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+Digests of the OAI records already ingested.
+
+Harvesting a source again returns many records which have not changed
+since the last harvest. Translating and merging them again is costly
+(fingerprints, name unification, several queries per record), so we store
+a hash of the normalized metadata of each ingested record, and skip the
+records whose hash has not changed.
+
+Only the records which were saved as papers are remembered: the others
+might have been rejected for reasons which do not depend on their
+metadata (such as an unknown source), so they are translated again.
+"""
+
+from __future__ import unicode_literals
+
+import hashlib
+import json
+
+from bulk_update.helper import bulk_update
+from django.db import IntegrityError
+from django.db import transaction
+from papers.models import OaiRecordDigest
+
+
+def normalize_metadata(value):
+    """
+    Normalizes metadata before hashing: whitespace around strings
+    is stripped and empty fields are dropped.
+
+    >>> normalize_metadata({'title': [' A title '], 'subject': [], 'type': None})
+    {u'title': [u'A title']}
+    """
+    if isinstance(value, dict):
+        normalized = {}
+        for key, item in value.items():
+            item = normalize_metadata(item)
+            if item not in (None, '', [], {}):
+                normalized[key] = item
+        return normalized
+    elif isinstance(value, (list, tuple)):
+        return [normalize_metadata(item) for item in value]
+    elif isinstance(value, basestring):
+        return value.strip()
+    return value
+
+
+def metadata_digest(header, metadata):
+    """
+    The digest of a record: it covers its format, sets and normalized
+    metadata, but not its datestamp (which can change when the metadata
+    does not).
+
+    :param header: the header of the record, as returned by pyoai
+    :param metadata: the dictionary of the record
+    :returns: a SHA-1 digest (20 bytes)
+    """
+    normalized = {
+        'format': header.format(),
+        'sets': sorted(header.setSpec()),
+        'metadata': normalize_metadata(metadata),
+    }
+    serialized = json.dumps(normalized, sort_keys=True,
+                            separators=(',', ':'))
+    return hashlib.sha1(serialized.encode('utf-8')).digest()
+
+
+def get_digests(identifiers):
+    """
+    :returns: the stored digests of these records, by identifier
+    """
+    identifiers = list(identifiers)
+    if not identifiers:
+        return {}
+    return {
+        identifier: bytes(digest)
+        for identifier, digest in OaiRecordDigest.objects.filter(
+            identifier__in=identifiers).values_list('identifier', 'digest')
+    }
+
+
+def store_digests(digests):
+    """
+    Stores (or replaces) the digests of ingested records.
+
+    :param digests: a dict mapping identifiers to digests
+    """
+    digests = dict(digests)
+    if not digests:
+        return
+    existing = list(OaiRecordDigest.objects.filter(
+        identifier__in=digests.keys()).only('identifier'))
+    for entry in existing:
+        entry.digest = digests.pop(entry.identifier)
+    if existing:
+        bulk_update(existing, update_fields=['digest'])
+
+    try:
+        with transaction.atomic():
+            OaiRecordDigest.objects.bulk_create([
+                OaiRecordDigest(identifier=identifier, digest=digest)
+                for identifier, digest in digests.items()])
+    except IntegrityError:
+        # another worker stored the same records in the meantime
+        pass
@@ -0,0 +1,213 @@
+# -*- encoding: utf-8 -*-
+
+# Dissemin: open access policy enforcement tool
+# Copyright (C) 2014 Antonin Delpeuch
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+from __future__ import unicode_literals
+
+from datetime import timedelta
+import Queue
+import threading
+import time
+import traceback
+
+from backend.oai import CustomSourceOAIDCTranslator
+from backend.oai import oai_harvest_name
+from backend.oai import OaiPaperSource
+from django.conf import settings
+from django.db import connection
+from papers.models import HarvestState
+from papers.models import oai_sources
+
+######## Harvesting OAI-PMH endpoints concurrently ###########
+#
+# The repositories listed in settings.OAI_HARVEST_ENDPOINTS are harvested
+# by a pool of threads, one endpoint per thread at a time, so that the
+# harvest of all the endpoints takes about as long as the slowest one.
+#
+# Each endpoint has its own request rate (see ThrottledClient) and its
+# own HarvestState, from which its incremental harvests start. Writing
+# to the database is done under a semaphore shared by all the threads,
+# so that at most OAI_HARVEST_MAX_WRITERS harvests write at once.
+#
+
+
+class OaiEndpoint(object):
+    """
+    An OAI-PMH endpoint harvested directly, whose records belong
+    to a given :class:`OaiSource`.
+    """
+
+    def __init__(self, endpoint, source, metadata_prefix='oai_dc',
+                 rate=1, day_granularity=False):
+        """
+        :param endpoint: the address of the endpoint
+        :param source: the identifier of the :class:`OaiSource`
+        :param metadata_prefix: the format the records are harvested in
+        :param rate: the maximum number of requests per second
+        :param day_granularity: does the endpoint only support
+            day-granular timestamps?
+        """
+        self.endpoint = endpoint
+        self.source = source
+        self.metadata_prefix = metadata_prefix
+        self.rate = rate
+        self.day_granularity = day_granularity
+
+    def __unicode__(self):
+        return self.endpoint
+
+    def harvest_name(self):
+        return oai_harvest_name(self.endpoint, self.metadata_prefix)
+
+    def harvest_state(self):
+        return HarvestState.get_by_name(self.harvest_name())
+
+    def paper_source(self, write_slots=None):
+        """
+        The paper source harvesting this endpoint.
+        """
+        paper_source = OaiPaperSource(endpoint=self.endpoint,
+                                      day_granularity=self.day_granularity,
+                                      rate=self.rate,
+                                      write_slots=write_slots)
+        paper_source.add_translator(
+            CustomSourceOAIDCTranslator(oai_sources.get(self.source)))
+        return paper_source
+
+
+def configured_endpoints():
+    """
+    The endpoints listed in `settings.OAI_HARVEST_ENDPOINTS`.
+    """
+    return [OaiEndpoint(**config)
+            for config in settings.OAI_HARVEST_ENDPOINTS]
+
+
+def endpoint_status(endpoints):
+    """
+    The state of the harvests of these endpoints, the most lagging first.
+
+    :returns: a list of (endpoint, harvest state, lagging) triples, where
+        `lagging` is true when the endpoint has never been harvested
+        completely, or is behind by more than `settings.OAI_HARVEST_MAX_LAG`
+    """
+    status = []
+    for endpoint in endpoints:
+        state = endpoint.harvest_state()
+        lag = state.lag()
+        if lag is None:
+            lag = timedelta.max
+        status.append((lag, endpoint, state))
+    status.sort(key=lambda item: item[0], reverse=True)
+    return [(item_endpoint, item_state,
+             item_lag > settings.OAI_HARVEST_MAX_LAG)
+            for item_lag, item_endpoint, item_state in status]
+
+
+class OaiHarvestScheduler(object):
+    """
+    Harvests several OAI-PMH endpoints concurrently.
+    """
+
+    def __init__(self, endpoints, max_endpoints=None, max_writers=None,
+                 batch_size=None):
+        """
+        :param endpoints: the list of :class:`OaiEndpoint` to harvest
+        :param max_endpoints: the number of endpoints harvested at once
+            (defaults to `settings.OAI_HARVEST_MAX_ENDPOINTS`)
+        :param max_writers: the number of harvests writing to the
+            database at once (defaults to `settings.OAI_HARVEST_MAX_WRITERS`)
+        :param batch_size: passed to :meth:`OaiPaperSource.ingest`
+        """
+        self.endpoints = endpoints
+        self.max_endpoints = (max_endpoints or
+                              settings.OAI_HARVEST_MAX_ENDPOINTS)
+        self.write_slots = threading.BoundedSemaphore(
+            max_writers or settings.OAI_HARVEST_MAX_WRITERS)
+        self.batch_size = batch_size
+        #! Duration of the harvest of each endpoint, in seconds
+        self.durations = {}
+        #! Exceptions raised by the harvests which failed, by endpoint
+        self.errors = {}
+
+    def run(self, force=False):
+        """
+        Harvests all the endpoints, the most lagging ones first (they
+        are likely to have the most records to harvest, so starting them
+        first shortens the total harvest).
+
+        A failing harvest does not stop the others: it is interrupted
+        (and will be resumed by the next run) and its error is recorded
+        in :attr:`errors`.
+
+        :param force: ingest all the records, even the unchanged ones
+        :returns: True if all the harvests completed
+        """
+        queue = Queue.Queue()
+        for endpoint, state, lagging in endpoint_status(self.endpoints):
+            queue.put(endpoint)
+
+        def work():
+            try:
+                while True:
+                    try:
+                        endpoint = queue.get(block=False)
+                    except Queue.Empty:
+                        return
+                    self.harvest(endpoint, force)
+            finally:
+                # each thread has its own database connection
+                if not connection.in_atomic_block:
+                    connection.close()
+
+        threads = [threading.Thread(target=work)
+                   for i in range(min(self.max_endpoints, len(self.endpoints)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return not self.errors
+
+    def harvest(self, endpoint, force=False):
+        """
+        Harvests one endpoint, from the end of its last completed
+        harvest (or resuming its last interrupted one).
+        """
+        start = time.time()
+        try:
+            paper_source = endpoint.paper_source(self.write_slots)
+            paper_source.ingest(metadataPrefix=endpoint.metadata_prefix,
+                                batch_size=self.batch_size, force=force)
+        except Exception as e:
+            print('Harvest of %s failed:' % endpoint.endpoint)
+            traceback.print_exc()
+            self.errors[endpoint.endpoint] = e
+        self.durations[endpoint.endpoint] = time.time() - start
+
+    def report(self):
+        lines = []
+        for endpoint in self.endpoints:
+            duration = self.durations.get(endpoint.endpoint)
+            if duration is None:
+                continue
+            lines.append('%s: %s in %.1f s' % (
+                endpoint.endpoint,
+                'failed' if endpoint.endpoint in self.errors else 'harvested',
+                duration))
+        return '\n'.join(lines)
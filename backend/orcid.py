@@ -22,12 +22,10 @@ from __future__ import unicode_literals
 
 #from requests.exceptions import RequestException
 #import json, requests
-import os
-import os.path as path
-import json
 from backend.crossref import convert_to_name_pair
 from backend.crossref import CrossRefAPI
 from backend.crossref import fetch_dois
+from backend.orcidcache import orcid_cache
 from backend.papersource import PaperSource
 from django.conf import settings
 from notification.api import add_notification_for
@@ -36,7 +34,7 @@ import notification.levels as notification_levels
 from papers.baremodels import BareOaiRecord
 from papers.baremodels import BarePaper
 from papers.errors import MetadataSourceException
-from papers.models import OaiSource
+from papers.models import oai_sources
 from papers.models import Researcher
 from papers.orcid import OrcidProfile
 from papers.orcid import affiliate_author_with_orcid
@@ -45,7 +43,42 @@ from papers.utils import validate_orcid
 ### Metadata manipulation utilities ####
 
 def orcid_oai_source():
-    return OaiSource.objects.get(identifier='orcid')
+    return oai_sources.get('orcid')
+
+
+def create_bare_paper_from_work(work):
+    """
+    Creates a bare paper (without its record) from the metadata of an
+    ORCID work. This does not access the database.
+
+    :returns: a pair: the paper and the fields of its ORCID record
+        (to be passed to :class:`BareOaiRecord` with the ORCID source)
+    """
+    assert (not work.skipped)
+    authors, orcids = work.authors_and_orcids
+    paper = BarePaper.create(
+        work.title,
+        authors,
+        work.pubdate,
+        visible=True,
+        affiliations=None,
+        orcids=orcids,
+    )
+    fields = {
+        'identifier': work.api_uri,
+        'splash_url': work.splash_url,
+        'pubtype': work.pubtype,
+    }
+    return paper, fields
+
+
+def add_orcid_record(paper, fields):
+    """
+    Adds the ORCID record created by :func:`create_bare_paper_from_work`
+    to its paper.
+    """
+    paper.add_oairecord(BareOaiRecord(source=orcid_oai_source(), **fields))
+    return paper
 
 
 ### Paper fetching ####
@@ -63,29 +96,18 @@ class OrcidPaperSource(PaperSource):
         return []
 
     def create_paper(self, work):
-        assert (not work.skipped)
-        # Create paper
-        authors, orcids = work.authors_and_orcids
-        paper = BarePaper.create(
-            work.title,
-            authors,
-            work.pubdate,
-            visible=True,
-            affiliations=None,
-            orcids=orcids,
-        )
-        record = BareOaiRecord(
-            source=orcid_oai_source(),
-            identifier=work.api_uri,
-            splash_url=work.splash_url,
-            pubtype=work.pubtype
-        )
-
-        paper.add_oairecord(record)
-
-        return paper
-
-    def fetch_crossref_incrementally(self, cr_api, orcid_id):
+        paper, fields = create_bare_paper_from_work(work)
+        return add_orcid_record(paper, fields)
+
+    def fetch_crossref_incrementally(self, cr_api, ref_name, orcid_id):
+        """
+        Searches CrossRef for the records which mention the ORCID iD
+        of the researcher. The pages of results are fetched concurrently
+        (see :meth:`CrossRefAPI.fetch_all_papers`).
+
+        :returns: a generator of (success, paper or metadata) pairs,
+            as :meth:`fetch_metadata_from_dois`
+        """
         # If we are using the ORCID sandbox, then do not look for papers from CrossRef
         # as the ORCID ids they contain are production ORCID ids (not fake
         # ones).
@@ -93,37 +115,39 @@ class OrcidPaperSource(PaperSource):
             return
 
         for metadata in cr_api.fetch_all_papers({'orcid': orcid_id}):
-            try:
-                paper = cr_api.save_doi_metadata(metadata)
-                if paper:
-                    yield True, paper
-                else:
-                    yield False, metadata
-            except ValueError as e:
-                print "Saving CrossRef record from ORCID failed: %s" % unicode(e)
+            yield self.paper_from_crossref(cr_api, ref_name, orcid_id, metadata)
 
     def fetch_metadata_from_dois(self, cr_api, ref_name, orcid_id, dois):
         doi_metadata = fetch_dois(dois)
         for metadata in doi_metadata:
-            try:
-                authors = map(convert_to_name_pair, metadata['author'])
-                orcids = affiliate_author_with_orcid(
-                    ref_name, orcid_id, authors)
-                paper = cr_api.save_doi_metadata(metadata, orcids)
-                if not paper:
-                    yield False, metadata
-                    continue
-
-                record = BareOaiRecord(
-                        source=orcid_oai_source(),
-                        identifier='orcid:%s:%s' % (orcid_id, metadata['DOI']),
-                        splash_url='https://%s/%s' % (
-                            settings.ORCID_BASE_DOMAIN, orcid_id),
-                        pubtype=paper.doctype)
-                paper.add_oairecord(record)
-                yield True, paper
-            except (KeyError, ValueError, TypeError):
-                yield False, metadata
+            yield self.paper_from_crossref(cr_api, ref_name, orcid_id, metadata)
+
+    def paper_from_crossref(self, cr_api, ref_name, orcid_id, metadata):
+        """
+        Creates a paper from the CrossRef metadata of one of the works
+        of the researcher, with a record pointing to their ORCID profile.
+
+        :returns: a pair: whether it succeeded, and the paper (or the
+            metadata if it failed)
+        """
+        try:
+            authors = map(convert_to_name_pair, metadata['author'])
+            orcids = affiliate_author_with_orcid(
+                ref_name, orcid_id, authors)
+            paper = cr_api.save_doi_metadata(metadata, orcids)
+            if not paper:
+                return False, metadata
+
+            record = BareOaiRecord(
+                    source=orcid_oai_source(),
+                    identifier='orcid:%s:%s' % (orcid_id, metadata['DOI']),
+                    splash_url='https://%s/%s' % (
+                        settings.ORCID_BASE_DOMAIN, orcid_id),
+                    pubtype=paper.doctype)
+            paper.add_oairecord(record)
+            return True, paper
+        except (KeyError, ValueError, TypeError):
+            return False, metadata
 
     def warn_user_of_ignored_papers(self, ignored_papers):
         if self.researcher is None:
@@ -143,15 +167,20 @@ class OrcidPaperSource(PaperSource):
                                     'backend_orcid'
                                     )
 
-    def fetch_orcid_records(self, orcid_identifier, profile=None, use_doi=True):
+    def fetch_orcid_records(self, orcid_identifier, profile=None, use_doi=True,
+                            incremental=True):
         """
         Queries ORCiD to retrieve the publications associated with a given ORCiD.
         It also fetches such papers from the CrossRef search interface.
 
         :param profile: The ORCID profile if it has already been fetched before (format: parsed JSON).
         :param use_doi: Fetch the publications by DOI when we find one (recommended, but slow)
+        :param incremental: Only fetch the works which are new, modified or failed
+                since the last harvest of the researcher (see :attr:`Researcher.orcid_works`)
         :returns: a generator, where all the papers found are yielded. (some of them could be in
-                free form, hence not imported)
+                free form, hence not imported) The works are only recorded as imported in
+                :attr:`Researcher.orcid_works` when the caller reports that their paper was saved,
+                by sending True to the generator (see :meth:`PaperSource.fetch_and_save`).
         """
         cr_api = CrossRefAPI()
 
@@ -163,7 +192,7 @@ class OrcidPaperSource(PaperSource):
         # Get ORCiD profile
         try:
             if profile is None:
-                profile = OrcidProfile(orcid_id=orcid_id)
+                profile = OrcidProfile(orcid_id=orcid_id, cache=orcid_cache)
             else:
                 profile = OrcidProfile(json=profile)
         except MetadataSourceException as e:
@@ -176,17 +205,56 @@ class OrcidPaperSource(PaperSource):
         if not self.researcher:
             return
 
+        # Nothing to do if the profile has not changed since it was
+        # last processed (this only costs two conditional requests)
+        try:
+            profile.work_summaries
+        except MetadataSourceException as e:
+            print e
+            return
+        if profile.unchanged:
+            print('ORCID profile %s unchanged since the last refresh' % orcid_id)
+            return
+
         # Reference name
         ref_name = profile.name
         ignored_papers = []  # list of ignored papers due to incomplete metadata
 
+        # Works processed by the last harvest: the ones which were imported
+        # and have not been modified since then are skipped
+        known_works = self.researcher.orcid_works if incremental else {}
+        works = {}
+        summaries = []
+        for summary in profile.work_summaries:
+            key = unicode(summary.put_code)
+            known = known_works.get(key)
+            if (known and known.get('ok') and
+                    known.get('modified') == summary.last_modified):
+                works[key] = known
+            else:
+                works[key] = {'modified': summary.last_modified, 'ok': False}
+                summaries.append(summary)
+        removed = set(known_works) - set(works)
+        if removed:
+            print('Works removed from the ORCID profile %s: %s' %
+                  (orcid_id, ', '.join(sorted(removed))))
+        if known_works:
+            print('%d new or modified works in the ORCID profile %s' %
+                  (len(summaries), orcid_id))
+
+        def imported(put_code):
+            works[unicode(put_code)]['ok'] = True
+
+        # whether all the papers yielded have been saved
+        all_saved = True
+
         # Get summary publications and separate them in two classes:
         # - the ones with DOIs, that we will fetch with CrossRef
         dois_and_putcodes = []  # list of (DOIs,putcode) to fetch
         # - the ones without: we will fetch ORCID's metadata about them
         #   and try to create a paper with what they provide
         put_codes = []
-        for summary in profile.work_summaries:
+        for summary in summaries:
             if summary.doi and use_doi:
                 dois_and_putcodes.append((summary.doi, summary.put_code))
             else:
@@ -194,17 +262,47 @@ class OrcidPaperSource(PaperSource):
 
         # 1st attempt with DOIs and CrossRef
         if use_doi:
-            # Let's grab papers with DOIs found in our ORCiD profile.
-            dois = [doi for doi, put_code in dois_and_putcodes]
+            # On the first harvest of a profile, the CrossRef records
+            # mentioning the ORCID iD are found by a search whose pages
+            # are fetched concurrently, which is much faster than fetching
+            # them DOI by DOI. (Later harvests only fetch the few works
+            # which changed, by DOI.)
+            found_dois = set()
+            if not known_works:
+                try:
+                    for success, paper_or_metadata in self.fetch_crossref_incrementally(
+                            cr_api, ref_name, orcid_id):
+                        if success:
+                            saved = yield paper_or_metadata
+                            all_saved = all_saved and bool(saved)
+                            if saved:
+                                found_dois.update(record.doi.lower()
+                                    for record in paper_or_metadata.oairecords
+                                    if record.doi)
+                except MetadataSourceException as e:
+                    print "Searching CrossRef by ORCID failed: %s" % unicode(e)
+
+            # Let's grab the other papers with DOIs found in our ORCiD profile.
+            remaining = []
+            for doi, put_code in dois_and_putcodes:
+                if doi.lower() in found_dois:
+                    imported(put_code)
+                else:
+                    remaining.append((doi, put_code))
+            dois = [doi for doi, put_code in remaining]
             for idx, (success, paper_or_metadata) in enumerate(self.fetch_metadata_from_dois(cr_api, ref_name, orcid_id, dois)):
                 if success:
-                    yield paper_or_metadata
+                    saved = yield paper_or_metadata
+                    all_saved = all_saved and bool(saved)
+                    if saved:
+                        imported(remaining[idx][1])
                 else:
-                    put_codes.append(dois_and_putcodes[idx][1])
+                    put_codes.append(remaining[idx][1])
 
         # 2nd attempt with ORCID's own crappy metadata
-        works = profile.fetch_works(put_codes)
-        for work in works:
+        not_fetched = set(put_codes)
+        for work in profile.fetch_works(put_codes):
+            not_fetched.discard(work.put_code)
             if not work:
                 continue
 
@@ -220,43 +318,50 @@ class OrcidPaperSource(PaperSource):
                 ignored_papers.append(work.as_dict())
                 continue
 
-            yield self.create_paper(work)
+            saved = yield self.create_paper(work)
+            all_saved = all_saved and bool(saved)
+            if saved:
+                imported(work.put_code)
+
+        # works whose batch could not be fetched: retry them next time
+        if not_fetched:
+            all_saved = False
 
         self.warn_user_of_ignored_papers(ignored_papers)
         if ignored_papers:
             print('Warning: Total ignored papers: %d' % (len(ignored_papers)))
 
+        self.researcher.orcid_works = works
+        self.researcher.save(update_fields=['orcid_works'])
+
+        # All the papers have been saved: the next refresh can skip
+        # them if the profile does not change. (Otherwise the validators
+        # of the profile are not cached, so that the next refresh retries
+        # the works which failed.)
+        if all_saved:
+            profile.save_to_cache()
 
-    def bulk_import(self, directory, fetch_papers=True, use_doi=False):
+
+    def bulk_import(self, directory, fetch_papers=True, use_doi=False,
+                    workers=None, resume=False):
         """
-        Bulk-imports ORCID profiles from a dmup
+        Bulk-imports ORCID profiles from a dump
         (warning: this still uses our DOI cache).
         The directory should contain json versions
         of orcid profiles, as in the official ORCID
         dump.
-        """
 
-        for root, _, fnames in os.walk(directory):
-            for fname in fnames:
-                #if fname == '0000-0003-1349-4524.json':
-                #    seen = True
-                #if not seen:
-                #    continue
-
-                with open(path.join(root, fname), 'r') as f:
-                    try:
-                        profile = json.load(f)
-                        orcid = profile['orcid-profile'][
-                                        'orcid-identifier'][
-                                        'path']
-                        r = Researcher.get_or_create_by_orcid(
-                            orcid, profile, update=True)
-                        if fetch_papers:
-                            papers = self.fetch_orcid_records(orcid,
-                                profile=profile,
-                                use_doi=use_doi)
-                            for p in papers:
-                                self.save_paper(p, r)
-                    except (ValueError, KeyError):
-                        print "Invalid profile: %s" % fname
+        The profiles are processed in parallel by
+        :class:`backend.orciddump.OrcidDumpLoader`.
 
+        :param fetch_papers: also import the works of the profiles
+        :param use_doi: fetch the works with a DOI from CrossRef
+            (otherwise ORCID's own metadata is used)
+        :param workers: the number of worker processes
+        :param resume: continue the last interrupted import of this
+            directory after its last checkpoint
+        """
+        from backend.orciddump import OrcidDumpLoader
+        loader = OrcidDumpLoader(workers=workers, fetch_papers=fetch_papers,
+                                 use_doi=use_doi)
+        return loader.load(directory, resume=resume)
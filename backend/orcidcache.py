@@ -0,0 +1,91 @@
+# -*- encoding: utf-8 -*-
+
+# Dissemin: open access policy enforcement tool
+# Copyright (C) 2014 Antonin Delpeuch
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+A persistent cache of the documents fetched from the ORCID API.
+
+Each document (the profile, and the summary of its works) is stored
+with the ETag and Last-Modified headers it was served with, so that
+refreshing a profile sends conditional requests: when ORCID answers
+304 Not Modified, the cached document is used, and when nothing has
+changed in the profile the works are not fetched again at all
+(see :meth:`papers.orcid.OrcidProfile.unchanged`).
+"""
+
+from __future__ import unicode_literals
+
+from backend.doicache import compress_metadata
+from backend.doicache import decompress_metadata
+from django.db import IntegrityError
+from django.db import transaction
+from django.utils import timezone
+from papers.models import OrcidCacheEntry
+
+
+class OrcidCache(object):
+    """
+    Stores ORCID documents in the :class:`OrcidCacheEntry` table.
+    """
+
+    def get(self, orcid, element):
+        """
+        :returns: a triple (document, etag, last_modified),
+            or None if the document is not in the cache
+        """
+        try:
+            entry = OrcidCacheEntry.objects.get(orcid=orcid, element=element)
+        except OrcidCacheEntry.DoesNotExist:
+            return None
+        document = decompress_metadata(entry.compressed_json)
+        if document is None:
+            return None
+        return document, entry.etag, entry.last_modified
+
+    def put(self, orcid, element, document, etag, last_modified):
+        """
+        Stores (or refreshes) a document and its validators.
+        """
+        fields = {
+            'compressed_json': compress_metadata(document),
+            'etag': etag or '',
+            'last_modified': last_modified or '',
+            'last_fetched': timezone.now(),
+        }
+        if OrcidCacheEntry.objects.filter(
+                orcid=orcid, element=element).update(**fields):
+            return
+        try:
+            with transaction.atomic():
+                OrcidCacheEntry.objects.create(
+                    orcid=orcid, element=element, **fields)
+        except IntegrityError:
+            # stored by another worker in the meantime
+            pass
+
+    def clear(self, orcid):
+        """
+        Forgets the documents of a profile, so that the next
+        refresh processes it completely.
+        """
+        OrcidCacheEntry.objects.filter(orcid=orcid).delete()
+
+
+#! The cache used by :mod:`backend.orcid`
+orcid_cache = OrcidCache()
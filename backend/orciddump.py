@@ -0,0 +1,390 @@
+# -*- encoding: utf-8 -*-
+
+# Dissemin: open access policy enforcement tool
+# Copyright (C) 2014 Antonin Delpeuch
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+from __future__ import unicode_literals
+
+import json
+from multiprocessing import cpu_count
+from multiprocessing import Pool
+import os
+import threading
+import time
+
+import requests.exceptions
+
+from backend.crossref import CrossRefAPI
+from backend.httpclient import http_client
+from backend.orcid import add_orcid_record
+from backend.orcid import create_bare_paper_from_work
+from backend.orcid import OrcidPaperSource
+from backend.queues import wait_for_interactive_tasks
+from bulk_update.helper import bulk_update
+from django.db import connections
+from django.utils import timezone
+from papers.errors import MetadataSourceException
+from papers.models import HarvestState
+from papers.models import Paper
+from papers.models import Researcher
+from papers.orcid import OrcidProfile
+from papers.orcid import OrcidWorkSummary
+from papers.utils import jpath
+from papers.utils import validate_orcid
+from publishers.models import alias_counter
+
+######## ORCID dumps ###########
+#
+# ORCID distributes a yearly dump of the public profiles, as a directory
+# tree with one JSON file per profile. The files are sorted by name and
+# sent by chunks to a pool of worker processes, which parse the profiles,
+# fetch their works from the ORCID API and convert them to bare papers,
+# without accessing the database. The main process creates the
+# researchers and saves the papers in bulk.
+#
+# The progress of the import is checkpointed in a :class:`HarvestState`
+# (the cursor is the name of the last file whose papers have been saved),
+# so that an interrupted import can be resumed.
+#
+
+# Number of profiles sent to a worker at once
+orcid_dump_chunk_size = 20
+# Number of papers saved at once
+orcid_dump_batch_size = 500
+# Number of chunks read in advance, per worker
+orcid_dump_chunks_per_worker = 2
+# Number of profiles between two progress reports
+orcid_dump_report_interval = 1000
+
+
+def orcid_dump_harvest_name(directory):
+    """
+    The name of the :class:`HarvestState` recording the progress
+    of the import of a dump.
+    """
+    return 'orcid-dump:%s' % os.path.abspath(directory)
+
+
+def list_profile_files(directory, after=None):
+    """
+    The JSON files of a dump, as paths relative to its directory,
+    sorted by name.
+
+    :param after: only return the files after this one
+        (the cursor of the last checkpoint)
+    """
+    fnames = []
+    for root, _, files in os.walk(directory):
+        for fname in files:
+            if fname.endswith('.json'):
+                fnames.append(os.path.relpath(os.path.join(root, fname),
+                                              directory))
+    fnames.sort()
+    if after is not None:
+        fnames = [fname for fname in fnames if fname > after]
+    return fnames
+
+
+def profile_orcid(profile):
+    """
+    The ORCID iD of a profile from a dump, in the format of the
+    2.x API or in the older 'orcid-profile' format.
+    """
+    orcid = (jpath('orcid-identifier/path', profile) or
+             jpath('orcid-profile/orcid-identifier/path', profile))
+    return validate_orcid(orcid)
+
+
+def profile_work_summaries(profile):
+    """
+    The summaries of the works of a profile: the ones included in
+    the dump if any, otherwise they are fetched from the API.
+    """
+    works = jpath('activities-summary/works', profile.json)
+    if works is None:
+        return profile.work_summaries
+    return [OrcidWorkSummary(summary)
+            for group in works.get('group') or []
+            for summary in group.get('work-summary') or []]
+
+
+def parse_profile(directory, fname, fetch_papers=True, use_doi=False):
+    """
+    Parses a profile from a dump, and fetches its works.
+    This runs in the worker processes and does not access the database.
+
+    :returns: a dict with the file name, the ORCID iD and the JSON of the
+        profile, and its works as (DOI, bare paper, record fields) triples.
+        The DOI is only set when `use_doi` is, and the paper (created
+        from ORCID's metadata) is None if the work could not be imported.
+        Returns None if the profile is invalid.
+    """
+    try:
+        with open(os.path.join(directory, fname), 'r') as f:
+            js = json.load(f)
+    except (IOError, ValueError):
+        return None
+    orcid = profile_orcid(js)
+    if orcid is None:
+        return None
+    result = {'file': fname, 'orcid': orcid, 'profile': js,
+              'works': [], 'ignored': 0, 'error': None}
+    if not fetch_papers:
+        return result
+
+    try:
+        profile = OrcidProfile(json=js)
+        profile.id = orcid
+        dois = {}
+        for summary in profile_work_summaries(profile):
+            dois[summary.put_code] = summary.doi if use_doi else None
+        for work in profile.fetch_works(list(dois)):
+            doi = dois.pop(work.put_code, None)
+            if work.skipped:
+                result['ignored'] += 1
+                result['works'].append((doi, None, None))
+            else:
+                paper, fields = create_bare_paper_from_work(work)
+                result['works'].append((doi, paper, fields))
+        # works not returned by the API: only their DOI can be used
+        for doi in dois.values():
+            result['works'].append((doi, None, None))
+    except (MetadataSourceException, requests.exceptions.RequestException,
+            ValueError, KeyError, TypeError) as e:
+        result['error'] = unicode(e)
+    return result
+
+
+def init_dump_worker(nb_workers):
+    """
+    Initializes a worker process: the requests sent to each service by
+    all the workers should not exceed the configured rate limits
+    (see `settings.HTTP_RATE_LIMITS`).
+    """
+    http_client.divide_rate_limits(nb_workers)
+
+
+def parse_profile_chunk(args):
+    """
+    Parses a chunk of profiles with :func:`parse_profile`.
+
+    :param args: a tuple (directory, file names, fetch_papers, use_doi)
+    """
+    directory, fnames, fetch_papers, use_doi = args
+    return [(fname, parse_profile(directory, fname, fetch_papers, use_doi))
+            for fname in fnames]
+
+
+class OrcidDumpLoader(object):
+    """
+    Loads a dump of ORCID profiles into the database.
+    """
+
+    def __init__(self, workers=None, chunk_size=orcid_dump_chunk_size,
+                 batch_size=orcid_dump_batch_size, fetch_papers=True,
+                 use_doi=False):
+        """
+        :param workers: the number of worker processes parsing the
+            profiles (defaults to the number of CPUs)
+        :param chunk_size: the number of profiles sent to a worker at once
+        :param batch_size: the number of papers saved at once
+        :param fetch_papers: also import the works of the profiles
+        :param use_doi: fetch the works with a DOI from CrossRef (the
+            papers created from ORCID's metadata are only saved when
+            this fails)
+        """
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.fetch_papers = fetch_papers
+        self.use_doi = use_doi
+        self.source = OrcidPaperSource()
+        self.cr_api = CrossRefAPI()
+        self.profiles = 0
+        self.invalid = 0
+        self.failed = 0
+        self.ignored = 0
+        self.saved = 0
+        self.start_time = None
+
+    def load(self, directory, resume=False):
+        """
+        Loads the profiles stored in the given directory.
+
+        :param resume: continue the last interrupted import of this
+            directory after its last checkpoint (if there is one)
+        :returns: the :class:`HarvestState` of the import
+        """
+        state = HarvestState.get_by_name(orcid_dump_harvest_name(directory))
+        if resume and state.resumable:
+            print('Resuming the import of %s after %s (%d profiles already processed)' %
+                  (directory, state.cursor, state.records))
+        else:
+            state.start(from_date=None, until_date=timezone.now())
+        fnames = list_profile_files(directory, after=state.cursor)
+
+        # Database connections should not be shared with the workers
+        # (they do not use them, but would inherit them when forking)
+        for connection in connections.all():
+            if not connection.in_atomic_block:
+                connection.close()
+        workers = self.workers or cpu_count()
+        pool = Pool(workers, initializer=init_dump_worker,
+                    initargs=(workers,))
+        # Pool.imap reads its input as fast as it can: we bound the
+        # number of chunks in memory with a semaphore.
+        in_flight = threading.BoundedSemaphore(
+            orcid_dump_chunks_per_worker * workers)
+        stop = threading.Event()
+
+        def chunks():
+            for i in range(0, len(fnames), self.chunk_size):
+                # (not blocking, so that the pool can be terminated)
+                while not in_flight.acquire(False):
+                    if stop.is_set():
+                        return
+                    time.sleep(0.01)
+                yield (directory, fnames[i:i+self.chunk_size],
+                       self.fetch_papers, self.use_doi)
+
+        self.start_time = time.time()
+        last_report = 0
+        batch = []
+        # last file of the last chunk processed, and number of profiles
+        # processed since the last checkpoint
+        cursor = state.cursor
+        since_checkpoint = 0
+        try:
+            # Pool.imap returns the chunks in order: all the files
+            # before the cursor have been processed when we checkpoint.
+            for results in pool.imap(parse_profile_chunk, chunks()):
+                in_flight.release()
+                for fname, result in results:
+                    self.profiles += 1
+                    batch.extend(self.process_profile(fname, result))
+                cursor = results[-1][0]
+                since_checkpoint += len(results)
+                if len(batch) >= self.batch_size:
+                    self.save_batch(batch)
+                    batch = []
+                    state.checkpoint(cursor, since_checkpoint)
+                    since_checkpoint = 0
+                if self.profiles - last_report >= orcid_dump_report_interval:
+                    print(self.report())
+                    last_report = self.profiles
+            self.save_batch(batch)
+            alias_counter.flush()
+            pool.close()
+        except BaseException:
+            # the papers of the current batch have not been saved:
+            # the import resumes at the last checkpoint
+            state.interrupt()
+            raise
+        finally:
+            stop.set()
+            pool.terminate()
+
+        state.checkpoint(cursor, since_checkpoint)
+        state.finish()
+        print(self.report())
+        return state
+
+    def process_profile(self, fname, result):
+        """
+        Creates (or updates) the researcher of a profile parsed by
+        :func:`parse_profile`.
+
+        :returns: the list of bare papers to save for this profile
+        """
+        if result is None:
+            print('Invalid profile: %s' % fname)
+            self.invalid += 1
+            return []
+        try:
+            researcher = Researcher.get_or_create_by_orcid(
+                result['orcid'], result['profile'], update=True)
+        except (MetadataSourceException, ValueError, KeyError, TypeError):
+            researcher = None
+        if researcher is None:
+            print('Invalid profile: %s' % fname)
+            self.invalid += 1
+            return []
+        if result['error']:
+            print('Fetching the works of %s failed: %s' %
+                  (result['orcid'], result['error']))
+            self.failed += 1
+        self.ignored += result['ignored']
+
+        papers = []
+        works = result['works']
+        if self.use_doi:
+            dois = [doi for doi, paper, fields in works if doi]
+            ref_name = OrcidProfile(json=result['profile']).name
+            found = set()
+            try:
+                for success, paper_or_metadata in self.source.fetch_metadata_from_dois(
+                        self.cr_api, ref_name, result['orcid'], dois):
+                    if success:
+                        papers.append(paper_or_metadata)
+                        found.update(record.doi.lower()
+                            for record in paper_or_metadata.oairecords
+                            if record.doi)
+            except MetadataSourceException as e:
+                print('Fetching the DOIs of %s failed: %s' %
+                      (result['orcid'], unicode(e)))
+            # ORCID's metadata is used when the DOI could not be fetched
+            works = [(doi, paper, fields) for doi, paper, fields in works
+                     if not doi or doi.lower() not in found]
+        for doi, paper, fields in works:
+            if paper is not None:
+                papers.append(add_orcid_record(paper, fields))
+        return papers
+
+    def save_batch(self, batch):
+        """
+        Saves a list of bare papers, and links their authors to the
+        researchers with the same ORCID iDs.
+        """
+        if not batch:
+            return
+        wait_for_interactive_tasks()
+        saved = Paper.bulk_from_bare(batch)
+        orcids = set(author['orcid'] for paper in saved
+                     for author in paper.authors_list if author['orcid'])
+        researcher_ids = dict(Researcher.objects.filter(
+            orcid__in=orcids).values_list('orcid', 'id'))
+        for paper in saved:
+            for author in paper.authors_list:
+                author['researcher_id'] = researcher_ids.get(author['orcid'])
+        bulk_update(saved, update_fields=['authors_list'])
+        Paper.update_index_bulk(saved)
+        self.saved += len(saved)
+
+    def profiles_per_second(self):
+        if not self.start_time:
+            return 0.
+        elapsed = time.time() - self.start_time
+        if not elapsed:
+            return 0.
+        return self.profiles / elapsed
+
+    def report(self):
+        return ('%d profiles read, %d invalid, %d failed, %d works ignored, '
+                '%d papers saved (%.1f profiles/s)' % (
+                    self.profiles, self.invalid, self.failed, self.ignored,
+                    self.saved, self.profiles_per_second()))
@@ -47,6 +47,10 @@ class PaperSource(object):
         This function is the one subclasses should reimplement.
         Given a researcher, it should yield all the papers it can
         fetch from the source.
+
+        When the papers are saved by :meth:`fetch_and_save`, each `yield`
+        expression evaluates to whether the paper it yielded was saved
+        (otherwise it evaluates to None).
         """
         raise NotImplementedError(
             "fetch_papers should be implemented by the subclass")
@@ -66,11 +70,24 @@ class PaperSource(object):
             papers are fetched on the fly for an user.
         """
         count = 0
-        for p in self.fetch_bare(researcher):
+        papers = iter(self.fetch_bare(researcher))
+        # generators are told whether the last paper they yielded was saved
+        send = getattr(papers, 'send', None)
+        saved = None
+        while True:
+            try:
+                if saved is None or send is None:
+                    p = next(papers)
+                else:
+                    p = send(saved)
+            except StopIteration:
+                break
             try:
                 self.save_paper(p, researcher)
             except ValueError:
+                saved = False
                 continue
+            saved = True
             if self.max_results is not None and count >= self.max_results:
                 break
 
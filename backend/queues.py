@@ -0,0 +1,157 @@
+# -*- encoding: utf-8 -*-
+
+# Dissemin: open access policy enforcement tool
+# Copyright (C) 2014 Antonin Delpeuch
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+from __future__ import unicode_literals
+
+import time
+
+from celery.signals import before_task_publish
+from celery.signals import task_prerun
+from celery.utils.log import get_task_logger
+from dissemin.settings import redis_client
+from django.conf import settings
+from redis.exceptions import RedisError
+
+######## Celery queues ###########
+#
+# Tasks are routed to three queues (see CELERY_ROUTES in the settings):
+#
+# - 'interactive': the tasks a user is waiting for, such as the creation
+#   of a profile from ORCID. They have their own workers (see celery.sh);
+# - 'default': short periodic tasks, and the tasks without a route;
+# - 'bulk': long ingestion and maintenance jobs, run by few workers.
+#
+# Bulk jobs also pause regularly while the interactive queue is backed up
+# (see wait_for_interactive_tasks), as they compete with interactive
+# tasks for the database and the external APIs.
+#
+# The time tasks spend in their queue is recorded for each queue,
+# see queue_report.
+#
+
+logger = get_task_logger(__name__)
+
+# The queues, by decreasing priority
+task_queues = ['interactive', 'default', 'bulk']
+# Name of the Redis list of the latest latencies of a queue
+queue_latency_key = 'queue-latency:%s'
+# Number of latencies kept per queue
+queue_latency_samples = 1000
+# Time between two checks of the interactive queue when a bulk job
+# is paused (in seconds)
+bulk_pause_interval = 5
+
+
+def queue_length(queue):
+    """
+    The number of tasks waiting in a queue (0 if Redis is unavailable).
+    """
+    try:
+        return redis_client.llen(queue)
+    except RedisError:
+        return 0
+
+
+def interactive_backlog():
+    """
+    Are more than `settings.CELERY_INTERACTIVE_MAX_BACKLOG` tasks
+    waiting in the interactive queue?
+    """
+    return queue_length('interactive') > settings.CELERY_INTERACTIVE_MAX_BACKLOG
+
+
+def wait_for_interactive_tasks(max_pause=None):
+    """
+    Pauses a bulk job while the interactive queue is backed up.
+    Bulk jobs call this between two batches.
+
+    :param max_pause: the maximum time to wait, after which the job
+        resumes anyway (defaults to `settings.BULK_MAX_PAUSE`; jobs paging
+        through an API should use `settings.BULK_CURSOR_MAX_PAUSE`, so that
+        their cursor does not expire)
+    :returns: the time paused (in seconds)
+    """
+    max_pause = max_pause or settings.BULK_MAX_PAUSE
+    start = time.time()
+    deadline = start + max_pause.total_seconds()
+    if not interactive_backlog():
+        return 0.
+    logger.info('Interactive queue backed up: pausing bulk job')
+    while time.time() < deadline and interactive_backlog():
+        time.sleep(bulk_pause_interval)
+    paused = time.time() - start
+    logger.info('Bulk job resumed after %.0f s' % paused)
+    return paused
+
+
+@before_task_publish.connect
+def record_publication_time(headers=None, **kwargs):
+    """
+    Stores the time a task is sent in its headers, to compute the
+    time it spends in its queue.
+    """
+    if headers is not None:
+        headers['published_at'] = time.time()
+
+
+@task_prerun.connect
+def record_queue_latency(task=None, **kwargs):
+    """
+    Records the time the task spent in its queue.
+    """
+    published_at = getattr(task.request, 'published_at', None)
+    if published_at is None:
+        return
+    queue = (task.request.delivery_info or {}).get('routing_key') or 'default'
+    key = queue_latency_key % queue
+    try:
+        pipe = redis_client.pipeline()
+        pipe.lpush(key, time.time() - float(published_at))
+        pipe.ltrim(key, 0, queue_latency_samples - 1)
+        pipe.execute()
+    except RedisError:
+        pass
+
+
+def queue_latencies(queue):
+    """
+    The latest latencies of the tasks of a queue (in seconds, sorted).
+    """
+    return sorted(float(latency) for latency in
+                  redis_client.lrange(queue_latency_key % queue, 0, -1))
+
+
+def queue_report():
+    """
+    The length of each queue, and the median, 95th percentile and
+    maximum time their latest tasks waited, as a string.
+    """
+    lines = []
+    for queue in task_queues:
+        line = '%s: %d waiting' % (queue, queue_length(queue))
+        latencies = queue_latencies(queue)
+        if latencies:
+            line += (', latency: median %.1f s, p95 %.1f s, max %.1f s '
+                     '(last %d tasks)' % (
+                        latencies[len(latencies) // 2],
+                        latencies[int(len(latencies) * 0.95)],
+                        latencies[-1], len(latencies)))
+        lines.append(line)
+    return '\n'.join(lines)
@@ -0,0 +1,228 @@
+# -*- encoding: utf-8 -*-
+
+# Dissemin: open access policy enforcement tool
+# Copyright (C) 2014 Antonin Delpeuch
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+from __future__ import unicode_literals
+
+import time
+
+from backend.queues import interactive_backlog
+from dissemin.settings import redis_client
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from papers.models import HarvestState
+from papers.models import Researcher
+
+######## Background refresh of researchers ###########
+#
+# The researchers harvested in the last RESEARCHER_REFRESH_MAX_AGE are
+# refreshed every RESEARCHER_REFRESH_INTERVAL, one Celery task per
+# researcher. The scheduler runs every RESEARCHER_REFRESH_PERIOD and
+# enqueues a chunk of refreshes, the most urgent first (see
+# refresh_priority). The size of the chunk is bounded by:
+#
+# - the number of refreshes which can still be queued or running, so that
+#   at most RESEARCHER_REFRESH_MAX_RUNNING run at once on all the workers
+#   (they are tracked in Redis, as they can run on any worker);
+# - the share of the ORCID and CrossRef APIs devoted to refreshes
+#   (RESEARCHER_REFRESH_BUDGETS). The refreshes of a chunk are also
+#   spread over the period.
+#
+# The progress is recorded in the HarvestState 'researcher-refresh',
+# where the admin shows the number of refreshes due and the ETA.
+#
+
+# Name of the Redis hash of the refreshes queued or running
+# (the ids of the researchers, with the time they were enqueued)
+refresh_running_key = 'researcher-refresh:running'
+# Name of the Redis counter of the refreshes completed since the
+# last run of the scheduler
+refresh_completed_key = 'researcher-refresh:completed'
+# Refreshes enqueued for longer than that (in seconds) are considered
+# lost (for instance if their worker was killed)
+refresh_timeout = 2*3600
+# Name of the HarvestState recording the progress of the refreshes
+refresh_harvest_name = 'researcher-refresh'
+# Weight of the staleness of researchers with an account, and of
+# researchers who logged in since their last refresh
+refresh_user_weight = 2
+refresh_login_weight = 4
+
+
+def refresh_priority(researcher, now):
+    """
+    The priority of the refresh of a researcher: the time since its last
+    harvest (in days), weighted by the activity of the researcher.
+    """
+    if researcher.last_harvest is None:
+        staleness = settings.RESEARCHER_REFRESH_MAX_AGE
+    else:
+        staleness = now - researcher.last_harvest
+    weight = 1
+    user = researcher.user
+    if user is not None:
+        weight = refresh_user_weight
+        if (user.last_login and researcher.last_harvest and
+                user.last_login > researcher.last_harvest):
+            weight = refresh_login_weight
+    return weight * staleness.total_seconds() / 86400.
+
+
+def start_refresh(pk):
+    """
+    Records that the refresh of a researcher has been enqueued.
+    """
+    redis_client.hset(refresh_running_key, pk, time.time())
+
+
+def finish_refresh(pk):
+    """
+    Records that the refresh of a researcher is over.
+    """
+    pipe = redis_client.pipeline()
+    pipe.hdel(refresh_running_key, pk)
+    pipe.incr(refresh_completed_key)
+    pipe.execute()
+
+
+class ResearcherRefreshScheduler(object):
+    """
+    Enqueues the background refreshes of researchers.
+    """
+
+    def __init__(self, chunk_size=None, max_running=None, budgets=None):
+        """
+        :param chunk_size: the maximum number of refreshes enqueued
+            at each run (defaults to `settings.RESEARCHER_REFRESH_CHUNK_SIZE`)
+        :param max_running: the maximum number of refreshes queued
+            or running at once (`settings.RESEARCHER_REFRESH_MAX_RUNNING`)
+        :param budgets: the share of the APIs used by the refreshes
+            (`settings.RESEARCHER_REFRESH_BUDGETS`)
+        """
+        self.chunk_size = chunk_size or settings.RESEARCHER_REFRESH_CHUNK_SIZE
+        self.max_running = (max_running or
+                            settings.RESEARCHER_REFRESH_MAX_RUNNING)
+        self.budgets = budgets or settings.RESEARCHER_REFRESH_BUDGETS
+        self.period = settings.RESEARCHER_REFRESH_PERIOD
+
+    def due(self, now=None):
+        """
+        The researchers whose refresh is due (queued or not).
+        """
+        now = now or timezone.now()
+        return Researcher.objects.filter(
+            last_harvest__gt=now - settings.RESEARCHER_REFRESH_MAX_AGE,
+            last_harvest__lt=now - settings.RESEARCHER_REFRESH_INTERVAL)
+
+    def running(self):
+        """
+        The ids of the researchers whose refresh is queued or running
+        (forgetting the ones which timed out).
+        """
+        running = set()
+        expired = []
+        deadline = time.time() - refresh_timeout
+        for pk, enqueued in redis_client.hgetall(refresh_running_key).items():
+            if float(enqueued) < deadline:
+                expired.append(pk)
+            else:
+                running.add(int(pk))
+        if expired:
+            redis_client.hdel(refresh_running_key, *expired)
+        return running
+
+    def budget(self):
+        """
+        The number of refreshes allowed by the API budgets at each run.
+        """
+        minutes = self.period.total_seconds() / 60.
+        return min([int(requests * minutes / cost)
+                    for requests, cost in self.budgets.values()] +
+                   [self.chunk_size])
+
+    def select(self, researchers, count, now=None):
+        """
+        The `count` researchers with the highest priority, among
+        the given ones.
+
+        Only the researchers which are the most stale overall, or among
+        the ones with an account, are considered.
+        """
+        if count <= 0:
+            return []
+        now = now or timezone.now()
+        researchers = researchers.select_related('user').order_by('last_harvest')
+        candidates = {r.pk: r for r in researchers[:4*count]}
+        for r in researchers.filter(~Q(user=None))[:count]:
+            candidates[r.pk] = r
+        return sorted(candidates.values(),
+                      key=lambda r: refresh_priority(r, now),
+                      reverse=True)[:count]
+
+    def run(self):
+        """
+        Enqueues the next chunk of refreshes and records the progress.
+
+        :returns: the list of researchers whose refresh was enqueued
+        """
+        from backend.tasks import refresh_researcher
+        now = timezone.now()
+        running = self.running()
+        waiting = self.due(now).exclude(pk__in=running)
+        count = min(self.budget(), self.max_running - len(running))
+        if interactive_backlog():
+            # leave the APIs to the users waiting for their profiles
+            count = 0
+        selected = self.select(waiting, count, now)
+        for idx, researcher in enumerate(selected):
+            start_refresh(researcher.pk)
+            # spread the refreshes over the period
+            refresh_researcher.apply_async(
+                kwargs={'pk': researcher.pk},
+                countdown=idx * self.period.total_seconds() / len(selected))
+
+        completed = int(redis_client.getset(refresh_completed_key, 0) or 0)
+        remaining = waiting.count() + len(running)
+        state = HarvestState.get_by_name(refresh_harvest_name)
+        if state.status != 'running':
+            if not remaining:
+                return selected
+            state.start(from_date=now - settings.RESEARCHER_REFRESH_MAX_AGE,
+                        until_date=now)
+        state.checkpoint(None, completed, remaining=remaining)
+        if not remaining:
+            state.finish()
+        return selected
+
+    def status(self):
+        """
+        :returns: a triple: the number of refreshes due (the queue depth),
+            the number of refreshes queued or running, and the estimated
+            time left before all the due refreshes are done (or None)
+        """
+        running = self.running()
+        waiting = self.due().exclude(pk__in=running).count()
+        state = HarvestState.get_by_name(refresh_harvest_name)
+        return waiting + len(running), len(running), state.eta()
+
+    def report(self):
+        due, running, eta = self.status()
+        return '%d researcher refreshes due, %d running, ETA: %s' % (
+            due, running, eta or 'unknown')
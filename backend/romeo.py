@@ -28,10 +28,15 @@ import requests.exceptions
 from backend.utils import cached_urlopen_retry
 from dissemin.settings import ROMEO_API_DOMAIN
 from dissemin.settings import ROMEO_API_KEY
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 from lxml import etree as ET
 from lxml.html import fromstring
 from papers.errors import MetadataSourceException
 from papers.utils import kill_html
+from papers.utils import LRUCache
 from papers.utils import nstrip
 from papers.utils import remove_diacritics
 from papers.utils import sanitize_html
@@ -52,6 +57,82 @@ PUBLISHER_NAME_ASSOCIATION_THRESHOLD = 1000
 # and the second one
 PUBLISHER_NAME_ASSOCIATION_FACTOR = 10
 
+# Maximum number of journal (and publisher) resolutions cached in memory
+RESOLUTION_CACHE_SIZE = 100000
+# Lifetime of the cached resolutions (in seconds). Each process has its
+# own caches and only invalidates them when it saves journals or
+# publishers itself, so changes made by other processes (web server,
+# Celery workers) are only seen once the stale entries expire.
+RESOLUTION_CACHE_TTL = 3600
+
+#! Results of :func:`fetch_journal`, by (ISSN, normalized title, matching mode)
+journal_resolution_cache = LRUCache(RESOLUTION_CACHE_SIZE,
+                                    ttl=RESOLUTION_CACHE_TTL)
+#! Results of :func:`fetch_publisher`, by name: pairs of the publisher
+# (or None) and whether an alias was used (so it should be incremented)
+publisher_resolution_cache = LRUCache(RESOLUTION_CACHE_SIZE,
+                                      ttl=RESOLUTION_CACHE_TTL)
+
+
+def cache_resolution(cache, key, value, tags=()):
+    """
+    Caches the result of a resolution once the current transaction
+    is committed (so that we never cache rows which are rolled back).
+    """
+    transaction.on_commit(lambda: cache.set(key, value, tags=tags))
+
+
+def journal_resolution_tags(key, journal):
+    """
+    The tags of a journal resolution, used to invalidate it when
+    a matching journal or its publisher is saved.
+    """
+    issn, title, matching_mode = key
+    tags = []
+    if issn:
+        tags.append(('issn', issn))
+    if title:
+        tags.append(('title', title))
+    if journal is not None:
+        tags.append(('journal', journal.pk))
+        tags.append(('publisher', journal.publisher_id))
+    return tags
+
+
+def publisher_resolution_tags(result):
+    """
+    The tags of a publisher resolution (the name is the key itself).
+    """
+    if result[0] is None:
+        return []
+    return [('publisher', result[0].pk)]
+
+
+@receiver(post_save, sender=Journal)
+@receiver(post_delete, sender=Journal)
+def invalidate_journal_resolutions(sender, instance, **kwargs):
+    # failed resolutions of that ISSN or title might succeed now
+    if instance.issn:
+        journal_resolution_cache.discard_tag(('issn', instance.issn))
+    if instance.title:
+        journal_resolution_cache.discard_tag(('title', instance.title.lower()))
+    journal_resolution_cache.discard_tag(('journal', instance.pk))
+
+
+@receiver(post_save, sender=Publisher)
+@receiver(post_delete, sender=Publisher)
+def invalidate_publisher_resolutions(sender, instance, **kwargs):
+    journal_resolution_cache.discard_tag(('publisher', instance.pk))
+    publisher_resolution_cache.discard_tag(('publisher', instance.pk))
+    # a failed resolution of that name might succeed now
+    publisher_resolution_cache.discard(instance.name)
+
+
+def resolution_cache_report():
+    return 'journals: %s\npublishers: %s' % (
+        journal_resolution_cache.report(),
+        publisher_resolution_cache.report())
+
 
 def perform_romeo_query(search_terms):
     search_terms = search_terms.copy()
@@ -122,6 +203,22 @@ def fetch_journal(search_terms, matching_mode='exact'):
         if len(terms[key]) > 256:
             return None
 
+    key = (terms.get('issn'), terms.get('jtitle', '').lower(), matching_mode)
+    found, journal = journal_resolution_cache.lookup(key)
+    if found:
+        return journal
+
+    journal = find_or_fetch_journal(terms, matching_mode)
+    cache_resolution(journal_resolution_cache, key, journal,
+                     journal_resolution_tags(key, journal))
+    return journal
+
+
+def find_or_fetch_journal(terms, matching_mode):
+    """
+    Looks up a journal in the model, and then in RoMEO
+    (bypassing the resolution cache).
+    """
     # First check we don't have it already
     journal = find_journal_in_model(terms)
     if journal:
@@ -179,32 +276,68 @@ def fetch_journal(search_terms, matching_mode='exact'):
 
 
 def fetch_publisher(publisher_name):
+    """
+    Finds the publisher associated with a name, from our aliases
+    or from RoMEO. Results are cached.
+    """
     if publisher_name is None:
         return
 
+    found, result = publisher_resolution_cache.lookup(publisher_name)
+    if not found:
+        result = find_or_fetch_publisher(publisher_name)
+        cache_resolution(publisher_resolution_cache, publisher_name, result,
+                         publisher_resolution_tags(result))
+    publisher, from_alias = result
+    if from_alias:
+        AliasPublisher.increment(publisher_name, publisher)
+    return publisher
+
+
+def count_publisher_alias(publisher_name, publisher):
+    """
+    Records that a publisher name has been associated with a publisher
+    (for instance through the journal of a publication).
+    """
+    if not publisher_name or publisher is None:
+        return
+    AliasPublisher.increment(publisher_name, publisher)
+    # a failed resolution of that name might succeed now
+    publisher_resolution_cache.discard(
+        publisher_name, lambda result: result[0] is None)
+
+
+def find_or_fetch_publisher(publisher_name):
+    """
+    Looks up a publisher by name (bypassing the resolution cache).
+
+    :returns: a pair: the publisher (or None), and whether the name
+        should be counted as an alias for it
+    """
     # First, let's see if we have a publisher with that name
     matching_publishers = Publisher.objects.filter(name=publisher_name)
     if len(matching_publishers) == 1:
-        return matching_publishers[0]
+        return matching_publishers[0], False
 
     # Second, let's see if the publisher name has often been associated to a
     # known publisher
-    aliases = list(AliasPublisher.objects.filter(
-        name=publisher_name).order_by('-count')[:2])
+    # (the counts include the increments which are not flushed yet)
+    aliases = AliasPublisher.counts_for(publisher_name)[:2]
     if len(aliases) == 1:
         # Only one publisher found. If it has been seen often enough under that name,
         # keep it!
-        if aliases[0].count > PUBLISHER_NAME_ASSOCIATION_THRESHOLD:
-            AliasPublisher.increment(publisher_name, aliases[0].publisher)
-            return aliases[0].publisher
+        publisher, count = aliases[0]
+        if count > PUBLISHER_NAME_ASSOCIATION_THRESHOLD:
+            return publisher, True
     elif len(aliases) == 2:
         # More than one publisher found (two aliases returned as we limited to the two first
         # results). Then we need to make sure the first one appears a lot more often than
         # the first
-        if (aliases[0].count > PUBLISHER_NAME_ASSOCIATION_THRESHOLD and
-                aliases[0].count > PUBLISHER_NAME_ASSOCIATION_FACTOR*aliases[1].count):
-            AliasPublisher.increment(publisher_name, aliases[0].publisher)
-            return aliases[0].publisher
+        publisher, count = aliases[0]
+        second_count = aliases[1][1]
+        if (count > PUBLISHER_NAME_ASSOCIATION_THRESHOLD and
+                count > PUBLISHER_NAME_ASSOCIATION_FACTOR*second_count):
+            return publisher, True
 
     # Otherwise, let's try to fetch the publisher from RoMEO!
 
@@ -218,17 +351,16 @@ def fetch_publisher(publisher_name):
     # Find the publisher
     publishers = root.findall('./publishers/publisher')
     if len(publishers) == 0:
-        return
+        return None, False
     elif len(publishers) > 1:
         search_terms['qtype'] = 'exact'
         root = perform_romeo_query(search_terms)
         publishers = root.findall('./publishers/publisher')
         if len(publishers) != 1:
-            return
+            return None, False
 
     publisher = get_or_create_publisher(publishers[0])
-    AliasPublisher.increment(publisher_name, publisher)
-    return publisher
+    return publisher, True
 
 
 def get_or_create_publisher(romeo_xml_description):
@@ -21,15 +21,21 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+from datetime import timedelta
 from statistics.models import AccessStatistics
 
-from datetime import timedelta
 from backend.zotero import consolidate_publication
 from backend.orcid import OrcidPaperSource
 from backend.crossref import CrossRefAPI
+from backend.oaiharvester import configured_endpoints
+from backend.oaiharvester import OaiHarvestScheduler
+from backend.queues import wait_for_interactive_tasks
+from backend.refresh import finish_refresh
+from backend.refresh import ResearcherRefreshScheduler
 from backend.utils import run_only_once
 from celery import shared_task
 from celery.utils.log import get_task_logger
+from django.conf import settings
 from django.utils import timezone
 from papers.errors import MetadataSourceException
 from papers.models import Paper
@@ -94,10 +100,29 @@ def fetch_everything_for_researcher(pk):
         r.harvester = None
         update_researcher_task(r, None)
 
-def refetch_researchers(start_time=timezone.now() - timedelta(days=30*6)):
-    for r in Researcher.objects.filter(last_harvest__gt=start_time).order_by('last_harvest'):
-        print(r.url)
-        fetch_everything_for_researcher(r.pk)
+
+@shared_task(name='refresh_researcher')
+def refresh_researcher(pk):
+    """
+    Background refresh of a researcher, enqueued by
+    :class:`backend.refresh.ResearcherRefreshScheduler`
+    """
+    try:
+        fetch_everything_for_researcher(pk)
+    finally:
+        finish_refresh(pk)
+
+
+@shared_task(name='schedule_researcher_refreshes')
+@run_only_once('schedule_researcher_refreshes', timeout=10*60)
+def schedule_researcher_refreshes():
+    """
+    Enqueues the next chunk of background refreshes of researchers
+    (see :mod:`backend.refresh`)
+    """
+    scheduler = ResearcherRefreshScheduler()
+    scheduler.run()
+    logger.info(scheduler.report())
 
 
 @shared_task(name='change_publisher_oa_status')
@@ -123,15 +148,19 @@ def consolidate_paper(pk):
 
 
 @shared_task(name='update_all_stats')
-@run_only_once('refresh_stats', timeout=3*60)
+@run_only_once('refresh_stats', timeout=60*60)
 def update_all_stats():
     """
     Updates the stats for every model using them
     """
-    AccessStatistics.update_all_stats(PaperWorld)
-    AccessStatistics.update_all_stats(Publisher)
-    AccessStatistics.update_all_stats(Journal)
-    AccessStatistics.update_all_stats(Institution)
+    # the pauses are bounded in total, so that the task finishes
+    # before its lock expires
+    pause_budget = settings.BULK_MAX_PAUSE.total_seconds()
+    for model in [PaperWorld, Publisher, Journal, Institution]:
+        if pause_budget > 0:
+            pause_budget -= wait_for_interactive_tasks(
+                max_pause=timedelta(seconds=pause_budget))
+        AccessStatistics.update_all_stats(model)
     #AccessStatistics.update_all_stats(Researcher)
     #AccessStatistics.update_all_stats(Department)
 
@@ -151,8 +180,20 @@ def update_journal_stats():
 @run_only_once('update_crossref', timeout=24*3600)
 def update_crossref():
     """
-    Updates paper metadata from Crossref
+    Updates paper metadata from Crossref (resuming the last
+    ingestion if it was interrupted)
     """
     c = CrossRefAPI()
-    c.fetch_and_save_new_records()
+    c.fetch_and_save_new_records(resume=True)
 
+
+@shared_task(name='harvest_oai_endpoints')
+@run_only_once('harvest_oai_endpoints', timeout=24*3600)
+def harvest_oai_endpoints():
+    """
+    Harvests the OAI-PMH endpoints listed in the settings, concurrently
+    (see :mod:`backend.oaiharvester`)
+    """
+    scheduler = OaiHarvestScheduler(configured_endpoints())
+    scheduler.run()
+    logger.info(scheduler.report())
@@ -21,19 +21,24 @@
 from __future__ import unicode_literals
 
 import datetime
+import itertools
 import unittest
 
+import requests_mock
+
 from backend.crossref import convert_to_name_pair
 from backend.crossref import CrossRefAPI
+from backend.crossref import CrossRefHarvester
 from backend.crossref import DOI_PROXY_SUPPORTS_BATCH
 from backend.crossref import fetch_dois_by_batch
 from backend.crossref import fetch_dois_incrementally
 from backend.crossref import fetch_metadata_by_DOI
 from backend.crossref import get_publication_date
 from backend.crossref import is_oa_license
+from backend.crossref import iter_dois_by_batch
 from backend.crossref import parse_crossref_date
 from django.test import TestCase
-from papers.errors import MetadataSourceException
+from papers.models import OaiRecord
 
 
 class CrossRefTest(TestCase):
@@ -103,6 +108,23 @@ class CrossRefTest(TestCase):
         self.assertTrue(self.api.create_paper_by_doi('10.15200/winn.145838.88372').pdf_url)
         self.assertFalse(self.api.create_paper_by_doi('10.5061/dryad.b167g').pdf_url)
 
+    def test_save_doi_metadata_bulk(self):
+        items = list(itertools.islice(self.api.fetch_all_records(
+            filters={'issn':'0302-9743'}, rows=20), 20))
+        papers = self.api.save_doi_metadata_bulk(items)
+        self.assertTrue(len(papers) > 10)
+        for p in papers:
+            self.assertTrue(p.pk)
+            self.assertEqual(p.fingerprint, p.new_fingerprint())
+        dois = set(r.doi for p in papers for r in p.oairecords)
+
+        # Saving the same page again merges with the existing papers
+        again = self.api.save_doi_metadata_bulk(items)
+        self.assertEqual(set(p.pk for p in again),
+                         set(p.pk for p in papers))
+        self.assertEqual(OaiRecord.objects.filter(doi__in=dois).count(),
+                         len(dois))
+
     def test_fetch_papers(self):
         generator = self.api.fetch_all_records(filters={'issn':'0302-9743'})
         for i in range(30):
@@ -135,6 +157,46 @@ class CrossRefUnitTest(unittest.TestCase):
                           'ISSN': ['2179-7412', '1807-3883'],
                           'member': 'http://id.crossref.org/member/3785'})
 
+    def test_harvester(self):
+        harvester = CrossRefHarvester(filters={'issn':'0302-9743'}, rows=10)
+        records = harvester.iter_pages()
+        for i in range(3):
+            page = next(records)
+            self.assertEqual(len(page), 10)
+        self.assertEqual(harvester.pages, 3)
+        self.assertEqual(harvester.records, 30)
+        self.assertTrue(harvester.bytes > 0)
+        self.assertNotEqual(harvester.cursor, '*')
+
+        # restarting from the checkpoint yields the last page again
+        resumed = CrossRefHarvester(filters={'issn':'0302-9743'}, rows=10,
+                                    cursor=harvester.cursor)
+        self.assertEqual([item['DOI'] for item in next(resumed.iter_pages())],
+                         [item['DOI'] for item in page])
+
+    @requests_mock.Mocker()
+    def test_fetch_all_papers(self, m):
+        def works(request, context):
+            offset = int(request.qs.get('offset', ['0'])[0])
+            return {'status': 'ok', 'message': {
+                'total-results': 25,
+                'items': [{'DOI': '10.1234/%d' % i}
+                          for i in range(offset, min(offset + 10, 25))]}}
+        m.get('https://api.crossref.org/works', json=works)
+
+        api = CrossRefAPI()
+        dois = [item['DOI'] for item in api.fetch_all_papers(
+                {'orcid': '0000-0002-8612-8827'}, rows=10)]
+        self.assertEqual(sorted(dois),
+                         sorted('10.1234/%d' % i for i in range(25)))
+        self.assertEqual(m.call_count, 3)
+        self.assertEqual(m.request_history[0].qs['filter'],
+                         ['orcid:0000-0002-8612-8827'])
+
+        dois = list(api.fetch_all_papers({'orcid': '0000-0002-8612-8827'},
+                                         rows=10, max_pages=2))
+        self.assertEqual(len(dois), 20)
+
     def test_parse_crossref_date_incomplete(self):
         self.assertEqual(parse_crossref_date(None), None)
         self.assertEqual(
@@ -196,6 +258,24 @@ class CrossRefUnitTest(unittest.TestCase):
             self.assertEqual([item['DOI'] for item in incremental],
                              [item['DOI'] for item in batch])
 
+    def test_iter_dois_by_batch(self):
+        dois = [
+            '10.1007/978-3-540-46375-7_2',
+            '10.2307/2540916',
+            '10.5281/zenodo.12826',
+            '10.1051/proc/2011014',
+            '10.1103/physreve.79.026303',
+            '10.5281/anuirsetacesecesrbl',
+        ] * 10
+        results = iter_dois_by_batch(dois, workers=3)
+        self.assertEqual(next(results)['DOI'], dois[0])
+        results = [next(results)] + list(results)
+        self.assertEqual(len(results), len(dois) - 1)
+        self.assertEqual([item['DOI'].lower() if item else None
+                          for item in results],
+                         [doi if 'anuirse' not in doi else None
+                          for doi in dois[1:]])
+
     def test_batch_with_comma(self):
         """
         Having a comma in a DOI should not fail the whole batch, just ignore
@@ -207,9 +287,12 @@ class CrossRefUnitTest(unittest.TestCase):
         self.assertTrue('10.1080/14786430410001678217' in fetched_dois)
 
     def test_dirty_batches(self):
-        with self.assertRaises(MetadataSourceException):
-            fetch_dois_by_batch(['aunirestauniecb898989']
-                                )  # definitely not a DOI
+        # a failed batch is not served, but does not interrupt the stream
+        dois = (['aunirestauniecb898989'] * 25 +  # definitely not a DOI
+                ['10.1080/14786430410001678217'])
+        results = fetch_dois_by_batch(dois)
+        self.assertTrue(all([item is None for item in results[:-1]]))
+        self.assertEqual(results[-1]['DOI'], dois[-1])
 
         dois = ['10.5281/anuirsetacesecesrbl']  # probably not a DOI
         results = fetch_dois_by_batch(dois)
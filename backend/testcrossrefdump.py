@@ -0,0 +1,93 @@
+# -*- encoding: utf-8 -*-
+from __future__ import unicode_literals
+
+import gzip
+from io import BytesIO
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from backend.crossrefdump import CrossRefDumpLoader
+from backend.crossrefdump import iter_dump_chunks
+from backend.crossrefdump import parse_dump_chunk
+from backend.tests import PrefilledTest
+from papers.models import Paper
+
+sample_dump = 'devutils/sample_crossref_dump.jsonl.gz'
+
+sample_dois = [
+    '10.1103/physreve.79.026303',
+    '10.1063/1.4738850',
+    '10.1051/proc/2011014',
+    '10.1080/14685240600601061',
+    '10.2307/2540916',
+]
+
+
+class CrossRefDumpUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_read_jsonl(self):
+        chunks = list(iter_dump_chunks(sample_dump, chunk_size=3))
+        self.assertEqual(map(len, chunks), [3, 3, 1])
+
+    def test_parse(self):
+        documents = sum(iter_dump_chunks(sample_dump), [])
+        results, invalid = parse_dump_chunk(documents)
+        # one truncated line and one record without authors
+        self.assertEqual(invalid, 2)
+        self.assertEqual([fields['doi'] for paper, fields in results],
+                         sample_dois)
+        paper, fields = results[0]
+        self.assertEqual(paper.title, 'Zero-mode clustering in turbulent flows')
+        self.assertEqual(paper.fingerprint, paper.new_fingerprint())
+        self.assertEqual(fields['journal_title'], 'Physical Review E')
+        self.assertEqual(fields['pdf_url'], None)
+        # CC-BY license
+        self.assertTrue(results[2][1]['pdf_url'])
+
+    def test_read_tarball(self):
+        documents = sum(iter_dump_chunks(sample_dump), [])
+        items = [json.loads(d) for d in documents[:3]]
+
+        fname = os.path.join(self.tmpdir, 'dump.tar.gz')
+        with tarfile.open(fname, 'w:gz') as tar:
+            page = json.dumps({'message': {'items': items}}).encode('utf-8')
+            info = tarfile.TarInfo('0.json')
+            info.size = len(page)
+            tar.addfile(info, BytesIO(page))
+
+            lines = BytesIO()
+            with gzip.GzipFile(fileobj=lines, mode='wb') as f:
+                f.write(b'\n'.join(documents[4:]))
+            info = tarfile.TarInfo('1.jsonl.gz')
+            info.size = len(lines.getvalue())
+            tar.addfile(info, BytesIO(lines.getvalue()))
+
+        chunks = list(iter_dump_chunks(fname))
+        self.assertEqual(map(len, chunks), [1, 3])
+        results, invalid = parse_dump_chunk(sum(chunks, []))
+        self.assertEqual(len(results), 5)
+        self.assertEqual(invalid, 1)
+
+
+class CrossRefDumpLoaderTest(PrefilledTest):
+
+    def test_load_dump(self):
+        loader = CrossRefDumpLoader(workers=2, chunk_size=2, batch_size=3)
+        loader.load(sample_dump)
+        self.assertEqual(loader.records, 7)
+        self.assertEqual(loader.invalid, 2)
+        self.assertEqual(loader.saved, 5)
+        for doi in sample_dois:
+            p = Paper.get_by_doi(doi)
+            self.assertTrue(p is not None)
+            self.assertEqual(p.oairecords[0].source.identifier, 'crossref')
@@ -0,0 +1,57 @@
+# -*- encoding: utf-8 -*-
+from __future__ import unicode_literals
+
+from datetime import timedelta
+
+from backend.doicache import DoiMetadataStore
+from django.test import TestCase
+from django.utils import timezone
+from papers.models import DoiMetadata
+
+
+class DoiMetadataStoreTest(TestCase):
+
+    def setUp(self):
+        self.store = DoiMetadataStore(ttl=timedelta(days=1), max_entries=2)
+
+    def test_get_put(self):
+        item = {'DOI': '10.1007/978-3-642-25516-8_1', 'title': ['Ŝome title']}
+        self.store.put_many([item, None, {'title': 'no DOI'}])
+        fresh, stale = self.store.get_many(
+            ['10.1007/978-3-642-25516-8_1', '10.1103/physreve.79.026303'])
+        self.assertEqual(fresh, {item['DOI']: item})
+        self.assertEqual(stale, {})
+        self.assertEqual((self.store.hits, self.store.misses), (1, 1))
+        self.assertEqual(self.store.hit_ratio(), 0.5)
+
+    def test_case_insensitive(self):
+        self.store.put_many([{'DOI': '10.1103/PhysRevE.79.026303'}])
+        fresh, _ = self.store.get_many(['10.1103/physreve.79.026303'])
+        self.assertTrue('10.1103/physreve.79.026303' in fresh)
+
+    def test_refresh(self):
+        self.store.put_many([{'DOI': '10.1063/1.4738850', 'volume': '1'}])
+        self.store.put_many([{'DOI': '10.1063/1.4738850', 'volume': '2'}])
+        fresh, _ = self.store.get_many(['10.1063/1.4738850'])
+        self.assertEqual(fresh['10.1063/1.4738850']['volume'], '2')
+        self.assertEqual(DoiMetadata.objects.count(), 1)
+
+    def test_stale(self):
+        self.store.put_many([{'DOI': '10.1063/1.4738850'}])
+        DoiMetadata.objects.update(
+            last_fetched=timezone.now() - timedelta(days=2))
+        fresh, stale = self.store.get_many(['10.1063/1.4738850'])
+        self.assertEqual(fresh, {})
+        self.assertTrue('10.1063/1.4738850' in stale)
+        self.assertEqual(self.store.stale, 1)
+
+    def test_evict(self):
+        self.store.put_many([{'DOI': '10.1063/1.4738850'},
+                             {'DOI': '10.1051/proc/2011014'},
+                             {'DOI': '10.2307/2540916'}])
+        DoiMetadata.objects.filter(doi='10.1051/proc/2011014').update(
+            last_accessed=timezone.now() - timedelta(hours=1))
+        self.assertEqual(self.store.evict(), 1)
+        self.assertEqual(
+            set(DoiMetadata.objects.values_list('doi', flat=True)),
+            set(['10.1063/1.4738850', '10.2307/2540916']))
@@ -0,0 +1,80 @@
+# -*- encoding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+import unittest
+
+from backend.extractors import REGISTERED_OAI_EXTRACTORS
+from oaipmh.common import Header
+
+sample_records = 'devutils/sample_extractor_records.json'
+
+
+def load_samples():
+    with open(sample_records, 'rb') as f:
+        samples = json.load(f)
+    return [(sample['source'],
+             Header(None, sample['identifier'], None, [], False),
+             sample['metadata'])
+            for sample in samples]
+
+
+def naive_urls(extractor, metadata):
+    """
+    Runs the mappings of a regex extractor one by one.
+    """
+    urls = {}
+    for field, regex, resource_type, skeleton in extractor.mappings:
+        for val in metadata.get(field, []):
+            val = val.strip()
+            if regex.match(val):
+                urls[resource_type] = regex.sub(skeleton, val)
+    return urls
+
+
+class ExtractorsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.samples = load_samples()
+
+    def extract(self, index):
+        source, header, metadata = self.samples[index]
+        return REGISTERED_OAI_EXTRACTORS[source].extract(header, metadata)
+
+    def test_arxiv(self):
+        self.assertEqual(self.extract(0),
+            {'splash': 'http://arxiv.org/abs/1501.00001',
+             'pdf': 'http://arxiv.org/pdf/1501.00001'})
+
+    def test_hal(self):
+        self.assertEqual(self.extract(2),
+            {'splash': 'https://hal.archives-ouvertes.fr/hal-01234567',
+             'pdf': 'https://hal.archives-ouvertes.fr/hal-01234567/document'})
+        self.assertEqual(self.extract(3),
+            {'splash': 'https://tel.archives-ouvertes.fr/tel-00765432'})
+
+    def test_base(self):
+        pmc = 'http://www.ncbi.nlm.nih.gov/pmc/articles/PMC3145678'
+        self.assertEqual(self.extract(4), {'splash': pmc, 'pdf': pmc})
+        # the link comes after the identifier in the mappings
+        pdf = 'https://zenodo.org/record/45678/files/paper.pdf'
+        self.assertEqual(self.extract(5), {'splash': pdf, 'pdf': pdf})
+        # free DOI prefix
+        doi = 'http://dx.doi.org/10.15200/winn.142560.00401'
+        self.assertEqual(self.extract(6), {'splash': doi, 'pdf': doi})
+        self.assertEqual(self.extract(7),
+            {'splash': 'http://dx.doi.org/10.1016/s0001-0001(01)00001-1'})
+
+    def test_combined_patterns(self):
+        for source, header, metadata in self.samples:
+            for extractor in REGISTERED_OAI_EXTRACTORS.values():
+                self.assertEqual(extractor._urls(header, metadata),
+                                 naive_urls(extractor, metadata))
+
+    def test_extract_many(self):
+        for source, extractor in REGISTERED_OAI_EXTRACTORS.items():
+            records = [(header, metadata)
+                       for s, header, metadata in self.samples if s == source]
+            self.assertEqual(extractor.extract_many(records),
+                             [extractor.extract(header, metadata)
+                              for header, metadata in records])
@@ -0,0 +1,75 @@
+# -*- encoding: utf-8 -*-
+from __future__ import unicode_literals
+
+import time
+import unittest
+
+import requests.exceptions
+import requests_mock
+
+from backend.httpclient import HttpClient
+from backend.httpclient import TokenBucket
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_burst(self):
+        bucket = TokenBucket(rate=1, capacity=3)
+        self.assertEqual([bucket.reserve() for i in range(3)], [0, 0, 0])
+        self.assertTrue(0.9 < bucket.reserve() <= 1)
+
+    def test_refill(self):
+        bucket = TokenBucket(rate=100, capacity=1)
+        bucket.acquire()
+        start = time.time()
+        bucket.acquire()
+        self.assertTrue(time.time() - start < 0.1)
+
+
+class HttpClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = HttpClient(retry_delay=0.01)
+
+    def test_backoff_delay(self):
+        for attempt in range(5):
+            delay = self.client.backoff_delay(attempt, 1)
+            self.assertTrue(0 <= delay <= 2**attempt)
+
+    @requests_mock.Mocker()
+    def test_retry_on_503(self, m):
+        m.get('http://example.com/', [{'status_code': 503},
+                                      {'status_code': 200, 'text': 'ok'}])
+        r = self.client.get('http://example.com/')
+        self.assertEqual(r.text, 'ok')
+        stats = self.client.stats['example.com']
+        self.assertEqual((stats.requests, stats.errors, stats.retries),
+                         (2, 1, 1))
+
+    @requests_mock.Mocker()
+    def test_give_up(self, m):
+        m.get('http://example.com/', status_code=429)
+        r = self.client.get('http://example.com/', retries=1)
+        self.assertEqual(r.status_code, 429)
+        self.assertEqual(self.client.stats['example.com'].requests, 2)
+
+    @requests_mock.Mocker()
+    def test_connection_error(self, m):
+        m.get('http://example.com/', exc=requests.exceptions.ConnectTimeout)
+        with self.assertRaises(requests.exceptions.Timeout):
+            self.client.get('http://example.com/', retries=2)
+        self.assertEqual(self.client.stats['example.com'].errors, 3)
+
+    def test_session_per_host(self):
+        self.assertTrue(self.client.session('example.com') is
+                        self.client.session('example.com'))
+        self.assertFalse(self.client.session('example.com') is
+                         self.client.session('example.org'))
+
+    def test_divide_rate_limits(self):
+        client = HttpClient(rate_limits={'example.com': (20, 40),
+                                         'example.org': (1, 1)})
+        client.divide_rate_limits(4)
+        self.assertEqual(client.rate_limits,
+                         {'example.com': (5., 10.), 'example.org': (0.25, 1.)})
+        self.assertEqual(client.bucket('example.com').rate, 5.)
@@ -20,14 +20,22 @@
 
 from __future__ import unicode_literals
 
+import threading
 import unittest
 from backend.oai import BASEDCTranslator
 from backend.oai import CiteprocTranslator
+from backend.oai import CustomSourceOAIDCTranslator
 from backend.oai import OAIDCTranslator
 from backend.oai import OaiPaperSource
+from backend.oai import StreamedPage
+from django.db import transaction
 from django.test import TestCase
+from django.test import TransactionTestCase
+from mock import patch
 from oaipmh.error import BadArgumentError
+from papers.models import HarvestState
 from papers.models import OaiRecord
+from papers.models import OaiSource
 
 
 class OaiTest(TestCase):
@@ -299,3 +307,224 @@ class OaiTest(TestCase):
                 'ftdatacite:oai:oai.datacite.org:3505359',
                 'base_dc')
         self.assertTrue(paper.pdf_url is not None)
+
+
+class OaiPipelineTest(TransactionTestCase):
+    # (the pipelined ingestion cannot run in the transaction of a TestCase)
+
+    def setUp(self):
+        self.source, _ = OaiSource.objects.get_or_create(identifier='arxiv',
+            defaults={'name': 'arXiv', 'oa': False, 'priority': 1,
+                      'default_pubtype': 'preprint'})
+        self.oai = OaiPaperSource(endpoint='http://export.arxiv.org/oai2')
+        self.oai.add_translator(CustomSourceOAIDCTranslator(self.source))
+        self.requests = []
+        self.unavailable = False
+
+        def make_request(**kwargs):
+            # serve the sample pages instead of querying the endpoint
+            self.requests.append(kwargs)
+            page = 1
+            if kwargs.get('resumptionToken'):
+                page = 2
+                if self.unavailable:
+                    raise IOError('endpoint unavailable')
+            with open('devutils/sample_oai_page%d.xml' % page, 'rb') as f:
+                return f.read()
+        self.oai.client.makeRequest = make_request
+
+    def test_raw_pages(self):
+        pages = list(self.oai.iter_raw_pages(metadataPrefix='oai_dc'))
+        self.assertEqual([token for page, token in pages],
+                         ['oai_dc|2017-01-01|3', None])
+        self.assertEqual(self.requests[1],
+            {'verb': 'ListRecords', 'resumptionToken': 'oai_dc|2017-01-01|3'})
+
+    def test_translate_page(self):
+        page, token = next(self.oai.iter_raw_pages(metadataPrefix='oai_dc'))
+        prepared, nb_records, skipped = self.oai.translate_page(page, 'oai_dc')
+        self.assertEqual((nb_records, skipped), (3, 0))
+        identifier, digest, metadata_format, paper = prepared[0]
+        self.assertEqual(identifier, 'oai:arXiv.org:1501.00001')
+        self.assertEqual(metadata_format, 'oai_dc')
+        self.assertEqual(paper.title, 'Pipelined harvesting of metadata records')
+        self.assertEqual(paper.oairecords[0].splash_url,
+                         'http://arxiv.org/abs/1501.00001')
+
+    def test_translate_unchanged_page(self):
+        page, token = next(self.oai.iter_raw_pages(metadataPrefix='oai_dc'))
+        identifiers = self.oai.page_identifiers(page)
+        self.assertEqual(identifiers, ['oai:arXiv.org:1501.00001',
+            'oai:arXiv.org:1501.00002', 'oai:arXiv.org:1501.00003'])
+        prepared = self.oai.translate_page(page, 'oai_dc')[0]
+        known_digests = {identifier: digest
+                         for identifier, digest, _, _ in prepared[:2]}
+        # the unchanged records are not translated
+        with patch.object(CustomSourceOAIDCTranslator, 'prepare') as prepare:
+            prepared, nb_records, skipped = self.oai.translate_page(
+                page, 'oai_dc', known_digests)
+        self.assertEqual((nb_records, skipped), (3, 2))
+        self.assertEqual([record[0] for record in prepared],
+                         ['oai:arXiv.org:1501.00003'])
+        self.assertEqual(prepare.call_count, 1)
+
+    def test_pipelined_ingest(self):
+        self.oai.ingest(metadataPrefix='oai_dc', workers=2)
+        records = OaiRecord.objects.filter(source=self.source,
+            identifier__startswith='oai:arXiv.org:150')
+        self.assertEqual(records.count(), 5)
+        state = HarvestState.get_by_name(self.oai.harvest_name('oai_dc'))
+        self.assertEqual(state.status, 'finished')
+        self.assertEqual((state.records, state.pages), (5, 2))
+
+    def test_pipeline_in_transaction(self):
+        with transaction.atomic():
+            with self.assertRaises(transaction.TransactionManagementError):
+                self.oai.ingest(metadataPrefix='oai_dc', workers=2)
+
+    def test_skip_unchanged(self):
+        self.oai.ingest(metadataPrefix='oai_dc', workers=2)
+        records = OaiRecord.objects.filter(source=self.source,
+            identifier__startswith='oai:arXiv.org:150')
+        records.delete()
+        # the records have not changed, so they are not ingested again
+        self.oai.ingest(metadataPrefix='oai_dc', workers=2, resume=False)
+        self.assertEqual(records.count(), 0)
+        self.oai.ingest(metadataPrefix='oai_dc', resume=False)
+        self.assertEqual(records.count(), 0)
+        self.oai.ingest(metadataPrefix='oai_dc', resume=False, force=True)
+        self.assertEqual(records.count(), 5)
+
+    def test_retry_rejected_records(self):
+        class MissingSourceTranslator(CustomSourceOAIDCTranslator):
+            def get_source(self, header, metadata):
+                return None
+
+        self.oai.add_translator(MissingSourceTranslator(self.source))
+        self.oai.ingest(metadataPrefix='oai_dc', workers=2)
+        self.oai.ingest(metadataPrefix='oai_dc', batch_size=2, resume=False)
+        records = OaiRecord.objects.filter(source=self.source,
+            identifier__startswith='oai:arXiv.org:150')
+        self.assertEqual(records.count(), 0)
+        # the rejected records are not skipped once they can be saved
+        self.oai.add_translator(CustomSourceOAIDCTranslator(self.source))
+        self.oai.ingest(metadataPrefix='oai_dc', workers=2, resume=False)
+        self.assertEqual(records.count(), 5)
+
+    def test_batch_commits(self):
+        class BrokenTranslator(CustomSourceOAIDCTranslator):
+            def translate(self, header, metadata):
+                paper = super(BrokenTranslator, self).translate(header, metadata)
+                if header.identifier().endswith('00002'):
+                    # too long to be saved
+                    paper.oairecords[0].splash_url = 'http://arxiv.org/'+'a'*2000
+                return paper
+
+        self.oai.add_translator(BrokenTranslator(self.source))
+        self.oai.ingest(metadataPrefix='oai_dc', batch_size=2)
+        records = OaiRecord.objects.filter(source=self.source,
+            identifier__startswith='oai:arXiv.org:150')
+        # only the invalid record was rolled back
+        self.assertEqual(records.count(), 4)
+        state = HarvestState.get_by_name(self.oai.harvest_name('oai_dc'))
+        self.assertEqual((state.records, state.pages), (5, 2))
+
+    def test_harvest_dates(self):
+        self.oai.ingest(metadataPrefix='oai_dc')
+        until = self.requests[0]['until']
+        self.assertRegexpMatches(until, r'^\d{4}-\d\d-\d\dT\d\d:\d\d:\d\dZ$')
+        self.assertFalse('from' in self.requests[0])
+
+        # the next harvest starts where the first one ended
+        self.requests = []
+        self.oai.ingest(metadataPrefix='oai_dc')
+        self.assertEqual(self.requests[0]['from'], until)
+        state = HarvestState.get_by_name(self.oai.harvest_name('oai_dc'))
+        self.assertEqual(state.status, 'finished')
+
+        day_granular = OaiPaperSource(endpoint='http://export.arxiv.org/oai2',
+                                      day_granularity=True)
+        self.assertEqual(day_granular.datestamp(state.until_date),
+                         self.requests[0]['until'][:10])
+
+    def test_download_outside_write_slots(self):
+        slots = threading.BoundedSemaphore(1)
+        self.oai.write_slots = slots
+        download = self.oai.client.makeRequest
+        held = []
+
+        def make_request(**kwargs):
+            free = slots.acquire(False)
+            if free:
+                slots.release()
+            held.append(not free)
+            return download(**kwargs)
+        self.oai.client.makeRequest = make_request
+
+        self.oai.ingest(metadataPrefix='oai_dc', batch_size=2)
+        self.assertEqual(held, [False, False])
+        state = HarvestState.get_by_name(self.oai.harvest_name('oai_dc'))
+        self.assertEqual(state.status, 'finished')
+        self.assertEqual((state.records, state.pages), (5, 2))
+
+    def test_resume(self):
+        self.unavailable = True
+        with self.assertRaises(IOError):
+            self.oai.ingest(metadataPrefix='oai_dc')
+        state = HarvestState.get_by_name(self.oai.harvest_name('oai_dc'))
+        self.assertTrue(state.resumable)
+        self.assertEqual(state.cursor, 'oai_dc|2017-01-01|3')
+        self.assertEqual((state.records, state.pages), (3, 1))
+        self.assertTrue('until' in self.requests[0])
+
+        self.unavailable = False
+        self.requests = []
+        self.oai.ingest(metadataPrefix='oai_dc')
+        # only the second page was fetched again
+        self.assertEqual(self.requests, [{'verb': 'ListRecords',
+            'resumptionToken': 'oai_dc|2017-01-01|3'}])
+        state = HarvestState.get_by_name(self.oai.harvest_name('oai_dc'))
+        self.assertEqual(state.status, 'finished')
+        self.assertEqual((state.records, state.pages), (5, 2))
+        self.assertEqual(state.last_success, state.until_date)
+
+
+class StreamedPageTest(unittest.TestCase):
+
+    def setUp(self):
+        # the endpoint is not queried
+        self.oai = OaiPaperSource(endpoint='http://doai.io/oai')
+
+    def read(self, filename):
+        with open(filename, 'rb') as f:
+            return f.read()
+
+    def test_same_as_pyoai(self):
+        xml = self.read('devutils/sample_oai_page1.xml')
+        client = self.oai.client
+        records, token = client.buildRecords('oai_dc',
+            client.getNamespaces(), self.oai.registry, client.parse(xml))
+
+        page = StreamedPage(xml, 'oai_dc', self.oai.registry)
+        streamed = list(page)
+        self.assertEqual(len(streamed), 3)
+        for (header, metadata, _), (s_header, s_metadata, _) in zip(records, streamed):
+            self.assertEqual(s_header.identifier(), header.identifier())
+            self.assertEqual(s_header.datestamp(), header.datestamp())
+            self.assertEqual(s_header.setSpec(), header.setSpec())
+            self.assertEqual(s_header.format(), 'oai_dc')
+            self.assertEqual(s_metadata._map, metadata._map)
+        self.assertEqual(page.resumption_token, token)
+
+    def test_any_format(self):
+        page = StreamedPage(self.read('devutils/sample_oai_any_page.xml'),
+                            'any', self.oai.registry)
+        records = list(page)
+        self.assertEqual([header.format() for header, _, _ in records],
+                         ['oai_dc', 'citeproc', None])
+        self.assertEqual(records[0][1]['title'],
+                         ['Pipelined harvesting of metadata records'])
+        self.assertEqual(records[1][1]['DOI'], '10.1103/physreve.79.026303')
+        self.assertTrue(records[2][0].isDeleted())
+        self.assertEqual(records[2][1], None)
+        self.assertEqual(page.resumption_token, 'any|2017-05-31|3')
@@ -0,0 +1,90 @@
+# -*- encoding: utf-8 -*-
+from __future__ import unicode_literals
+
+from datetime import timedelta
+import threading
+import time
+
+from backend.oaiharvester import endpoint_status
+from backend.oaiharvester import OaiEndpoint
+from backend.oaiharvester import OaiHarvestScheduler
+from django.test import TransactionTestCase
+from django.utils import timezone
+from papers.models import HarvestState
+from papers.models import OaiRecord
+from papers.models import OaiSource
+
+
+class SampleEndpoint(OaiEndpoint):
+    """
+    Serves the sample pages, with identifiers specific to the endpoint,
+    counting the harvests running at once.
+    """
+    running = []
+    max_running = [0]
+    lock = threading.Lock()
+
+    def paper_source(self, write_slots=None):
+        paper_source = super(SampleEndpoint, self).paper_source(write_slots)
+
+        def make_request(**kwargs):
+            page = 2 if kwargs.get('resumptionToken') else 1
+            with self.lock:
+                self.running.append(self)
+                self.max_running[0] = max(self.max_running[0],
+                                          len(set(self.running)))
+            time.sleep(0.1)
+            with self.lock:
+                self.running.remove(self)
+            with open('devutils/sample_oai_page%d.xml' % page, 'rb') as f:
+                return f.read().replace(b'oai:arXiv.org:',
+                                        b'oai:%s:' % self.source.encode('ascii'))
+        paper_source.client.makeRequest = make_request
+        return paper_source
+
+
+class OaiHarvestSchedulerTest(TransactionTestCase):
+    # restore the sources created by the migrations after the test
+    serialized_rollback = True
+
+    def setUp(self):
+        self.endpoints = []
+        for name in ['repo-a', 'repo-b', 'repo-c']:
+            OaiSource.objects.create(identifier=name, name=name, oa=True,
+                                     priority=1, default_pubtype='preprint')
+            self.endpoints.append(SampleEndpoint(
+                'http://%s.example.org/oai' % name, name))
+        SampleEndpoint.max_running[0] = 0
+
+    def test_harvest(self):
+        scheduler = OaiHarvestScheduler(self.endpoints, max_endpoints=2,
+                                        max_writers=1)
+        self.assertTrue(scheduler.run())
+        self.assertEqual(SampleEndpoint.max_running[0], 2)
+        for endpoint in self.endpoints:
+            state = endpoint.harvest_state()
+            self.assertEqual(state.status, 'finished')
+            self.assertEqual(state.records, 5)
+            self.assertEqual(OaiRecord.objects.filter(
+                source__identifier=endpoint.source).count(), 5)
+
+    def test_failure(self):
+        self.endpoints.append(SampleEndpoint('http://unknown.example.org/oai',
+                                             'unknown-source'))
+        scheduler = OaiHarvestScheduler(self.endpoints)
+        self.assertFalse(scheduler.run())
+        self.assertEqual(list(scheduler.errors),
+                         ['http://unknown.example.org/oai'])
+        self.assertEqual(self.endpoints[0].harvest_state().status, 'finished')
+
+    def test_status(self):
+        now = timezone.now()
+        HarvestState.objects.create(name=self.endpoints[0].harvest_name(),
+            last_success=now - timedelta(hours=1))
+        HarvestState.objects.create(name=self.endpoints[1].harvest_name(),
+            last_success=now - timedelta(days=5))
+        status = endpoint_status(self.endpoints)
+        self.assertEqual([(endpoint.source, lagging)
+                          for endpoint, state, lagging in status],
+                         [('repo-c', True), ('repo-b', True),
+                          ('repo-a', False)])
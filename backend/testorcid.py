@@ -5,6 +5,8 @@ import unittest
 
 from backend.orcid import affiliate_author_with_orcid
 from backend.orcid import OrcidPaperSource
+from backend.orcidcache import orcid_cache
+from mock import patch
 from papers.models import Paper
 from papers.models import Researcher
 from backend.tests import PaperSourceTest
@@ -84,6 +86,48 @@ class OrcidIntegrationTest(PaperSourceTest):
         titles = [paper.title for paper in papers]
         self.assertTrue('Company-Coq: Taking Proof General one step closer to a real IDE' in titles)
 
+    def test_incremental_refresh(self):
+        pboesu = Researcher.get_or_create_by_orcid('0000-0001-6723-6833')
+        self.source.fetch_and_save(pboesu)
+        pboesu.refresh_from_db()
+        works = pboesu.orcid_works
+        failed = [key for key, work in works.items() if not work['ok']]
+        dropped = next(key for key, work in works.items() if work['ok'])
+
+        # pretend that a work was not imported, and that another one
+        # has been removed from the profile since the last harvest
+        del works[dropped]
+        works['123'] = {'modified': 0, 'ok': True}
+        pboesu.orcid_works = works
+        pboesu.save(update_fields=['orcid_works'])
+        orcid_cache.clear(pboesu.orcid)
+
+        with patch.object(self.source, 'save_paper',
+                          wraps=self.source.save_paper) as save_paper:
+            self.source.fetch_and_save(pboesu)
+        self.assertTrue(1 <= save_paper.call_count <= len(failed) + 1)
+        pboesu.refresh_from_db()
+        self.assertTrue(pboesu.orcid_works[dropped]['ok'])
+        self.assertFalse('123' in pboesu.orcid_works)
+
+    def test_failed_saves_are_retried(self):
+        pboesu = Researcher.get_or_create_by_orcid('0000-0001-6723-6833')
+        orcid_cache.clear(pboesu.orcid)
+        with patch.object(self.source, 'save_paper',
+                          side_effect=ValueError('invalid paper')):
+            self.source.fetch_and_save(pboesu)
+        pboesu.refresh_from_db()
+        # no work is recorded as imported, so they are all fetched again
+        self.assertTrue(pboesu.orcid_works)
+        self.assertFalse(any(work['ok']
+                             for work in pboesu.orcid_works.values()))
+
+        # the profile was not cached, so the next refresh processes it again
+        with patch.object(self.source, 'save_paper',
+                          wraps=self.source.save_paper) as save_paper:
+            self.source.fetch_and_save(pboesu)
+        self.assertTrue(save_paper.called)
+
     def test_import_with_crossref_error(self):
         stergios = Researcher.get_or_create_by_orcid('0000-0001-9232-4042')
         self.source.fetch_and_save(stergios)
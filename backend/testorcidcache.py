@@ -0,0 +1,74 @@
+# -*- encoding: utf-8 -*-
+from __future__ import unicode_literals
+
+import requests_mock
+
+from backend.orcidcache import OrcidCache
+from django.test import TestCase
+from papers.errors import MetadataSourceException
+from papers.models import OrcidCacheEntry
+from papers.orcid import OrcidProfile
+
+orcid_id = '0000-0002-8612-8827'
+profile_json = {'orcid-identifier': {'path': orcid_id}}
+works_json = {'group': []}
+
+
+class OrcidCacheTest(TestCase):
+
+    def setUp(self):
+        self.cache = OrcidCache()
+
+    def test_get_put(self):
+        self.assertEqual(self.cache.get(orcid_id, ''), None)
+        self.cache.put(orcid_id, '', profile_json, '"v1"', None)
+        self.cache.put(orcid_id, '', profile_json, '"v2"', None)
+        self.assertEqual(self.cache.get(orcid_id, ''),
+                         (profile_json, '"v2"', ''))
+        self.cache.clear(orcid_id)
+        self.assertEqual(OrcidCacheEntry.objects.count(), 0)
+
+    @requests_mock.Mocker()
+    def test_conditional_requests(self, m):
+        def document(js, etag):
+            def respond(request, context):
+                if request.headers.get('If-None-Match') == etag:
+                    context.status_code = 304
+                    return None
+                context.headers['ETag'] = etag
+                return js
+            return respond
+        base = 'https://pub.orcid.org/v2.1/%s/' % orcid_id
+        m.get(base, json=document(profile_json, '"p1"'))
+        m.get(base + 'works', json=document(works_json, '"w1"'))
+
+        profile = OrcidProfile(orcid_id=orcid_id, instance='orcid.org',
+                               cache=self.cache)
+        profile.work_summaries
+        self.assertFalse(profile.unchanged)
+        # nothing is cached before the profile has been processed
+        self.assertEqual(OrcidCacheEntry.objects.count(), 0)
+        profile.save_to_cache()
+
+        profile = OrcidProfile(orcid_id=orcid_id, instance='orcid.org',
+                               cache=self.cache)
+        self.assertEqual(profile.json, profile_json)
+        self.assertEqual(profile.work_summaries, [])
+        self.assertTrue(profile.unchanged)
+        self.assertEqual(m.request_history[-1].headers['If-None-Match'],
+                         '"w1"')
+
+    @requests_mock.Mocker()
+    def test_error_responses_not_cached(self, m):
+        base = 'https://pub.orcid.org/v2.1/%s/' % orcid_id
+        m.get(base, json=profile_json, headers={'ETag': '"p1"'})
+        m.get(base + 'works', status_code=500, json={'error': 'failed'},
+              headers={'ETag': '"e1"'})
+
+        profile = OrcidProfile(orcid_id=orcid_id, instance='orcid.org',
+                               cache=self.cache)
+        with self.assertRaises(MetadataSourceException):
+            profile.work_summaries
+        self.assertNotIn('works', profile.fetched_elements)
+        profile.save_to_cache()
+        self.assertEqual(self.cache.get(orcid_id, 'works'), None)
@@ -0,0 +1,65 @@
+# -*- encoding: utf-8 -*-
+from __future__ import unicode_literals
+
+import unittest
+
+from backend.orciddump import list_profile_files
+from backend.orciddump import orcid_dump_harvest_name
+from backend.orciddump import OrcidDumpLoader
+from backend.orciddump import parse_profile
+from backend.tests import PrefilledTest
+from django.utils import timezone
+from papers.models import HarvestState
+from papers.models import Researcher
+
+sample_dump = 'devutils/sample_orcid_dump'
+
+sample_files = [
+    '473/0000-0002-0022-2290.json',
+    '473/0000-0002-9658-1473.json',
+    '827/0000-0002-8612-8827.json',
+]
+
+
+class OrcidDumpUnitTest(unittest.TestCase):
+
+    def test_list_files(self):
+        self.assertEqual(list_profile_files(sample_dump), sample_files)
+        self.assertEqual(list_profile_files(sample_dump, after=sample_files[1]),
+                         sample_files[2:])
+
+    def test_parse(self):
+        # truncated JSON
+        self.assertEqual(parse_profile(sample_dump, sample_files[0]), None)
+        result = parse_profile(sample_dump, sample_files[1])
+        self.assertEqual(result['orcid'], '0000-0002-9658-1473')
+        self.assertEqual(result['works'], [])
+        self.assertEqual(result['error'], None)
+
+
+class OrcidDumpLoaderTest(PrefilledTest):
+
+    def test_load_dump(self):
+        loader = OrcidDumpLoader(workers=2, chunk_size=1, batch_size=1)
+        state = loader.load(sample_dump)
+        self.assertEqual(loader.profiles, 3)
+        self.assertEqual(loader.invalid, 1)
+        self.assertEqual(state.status, 'finished')
+        self.assertEqual(state.records, 3)
+        r = Researcher.objects.get(orcid='0000-0002-9658-1473')
+        self.assertEqual(r.name.last, 'Curie')
+
+    def test_resume(self):
+        state = HarvestState.get_by_name(orcid_dump_harvest_name(sample_dump))
+        state.start(None, timezone.now())
+        state.checkpoint(sample_files[1], 2)
+        state.interrupt()
+
+        loader = OrcidDumpLoader(workers=2)
+        state = loader.load(sample_dump, resume=True)
+        self.assertEqual(loader.profiles, 1)
+        self.assertEqual(state.records, 3)
+        self.assertFalse(Researcher.objects.filter(
+            orcid='0000-0002-9658-1473').exists())
+        self.assertTrue(Researcher.objects.filter(
+            orcid='0000-0002-8612-8827').exists())
@@ -0,0 +1,59 @@
+# -*- encoding: utf-8 -*-
+from __future__ import unicode_literals
+
+from datetime import timedelta
+import time
+import unittest
+
+import backend.queues
+from backend.queues import queue_latencies
+from backend.queues import queue_latency_key
+from backend.queues import record_queue_latency
+from backend.queues import wait_for_interactive_tasks
+from dissemin.settings import redis_client
+from django.test import override_settings
+
+
+class FakeRequest(object):
+
+    def __init__(self, published_at, queue):
+        self.published_at = published_at
+        self.delivery_info = {'routing_key': queue}
+
+
+class FakeTask(object):
+
+    def __init__(self, published_at, queue):
+        self.request = FakeRequest(published_at, queue)
+
+
+class QueuesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pause_interval = backend.queues.bulk_pause_interval
+        backend.queues.bulk_pause_interval = 0.01
+
+    def tearDown(self):
+        backend.queues.bulk_pause_interval = self.pause_interval
+        redis_client.delete(queue_latency_key % 'test-queue')
+
+    @override_settings(CELERY_INTERACTIVE_MAX_BACKLOG=1000000)
+    def test_no_backlog(self):
+        self.assertEqual(wait_for_interactive_tasks(), 0)
+
+    @override_settings(CELERY_INTERACTIVE_MAX_BACKLOG=-1)
+    def test_pause(self):
+        # the interactive queue is always considered backed up
+        paused = wait_for_interactive_tasks(max_pause=timedelta(seconds=0.1))
+        self.assertTrue(0.1 <= paused < 1)
+
+    def test_latency(self):
+        now = time.time()
+        record_queue_latency(task=FakeTask(now - 3, 'test-queue'))
+        record_queue_latency(task=FakeTask(now - 1, 'test-queue'))
+        # tasks run eagerly are not recorded
+        record_queue_latency(task=FakeTask(None, 'test-queue'))
+        latencies = queue_latencies('test-queue')
+        self.assertEqual(len(latencies), 2)
+        self.assertTrue(1 <= latencies[0] < 2)
+        self.assertTrue(3 <= latencies[1] < 4)
@@ -0,0 +1,81 @@
+# -*- encoding: utf-8 -*-
+from __future__ import unicode_literals
+
+from datetime import timedelta
+import time
+import unittest
+
+from backend.refresh import finish_refresh
+from backend.refresh import refresh_priority
+from backend.refresh import refresh_running_key
+from backend.refresh import refresh_timeout
+from backend.refresh import ResearcherRefreshScheduler
+from backend.refresh import start_refresh
+from backend.tests import PrefilledTest
+from dissemin.settings import redis_client
+from django.contrib.auth.models import User
+from django.utils import timezone
+from papers.models import HarvestState
+from papers.models import Researcher
+
+
+class RefreshPriorityTest(unittest.TestCase):
+
+    def test_priority(self):
+        now = timezone.now()
+        user = User(last_login=now - timedelta(days=1))
+        inactive = Researcher(last_harvest=now - timedelta(days=20))
+        member = Researcher(last_harvest=now - timedelta(days=10), user=user)
+        self.assertTrue(refresh_priority(member, now) >
+                        refresh_priority(inactive, now))
+        user.last_login = now - timedelta(days=30)
+        self.assertTrue(refresh_priority(member, now) <
+                        refresh_priority(inactive, now))
+
+
+class ResearcherRefreshSchedulerTest(PrefilledTest):
+
+    def setUp(self):
+        redis_client.delete(refresh_running_key)
+        self.scheduler = ResearcherRefreshScheduler(
+            chunk_size=10, max_running=3,
+            budgets={'pub.orcid.org': (60, 4), 'api.crossref.org': (60, 2)})
+        now = timezone.now()
+        for days, r in enumerate([self.r1, self.r2, self.r3, self.r4, self.r5]):
+            Researcher.objects.filter(pk=r.pk).update(
+                last_harvest=now - timedelta(days=10+days))
+
+    def tearDown(self):
+        redis_client.delete(refresh_running_key)
+
+    def test_budget(self):
+        # 60 ORCID requests per minute, 4 requests per refresh
+        scheduler = ResearcherRefreshScheduler(chunk_size=100,
+            budgets={'pub.orcid.org': (60, 4), 'api.crossref.org': (60, 2)})
+        self.assertEqual(scheduler.budget(), 15)
+        # no more than a chunk at each run
+        self.assertEqual(self.scheduler.budget(), 10)
+
+    def test_select(self):
+        due = self.scheduler.due()
+        self.assertEqual(set(due), set([self.r1, self.r2, self.r3, self.r4, self.r5]))
+        self.assertEqual(self.scheduler.select(due, 2), [self.r5, self.r4])
+        self.assertEqual(self.scheduler.select(due, 0), [])
+
+    def test_running(self):
+        start_refresh(self.r1.pk)
+        start_refresh(self.r2.pk)
+        redis_client.hset(refresh_running_key, self.r3.pk,
+                          time.time() - refresh_timeout - 1)
+        self.assertEqual(self.scheduler.running(), set([self.r1.pk, self.r2.pk]))
+        finish_refresh(self.r1.pk)
+        self.assertEqual(self.scheduler.running(), set([self.r2.pk]))
+
+    def test_eta(self):
+        state = HarvestState.get_by_name('test-eta')
+        state.start(None, timezone.now())
+        self.assertEqual(state.eta(), None)
+        state.started -= timedelta(minutes=10)
+        state.checkpoint(None, 20, remaining=40)
+        eta = state.eta()
+        self.assertTrue(timedelta(minutes=19) < eta <= timedelta(minutes=20))
@@ -30,7 +30,11 @@ from backend.maintenance import update_paper_statuses
 from backend.romeo import fetch_journal
 from backend.romeo import fetch_publisher
 from backend.romeo import find_journal_in_model
+from backend.romeo import journal_resolution_cache
+from backend.romeo import journal_resolution_tags
 from backend.romeo import perform_romeo_query
+from backend.romeo import publisher_resolution_cache
+from backend.romeo import publisher_resolution_tags
 from backend.tasks import fetch_everything_for_researcher
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.management import call_command
@@ -81,6 +85,35 @@ class RomeoTest(TestCase):
         self.assertEqual(fetch_publisher(None), None)
         # TODO: more tests!
 
+    def test_resolution_cache(self):
+        journal = fetch_journal({'issn': '0022-328X'})
+        for key, value in [(('0022-328X', '', 'exact'), journal),
+                           (('1234-5678', '', 'exact'), None),
+                           (('8765-4321', '', 'exact'), None)]:
+            journal_resolution_cache.set(
+                key, value, tags=journal_resolution_tags(key, value))
+        result = (journal.publisher, True)
+        publisher_resolution_cache.set(
+            'Elsevier', result, tags=publisher_resolution_tags(result))
+        self.assertEqual(fetch_journal({'issn': '1234-5678'}), None)
+
+        # creating a journal invalidates failed resolutions of its ISSN
+        Journal.objects.create(title='Some journal', issn='1234-5678',
+                               publisher=journal.publisher)
+        self.assertEqual(journal_resolution_cache.lookup(
+            ('1234-5678', '', 'exact')), (False, None))
+        self.assertEqual(journal_resolution_cache.lookup(
+            ('8765-4321', '', 'exact')), (True, None))
+        self.assertEqual(journal_resolution_cache.lookup(
+            ('0022-328X', '', 'exact')), (True, journal))
+
+        # updating a publisher invalidates its journals
+        journal.publisher.save()
+        self.assertEqual(journal_resolution_cache.lookup(
+            ('0022-328X', '', 'exact')), (False, None))
+        self.assertEqual(publisher_resolution_cache.lookup('Elsevier'),
+                         (False, None))
+
     def test_unicode(self):
         terms = {'issn': '0375-0906'}
         journal = fetch_journal(terms)
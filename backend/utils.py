@@ -20,11 +20,9 @@
 
 from __future__ import unicode_literals
 
-from time import sleep
-
-import requests
 import requests.exceptions
 
+from backend.httpclient import http_client
 from dissemin.settings import redis_client
 from memoize import memoize
 from papers.errors import MetadataSourceException
@@ -60,39 +58,35 @@ class run_only_once(object):
 
 # Open an URL with retries
 
-def urlopen_retry(url, **kwargs):  # data, timeout, retries, delay, backoff):
+def urlopen_retry(url, **kwargs):  # data, timeout, retries, delay, headers
+    """
+    Fetches an URL with the shared HTTP client, retrying (with
+    exponential backoff) after timeouts and connection errors.
+
+    :returns: the text of the response
+    :raises: :class:`MetadataSourceException` if the request failed
+    """
     data = kwargs.get('data', None)
     timeout = kwargs.get('timeout', 10)
     retries = kwargs.get('retries', 3)
     delay = kwargs.get('delay', 5)
-    backoff = kwargs.get('backoff', 2)
     headers = kwargs.get('headers', {})
     try:
-        r = requests.get(url,
-                         params=data,
-                         timeout=timeout,
-                         headers=headers,
-                         allow_redirects=True)
+        r = http_client.get(url,
+                            params=data,
+                            timeout=timeout,
+                            headers=headers,
+                            allow_redirects=True,
+                            retries=retries,
+                            delay=delay)
         return r.text
     except requests.exceptions.Timeout as e:
-        if retries <= 0:
-            raise MetadataSourceException('Timeout: '+str(e))
+        raise MetadataSourceException('Timeout: '+str(e))
     except requests.exceptions.ConnectionError as e:
-        if retries <= 0:
-            raise MetadataSourceException('Connection error: '+str(e))
+        raise MetadataSourceException('Connection error: '+str(e))
     except requests.exceptions.RequestException as e:
         raise MetadataSourceException('Request error: '+str(e))
 
-    print "Retrying in "+str(delay)+" seconds..."
-    print "URL: "+url
-    sleep(delay)
-    return urlopen_retry(url,
-                         data=data,
-                         timeout=timeout,
-                         retries=retries-1,
-                         delay=delay*backoff,
-                         backoff=backoff)
-
 
 @memoize(timeout=86400)  # 1 day
 def cached_urlopen_retry(*args, **kwargs):
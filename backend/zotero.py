@@ -1,12 +1,11 @@
 # -*- encoding: utf-8 -*-
 from __future__ import unicode_literals
 
+from backend.httpclient import http_client
 from dissemin.settings import DOI_PROXY_DOMAIN
 from papers.errors import MetadataSourceException
 from papers.utils import sanitize_html
 
-import requests
-
 ##### Zotero interface #####
 
 def fetch_zotero_by_DOI(doi):
@@ -15,7 +14,7 @@ def fetch_zotero_by_DOI(doi):
     Works only with the doi_cache proxy.
     """
     try:
-        request = requests.get('http://'+DOI_PROXY_DOMAIN+'/zotero/'+doi)
+        request = http_client.get('http://'+DOI_PROXY_DOMAIN+'/zotero/'+doi)
         return request.json()
     except ValueError as e:
         raise MetadataSourceException('Error while fetching Zotero metadata:\nInvalid JSON response.\n' +
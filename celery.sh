@@ -1,2 +1,12 @@
 #!/bin/bash
-celery --app=dissemin.celery:app worker -B -l INFO
+# Tasks a user is waiting for have their own workers, so that they never
+# wait behind bulk jobs (see CELERY_ROUTES in dissemin/settings/common.py).
+# The number of workers of each queue can be set in the environment.
+celery --app=dissemin.celery:app worker -Q interactive -n interactive@%h \
+    -c ${INTERACTIVE_WORKERS:-4} -l INFO &
+celery --app=dissemin.celery:app worker -Q bulk -n bulk@%h \
+    -c ${BULK_WORKERS:-2} -l INFO &
+celery --app=dissemin.celery:app worker -Q default -n default@%h \
+    -c ${DEFAULT_WORKERS:-2} -B -l INFO &
+trap 'kill $(jobs -p)' EXIT
+wait
@@ -89,12 +89,54 @@ DOI_PROXY_SUPPORTS_BATCH = True
 #DOI_PROXY_DOMAIN =  'doi.org'
 #DOI_PROXY_SUPPORTS_BATCH = False
 
+### Local DOI metadata store ###
+# DOI metadata fetched from CrossRef or the DOI proxy is kept
+# in the database (compressed) and reused for that long:
+DOI_METADATA_CACHE_TTL = timedelta(days=30)
+# Maximum number of DOIs kept in the store (the least recently
+# used ones are evicted first). Set to 0 to disable the store.
+DOI_METADATA_CACHE_MAX_ENTRIES = 2000000
+
 ### CrossRef politeness options ###
 # These options determine how we identify ourselves to CrossRef.
 # It is not mandatory to provide them but it helps get a better service.
 CROSSREF_MAILTO = 'dev@dissem.in'
 CROSSREF_USER_AGENT = 'Dissemin/0.1 (https://dissem.in/; mailto:dev@dissem.in)'
 
+### RoMEO proxy ###
+# Set this to 'sherpa.ac.uk' if our custom mirror is not up anymore.
+# Otherwise our proxy caches results and is more reliable than the
+# original endpoint.
+ROMEO_API_DOMAIN = 'romeo-cache.dissem.in'
+
+### Outbound HTTP politeness ###
+# Maximum request rates to external services, per host, as pairs
+# (requests per second, burst size). Shared by all the threads of a
+# process (see backend.httpclient). Other hosts are not throttled.
+HTTP_RATE_LIMITS = {
+    'api.crossref.org': (20, 20),
+    'pub.orcid.org': (20, 40),
+    'pub.sandbox.orcid.org': (20, 40),
+    ROMEO_API_DOMAIN: (5, 10),
+}
+
+### OAI-PMH harvesting ###
+# Repositories harvested directly (see backend.oaiharvester), with the
+# identifier of the OaiSource their records belong to and optionally
+# their metadata format ('oai_dc' by default), the maximum number of
+# requests per second we send them (1 by default) and whether they only
+# support day-granular timestamps. For instance:
+# {'endpoint': 'https://export.arxiv.org/oai2', 'source': 'arxiv',
+#  'rate': 0.1, 'day_granularity': True}
+OAI_HARVEST_ENDPOINTS = []
+# Maximum number of endpoints harvested at once
+OAI_HARVEST_MAX_ENDPOINTS = 8
+# Maximum number of harvests writing to the database at once
+OAI_HARVEST_MAX_WRITERS = 4
+# Harvests which are more than that behind their endpoint are reported
+# as lagging
+OAI_HARVEST_MAX_LAG = timedelta(days=2)
+
 # Proaixy API key
 # Used to fetch paper metadata. Get one by asking developers@dissem.in
 # This is a default key that should only be used for tests
@@ -102,12 +144,6 @@ if PROAIXY_API_KEY is None:
     PROAIXY_API_KEY = '46f664aaae8d25826ff6'
 
 
-### RoMEO proxy ###
-# Set this to 'sherpa.ac.uk' if our custom mirror is not up anymore.
-# Otherwise our proxy caches results and is more reliable than the
-# original endpoint.
-ROMEO_API_DOMAIN = 'romeo-cache.dissem.in'
-
 ### Paper deposits ###
 # Max size of the PDFs (in bytes)
 # 2.5MB - 2621440
@@ -123,6 +159,24 @@ URL_DEPOSIT_DOWNLOAD_TIMEOUT = 10
 # On login of an user, minimum time between the last harvest to trigger
 # a new harvest for that user.
 PROFILE_REFRESH_ON_LOGIN = timedelta(days=1)
+# The researchers harvested in that period are refreshed regularly in the
+# background (see backend.refresh)
+RESEARCHER_REFRESH_MAX_AGE = timedelta(days=30*6)
+# Minimum time between two background refreshes of a researcher
+RESEARCHER_REFRESH_INTERVAL = timedelta(days=7)
+# Time between two runs of the refresh scheduler, which enqueues
+# one chunk of refreshes at each run
+RESEARCHER_REFRESH_PERIOD = timedelta(minutes=1)
+# Maximum number of refreshes enqueued at each run
+RESEARCHER_REFRESH_CHUNK_SIZE = 50
+# Maximum number of refreshes queued or running at once, on all workers
+RESEARCHER_REFRESH_MAX_RUNNING = 8
+# Share of the external APIs used by background refreshes, per host, as
+# pairs (requests per minute, estimated number of requests per refresh)
+RESEARCHER_REFRESH_BUDGETS = {
+    'pub.orcid.org': (300, 4),
+    'api.crossref.org': (300, 2),
+}
 
 ### Application definition ###
 # You should not have to change anything in this section.
@@ -154,6 +208,7 @@ INSTALLED_APPS = (
     'deposit.sword',
     'deposit.osf',
     'autocomplete',
+    'backend',
     'notification',
     'bootstrap_pagination',
     'django_js_reverse',
@@ -257,6 +312,36 @@ except ImportError:
 CELERY_ACCEPT_CONTENT = ['pickle', 'json', 'msgpack', 'yaml']
 CELERY_IMPORTS = ['backend.tasks']
 
+# Tasks a user is waiting for go to the 'interactive' queue, which has
+# its own workers, and long jobs to the 'bulk' queue, which has few of
+# them (see backend.queues and celery.sh). Other tasks go to 'default'.
+CELERY_DEFAULT_QUEUE = 'default'
+CELERY_ROUTES = {
+    'init_profile_from_orcid': {'queue': 'interactive'},
+    'fetch_everything_for_researcher': {'queue': 'interactive'},
+    'change_publisher_oa_status': {'queue': 'interactive'},
+    'consolidate_paper': {'queue': 'interactive'},
+    'refresh_researcher': {'queue': 'bulk'},
+    'update_all_stats': {'queue': 'bulk'},
+    'update_journal_stats': {'queue': 'bulk'},
+    'update_crossref': {'queue': 'bulk'},
+    'harvest_oai_endpoints': {'queue': 'bulk'},
+    'refresh_deposit_statuses': {'queue': 'bulk'},
+}
+# Workers only reserve one task at a time, so that short tasks are not
+# stuck behind a long one reserved by the same worker
+CELERYD_PREFETCH_MULTIPLIER = 1
+# Bulk jobs pause while more than that many tasks are waiting in the
+# interactive queue...
+CELERY_INTERACTIVE_MAX_BACKLOG = 5
+# ... for at most that long at a time
+BULK_MAX_PAUSE = timedelta(minutes=10)
+# ... or that long when they hold a cursor or a resumption token which
+# could expire in the meantime (CrossRef cursors expire after about five
+# minutes without requests, and many OAI-PMH endpoints expire their
+# resumption tokens too)
+BULK_CURSOR_MAX_PAUSE = timedelta(minutes=1)
+
 CELERYBEAT_SCHEDULE = {
     'update_all_stats': {
         'task': 'update_all_stats',
@@ -266,6 +351,14 @@ CELERYBEAT_SCHEDULE = {
           'task': 'refresh_deposit_statuses',
           'schedule': timedelta(days=1),
     },
+    'harvest_oai_endpoints': {
+          'task': 'harvest_oai_endpoints',
+          'schedule': timedelta(days=1),
+    },
+    'schedule_researcher_refreshes': {
+          'task': 'schedule_researcher_refreshes',
+          'schedule': RESEARCHER_REFRESH_PERIOD,
+    },
 #    'update_crossref': {
 #          'task': 'update_crossref',
 #          'schedule': timedelta(days=1),
@@ -18,6 +18,7 @@
 
 from django.contrib import admin
 from papers.models import Department
+from papers.models import HarvestState
 from papers.models import Institution
 from papers.models import Name
 from papers.models import OaiRecord
@@ -50,6 +51,14 @@ class OaiRecordAdmin(admin.ModelAdmin):
 class ResearcherAdmin(admin.ModelAdmin):
     raw_id_fields = ('name', 'stats',)
 
+
+class HarvestStateAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'from_date', 'until_date', 'records',
+                    'pages', 'records_per_page', 'remaining', 'eta',
+                    'last_checkpoint', 'last_success', 'lag')
+    list_filter = ('status',)
+    readonly_fields = ('started', 'last_checkpoint')
+
 admin.site.register(Institution)
 admin.site.register(Department)
 admin.site.register(Researcher, ResearcherAdmin)
@@ -58,3 +67,4 @@ admin.site.register(Paper, PaperAdmin)
 admin.site.register(OaiSource)
 admin.site.register(OaiRecord, OaiRecordAdmin)
 admin.site.register(PaperWorld, SingletonModelAdmin)
+admin.site.register(HarvestState, HarvestStateAdmin)
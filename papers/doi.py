@@ -47,7 +47,12 @@ def to_doi(candidate):
     u'10.1145/1721837.1721839'
     >>> to_doi('10.1093/jhmas/XXXI.4.480')
     u'10.1093/jhmas/xxxi.4.480'
+    >>> to_doi('http://arxiv.org/abs/1501.00001')
     """
+    # all DOIs contain this: most candidates are rejected here,
+    # without trying the regular expressions
+    if not candidate or '10.' not in candidate:
+        return None
     m = doi_re.match(candidate)
     if m:
         return m.groups()[0].lower()
@@ -57,6 +62,38 @@ def to_doi(candidate):
             return openaire_match.group(1).lower()
 
 
+def find_dois(candidates, memo=None, first_only=False):
+    """
+    Finds the DOIs in a list of strings, such as the identifiers
+    of a metadata record.
+
+    >>> find_dois(['http://arxiv.org/abs/1501.00001', 'doi:10.1145/1721837.1721839', 'https://doi.org/10.1145/1721837.1721839'])
+    [u'10.1145/1721837.1721839']
+    >>> find_dois(['doi:10.1145/1721837.1721839', '10.1093/jhmas/xxxi.4.480'], first_only=True)
+    [u'10.1145/1721837.1721839']
+
+    :param memo: a dict remembering the DOI (or None) found in each string,
+        which can be shared by the calls for a batch of records when they
+        contain the same strings
+    :param first_only: stop at the first DOI found
+    :returns: the DOIs found, without duplicates, in the order of the
+        strings they were found in
+    """
+    if memo is None:
+        memo = {}
+    dois = []
+    for candidate in candidates:
+        try:
+            doi = memo[candidate]
+        except KeyError:
+            doi = memo[candidate] = to_doi(candidate)
+        if doi and doi not in dois:
+            dois.append(doi)
+            if first_only:
+                break
+    return dois
+
+
 def doi_to_url(doi):
     """
     Takes a (valid) doi and returns its resolving URL
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('papers', '0052_researcher_visible'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DoiMetadata',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('doi', models.CharField(max_length=1024, unique=True)),
+                ('compressed_json', models.BinaryField()),
+                ('last_fetched', models.DateTimeField(db_index=True)),
+                ('last_accessed', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'verbose_name': 'DOI metadata',
+                'verbose_name_plural': 'DOI metadata',
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('papers', '0053_doimetadata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HarvestState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=512, unique=True)),
+                ('status', models.CharField(choices=[('running', 'Running'), ('interrupted', 'Interrupted'), ('finished', 'Finished')], default='finished', max_length=32)),
+                ('from_date', models.DateTimeField(blank=True, null=True)),
+                ('until_date', models.DateTimeField(blank=True, null=True)),
+                ('cursor', models.TextField(blank=True, null=True)),
+                ('progress_date', models.DateField(blank=True, null=True)),
+                ('records', models.BigIntegerField(default=0)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('last_checkpoint', models.DateTimeField(blank=True, null=True)),
+                ('last_success', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
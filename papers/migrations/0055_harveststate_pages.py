@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('papers', '0054_harveststate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='harveststate',
+            name='pages',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('papers', '0055_harveststate_pages'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OaiRecordDigest',
+            fields=[
+                ('identifier', models.CharField(max_length=512, primary_key=True, serialize=False)),
+                ('digest', models.BinaryField()),
+            ],
+            options={
+                'verbose_name': 'OAI record digest',
+            },
+        ),
+    ]
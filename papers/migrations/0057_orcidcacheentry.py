@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('papers', '0056_oairecorddigest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrcidCacheEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('orcid', models.CharField(max_length=32)),
+                ('element', models.CharField(blank=True, max_length=64)),
+                ('compressed_json', models.BinaryField()),
+                ('etag', models.CharField(blank=True, max_length=256)),
+                ('last_modified', models.CharField(blank=True, max_length=64)),
+                ('last_fetched', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'ORCID cache entry',
+                'verbose_name_plural': 'ORCID cache entries',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='orcidcacheentry',
+            unique_together=set([('orcid', 'element')]),
+        ),
+    ]
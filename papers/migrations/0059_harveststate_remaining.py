@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('papers', '0058_researcher_orcid_works'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='harveststate',
+            name='remaining',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
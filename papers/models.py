@@ -48,6 +48,8 @@ from __future__ import unicode_literals
 from datetime import datetime
 from datetime import timedelta
 import re
+import threading
+import time
 import haystack
 from statistics.models import AccessStatistics
 from statistics.models import combined_status_for_instance
@@ -70,7 +72,12 @@ from django.core.cache.utils import make_template_fragment_key
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.urlresolvers import reverse
 from django.db import DataError
+from django.db import IntegrityError
 from django.db import models
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 from django.template.defaultfilters import slugify
 from django.utils import timezone
 from django.utils.functional import cached_property
@@ -83,6 +90,7 @@ from papers.baremodels import BarePaper
 from papers.baremodels import MAX_NAME_LENGTH
 from papers.baremodels import PAPER_TYPE_CHOICES
 from papers.baremodels import PAPER_TYPE_PREFERENCE
+from papers.doi import find_dois
 from papers.doi import to_doi
 from papers.errors import MetadataSourceException
 from papers.name import name_similarity
@@ -97,12 +105,25 @@ from publishers.models import Publisher
 from solo.models import SingletonModel
 from search import SearchQuerySet
 
+# Time (in seconds) after which the OAI sources are reloaded
+# from the database by :class:`OaiSourceRegistry`
+OAI_SOURCE_REGISTRY_TTL = 300
+# Minimum time (in seconds) between two reloads caused by lookups
+# of unknown sources
+OAI_SOURCE_REGISTRY_MISS_DELAY = 30
+
 UPLOAD_TYPE_CHOICES = [
    ('preprint', _('Preprint')),
    ('postprint', _('Postprint')),
    ('pdfversion', _("Published version")),
    ]
 
+HARVEST_STATUS_CHOICES = [
+   ('running', _('Running')),
+   ('interrupted', _('Interrupted')),
+   ('finished', _('Finished')),
+   ]
+
 HARVESTER_TASK_CHOICES = [
    ('init', _('Preparing profile')),
    ('orcid', _('Fetching publications from ORCID')),
@@ -384,6 +405,10 @@ class Researcher(models.Model):
     #: Current subtask of the harvester
     current_task = models.CharField(
         max_length=64, choices=HARVESTER_TASK_CHOICES, null=True, blank=True)
+    #: The works of the ORCID profile processed by the last harvest: a dict
+    #: mapping their put codes to their last modification date in ORCID
+    #: ('modified') and whether they were imported successfully ('ok')
+    orcid_works = JSONField(default=dict, blank=True)
 
     #: Statistics of papers authored by this researcher
     stats = models.ForeignKey(AccessStatistics, null=True, blank=True)
@@ -811,10 +836,12 @@ class Paper(models.Model, BarePaper):
         self.authors_list[position]['researcher_id'] = researcher_id
         self.save(update_fields=['authors_list'])
 
-    def add_oairecord(self, oairecord):
+    def add_oairecord(self, oairecord, doi_memo=None):
         """
         Adds a record (possibly bare) to the paper, by saving it in
         the database
+
+        :param doi_memo: passed to :meth:`OaiRecord.find_duplicate_records`
         """
         # Clean up the record
         oairecord.cleanup_description()
@@ -832,7 +859,7 @@ class Paper(models.Model, BarePaper):
                     rec.about.merge(self)
                 self.just_created = False
 
-        rec = OaiRecord.new(about=self,
+        rec = OaiRecord.new(about=self, doi_memo=doi_memo,
                             **oairecord.__dict__)
         self.just_created = False
         return rec
@@ -855,12 +882,13 @@ class Paper(models.Model, BarePaper):
         return Paper.objects.filter(fingerprint__exact=fp)
 
     @classmethod
-    def from_bare(cls, paper):
+    def from_bare(cls, paper, doi_memo=None):
         """
         Saves a paper to the database if it is not already present.
         The clustering algorithm is run to decide what authors should be
         attributed to the paper.
 
+        :param doi_memo: passed to :meth:`OaiRecord.find_duplicate_records`
         :returns: the :class:`Paper` instance created from the bare paper supplied.
         """
         try:
@@ -877,7 +905,7 @@ class Paper(models.Model, BarePaper):
                         paper.authors,
                         save_now=False)
                 for record in paper.oairecords:
-                    p.add_oairecord(record)
+                    p.add_oairecord(record, doi_memo)
                 p.update_availability()  # in Paper, this saves to the db
             else:  # Otherwise we create a new paper
                 # this already saves the paper in the db
@@ -889,6 +917,101 @@ class Paper(models.Model, BarePaper):
             raise ValueError(
                 'Invalid paper, does not fit in the database schema:\n'+unicode(e))
 
+    @classmethod
+    def bulk_from_bare(cls, bare_papers, doi_memo=None):
+        """
+        Saves many bare papers at once (useful for bulk ingestion).
+
+        The fingerprints, DOIs and OAI identifiers of all the papers are
+        looked up with one query each. The papers which do not match anything
+        in the database are then inserted in bulk, with their OAI records.
+        The others (and the duplicates inside the batch) go through
+        :meth:`from_bare`, which merges them with the existing papers.
+
+        :param doi_memo: passed to :meth:`OaiRecord.find_duplicate_records`
+        :returns: the list of :class:`Paper` instances saved (papers that
+            could not be saved are skipped)
+        """
+        bare_papers = list(bare_papers)
+        for paper in bare_papers:
+            paper.update_availability()
+            paper.fingerprint = paper.new_fingerprint()
+
+        identifiers = set()
+        dois = set()
+        for paper in bare_papers:
+            for record in paper.oairecords:
+                identifiers.add(record.identifier)
+                if record.doi:
+                    dois.add(record.doi)
+
+        known_fingerprints = set(Paper.objects.filter(
+            fingerprint__in=[p.fingerprint for p in bare_papers]
+            ).values_list('fingerprint', flat=True))
+        known_identifiers = set()
+        known_dois = set()
+        if identifiers:
+            for identifier, doi in OaiRecord.objects.filter(
+                    models.Q(identifier__in=identifiers) |
+                    models.Q(doi__in=dois)).values_list('identifier', 'doi'):
+                known_identifiers.add(identifier)
+                known_dois.add(doi)
+
+        # Split the batch between papers we can insert straight away
+        # and the ones that need to be merged with something
+        new_papers = []
+        conflicting = []
+        for paper in bare_papers:
+            records = paper.oairecords
+            # papers with invalid records are left to from_bare,
+            # which reports the error
+            if (paper.fingerprint in known_fingerprints or
+                any(r.splash_url is None or
+                    r.identifier in known_identifiers or
+                    (r.doi and r.doi in known_dois) for r in records)):
+                conflicting.append(paper)
+                continue
+            new_papers.append(paper)
+            known_fingerprints.add(paper.fingerprint)
+            for r in records:
+                known_identifiers.add(r.identifier)
+                if r.doi:
+                    known_dois.add(r.doi)
+
+        saved = []
+        try:
+            with transaction.atomic():
+                for bare in new_papers:
+                    paper = cls(**dict((f, getattr(bare, f))
+                                       for f in cls._bare_fields))
+                    for idx, author in enumerate(bare.authors):
+                        paper.add_author(author, position=idx)
+                    saved.append(paper)
+                cls.objects.bulk_create(saved)
+
+                records = []
+                for paper, bare in zip(saved, new_papers):
+                    for bare_record in bare.oairecords:
+                        bare_record.cleanup_description()
+                        record = OaiRecord.from_bare(bare_record)
+                        record.about = paper
+                        record.priority = bare_record.source.priority
+                        records.append(record)
+                OaiRecord.objects.bulk_create(records)
+        except (DataError, IntegrityError):
+            # Something does not fit in the database schema, or a concurrent
+            # ingestion created the same papers: save them one by one.
+            saved = []
+            conflicting = new_papers + conflicting
+
+        for bare in conflicting:
+            try:
+                saved.append(cls.from_bare(bare, doi_memo))
+            except ValueError as e:
+                print "Ignoring invalid paper:"
+                print e
+        return saved
+
     ### Other methods, specific to this non-bare subclass ###
 
     def update_author_stats(self):
@@ -1317,6 +1440,25 @@ class Paper(models.Model, BarePaper):
             except haystack.exceptions.NotHandled:
                 pass
 
+    @classmethod
+    def update_index_bulk(cls, papers):
+        """
+        Updates Haystack's index for many papers at once
+        (one request to the search engine for the whole list)
+        """
+        papers = list(papers)
+        if not papers:
+            return
+        using_backends = haystack.connection_router.for_write(
+            instance=papers[0])
+        for using in using_backends:
+            try:
+                engine = haystack.connections[using]
+                index = engine.get_unified_index().get_index(Paper)
+                engine.get_backend().update(index, papers)
+            except haystack.exceptions.NotHandled:
+                pass
+
 # Rough data extracted through OAI-PMH
 
 class OaiSourceManager(CachingManager):
@@ -1345,6 +1487,128 @@ class OaiSource(CachingMixin, models.Model):
         verbose_name = "OAI source"
 
 
+class OaiSourceRegistry(object):
+    """
+    Process-local registry of the :class:`OaiSource` instances,
+    which are looked up for every ingested record. All sources are
+    loaded at once and then served from memory, by identifier or by id.
+
+    The registry is refreshed when a source is saved or deleted in this
+    process, and reloaded after :data:`OAI_SOURCE_REGISTRY_TTL` seconds
+    to notice the changes made by other processes. Lookups of unknown
+    sources also reload it, at most once every
+    :data:`OAI_SOURCE_REGISTRY_MISS_DELAY` seconds.
+    """
+
+    def __init__(self, ttl=OAI_SOURCE_REGISTRY_TTL,
+                 miss_delay=OAI_SOURCE_REGISTRY_MISS_DELAY):
+        self.ttl = ttl
+        self.miss_delay = miss_delay
+        self.lock = threading.Lock()
+        self.by_identifier = None
+        self.by_id = None
+        self.loaded_at = None
+        self.miss_reloaded_at = None
+        self.frozen = False
+
+    def load(self):
+        """
+        :returns: a pair of dicts: the sources by identifier and by id
+        """
+        with self.lock:
+            if self.by_identifier is not None and (self.frozen or
+                    time.time() - self.loaded_at < self.ttl):
+                return self.by_identifier, self.by_id
+        sources = list(OaiSource.objects.all())
+        by_identifier = {source.identifier: source for source in sources}
+        by_id = {source.pk: source for source in sources}
+        # sources created by a transaction which is rolled back
+        # afterwards are only forgotten when the registry is
+        # reloaded, which is fine as sources are rarely created
+        with self.lock:
+            self.by_identifier = by_identifier
+            self.by_id = by_id
+            self.loaded_at = time.time()
+        return by_identifier, by_id
+
+    def reload_after_miss(self):
+        """
+        Reloads the registry after a lookup of an unknown source,
+        unless it was already reloaded for that reason recently.
+
+        :returns: whether it was reloaded
+        """
+        with self.lock:
+            now = time.time()
+            if self.frozen or (self.miss_reloaded_at is not None and
+                    now - self.miss_reloaded_at < self.miss_delay):
+                return False
+            self.miss_reloaded_at = now
+            self.by_identifier = None
+            self.by_id = None
+            self.loaded_at = None
+        return True
+
+    def get(self, identifier):
+        """
+        :returns: the source with that identifier
+        :raises: :class:`OaiSource.DoesNotExist` if there is none
+        """
+        source = self.load()[0].get(identifier)
+        # it might have been created since the registry was loaded
+        if source is None and self.reload_after_miss():
+            source = self.load()[0].get(identifier)
+        if source is None:
+            raise OaiSource.DoesNotExist(
+                'No OAI source with identifier %s' % identifier)
+        return source
+
+    def get_by_id(self, source_id):
+        """
+        :returns: the source with that id
+        :raises: :class:`OaiSource.DoesNotExist` if there is none
+        """
+        source = self.load()[1].get(source_id)
+        if source is None and self.reload_after_miss():
+            source = self.load()[1].get(source_id)
+        if source is None:
+            raise OaiSource.DoesNotExist(
+                'No OAI source with id %s' % source_id)
+        return source
+
+    def freeze(self):
+        """
+        Stops reloading the sources from the database. This is used by
+        processes which must not query it, such as the workers of the
+        pipelined OAI ingestion, which are forked once the registry
+        has been loaded.
+        """
+        with self.lock:
+            self.frozen = True
+
+    def refresh(self):
+        """
+        Forgets the loaded sources: they will be reloaded on
+        the next lookup.
+        """
+        with self.lock:
+            if self.frozen:
+                return
+            self.by_identifier = None
+            self.by_id = None
+            self.loaded_at = None
+
+#! Shared registry of the OAI sources
+oai_sources = OaiSourceRegistry()
+
+
+@receiver(post_save, sender=OaiSource)
+@receiver(post_delete, sender=OaiSource)
+def refresh_oai_sources(sender, instance, **kwargs):
+    oai_sources.refresh()
+    transaction.on_commit(oai_sources.refresh)
+
+
 class OaiRecord(models.Model, BareOaiRecord):
     source = models.ForeignKey(OaiSource)
     about = models.ForeignKey(Paper)
@@ -1385,16 +1649,18 @@ class OaiRecord(models.Model, BareOaiRecord):
         self.save(update_fields=['priority'])
 
     @classmethod
-    def new(cls, **kwargs):
+    def new(cls, doi_memo=None, **kwargs):
         """
         Creates a new OAI record by checking first for duplicates and
         updating them if necessary.
+
+        :param doi_memo: passed to :meth:`find_duplicate_records`
         """
         source = None
         if kwargs.get('source') is None:
             source_id = kwargs.get('source_id')
             try:
-                source = OaiSource.objects.get(id=source_id)
+                source = oai_sources.get_by_id(source_id)
             except ObjectDoesNotExist:
                 pass
             if source is None:
@@ -1421,7 +1687,8 @@ class OaiRecord(models.Model, BareOaiRecord):
             match = OaiRecord.find_duplicate_records(
                     about,
                     splash_url,
-                    pdf_url)
+                    pdf_url,
+                    doi_memo)
 
         # We check that there are not already too many records in this
         # paper
@@ -1525,7 +1792,7 @@ class OaiRecord(models.Model, BareOaiRecord):
             return match
 
     @classmethod
-    def find_duplicate_records(cls, paper, splash_url, pdf_url):
+    def find_duplicate_records(cls, paper, splash_url, pdf_url, doi_memo=None):
         """
         Finds duplicate OAI records. These duplicates can have a different identifier,
         or slightly different urls (for instance https:// instead of http://).
@@ -1533,8 +1800,13 @@ class OaiRecord(models.Model, BareOaiRecord):
         :param paper: the :class:`Paper` the record is about
         :param splash_url: the splash url of the target record (link to the metadata page)
         :param pdf_url: the url of the PDF, if known (otherwise `None`)
+        :param doi_memo: a dict remembering the DOIs found in URLs (see
+            :func:`papers.doi.find_dois`), which can be shared by the
+            records of a batch as the same URLs come up again and again
         """
         https_re = re.compile(r'https?(.*)')
+        if doi_memo is None:
+            doi_memo = {}
 
         def shorten(url):
             """
@@ -1542,9 +1814,9 @@ class OaiRecord(models.Model, BareOaiRecord):
             """
             if not url:
                 return
-            doi = to_doi(url)
-            if doi:
-                return doi
+            dois = find_dois([url], doi_memo, first_only=True)
+            if dois:
+                return dois[0]
             match = https_re.match(url.strip())
             if match:
                 return match.group(1)
@@ -1569,6 +1841,197 @@ class OaiRecord(models.Model, BareOaiRecord):
         verbose_name = "OAI record"
 
 
+class DoiMetadata(models.Model):
+    """
+    Local copy of the citeproc metadata of a DOI, as returned by CrossRef
+    or the DOI proxy. This is used as a persistent cache by
+    :class:`backend.doicache.DoiMetadataStore`.
+    """
+    doi = models.CharField(max_length=1024, unique=True)
+    #! The citeproc JSON, compressed with zlib
+    compressed_json = models.BinaryField()
+    #! When the metadata was last fetched from the upstream source
+    last_fetched = models.DateTimeField(db_index=True)
+    #! When the metadata was last read from the cache (for eviction)
+    last_accessed = models.DateTimeField(db_index=True)
+
+    def __unicode__(self):
+        return self.doi
+
+    class Meta:
+        verbose_name = "DOI metadata"
+        verbose_name_plural = "DOI metadata"
+
+
+class OrcidCacheEntry(models.Model):
+    """
+    Local copy of a document of the ORCID API (a profile, or the
+    summary of its works), with the validators returned with it, so
+    that it can be revalidated with a conditional request.
+    This is used by :class:`backend.orcidcache.OrcidCache`.
+    """
+    orcid = models.CharField(max_length=32)
+    #! Path of the document, relative to the profile ('' for the profile)
+    element = models.CharField(max_length=64, blank=True)
+    #! The JSON document, compressed with zlib
+    compressed_json = models.BinaryField()
+    #! Validators: the ETag and Last-Modified headers of the response
+    etag = models.CharField(max_length=256, blank=True)
+    last_modified = models.CharField(max_length=64, blank=True)
+    #! When the document was last fetched or revalidated
+    last_fetched = models.DateTimeField()
+
+    def __unicode__(self):
+        return '%s/%s' % (self.orcid, self.element)
+
+    class Meta:
+        verbose_name = "ORCID cache entry"
+        verbose_name_plural = "ORCID cache entries"
+        unique_together = (('orcid', 'element'),)
+
+
+class OaiRecordDigest(models.Model):
+    """
+    Hash of the normalized metadata of the last ingested version
+    of an OAI record, to skip the records which have not changed
+    when a source is harvested again (see :mod:`backend.oaidigests`).
+    """
+    identifier = models.CharField(max_length=512, primary_key=True)
+    #! SHA-1 digest of the normalized metadata
+    digest = models.BinaryField()
+
+    def __unicode__(self):
+        return self.identifier
+
+    class Meta:
+        verbose_name = "OAI record digest"
+
+
+class HarvestState(models.Model):
+    """
+    Progress of a long-running harvest (such as the incremental
+    ingestion of CrossRef), checkpointed regularly so that the
+    harvest can be resumed after an interruption.
+
+    A harvest covers the records updated in a given time window.
+    """
+    #! Identifies the harvest, for instance 'crossref'
+    name = models.CharField(max_length=512, unique=True)
+    status = models.CharField(max_length=32,
+                              choices=HARVEST_STATUS_CHOICES,
+                              default='finished')
+    #! The time window covered by the current (or last) harvest
+    from_date = models.DateTimeField(null=True, blank=True)
+    until_date = models.DateTimeField(null=True, blank=True)
+    #! Position (cursor or resumption token) of the last checkpoint
+    cursor = models.TextField(null=True, blank=True)
+    #! When records are harvested in chronological order: update date
+    # of the last record before the checkpoint
+    progress_date = models.DateField(null=True, blank=True)
+    #! Number of records processed before the last checkpoint
+    records = models.BigIntegerField(default=0)
+    #! Number of pages processed before the last checkpoint
+    # (for harvests fetching records by pages, such as OAI-PMH)
+    pages = models.BigIntegerField(default=0)
+    #! Number of records left to process at the last checkpoint,
+    # when it is known (for instance, the length of a queue)
+    remaining = models.BigIntegerField(null=True, blank=True)
+
+    started = models.DateTimeField(null=True, blank=True)
+    last_checkpoint = models.DateTimeField(null=True, blank=True)
+    #! End of the time window of the last harvest that completed
+    last_success = models.DateTimeField(null=True, blank=True)
+
+    def __unicode__(self):
+        return self.name
+
+    @classmethod
+    def get_by_name(cls, name):
+        state, _ = cls.objects.get_or_create(name=name)
+        return state
+
+    @property
+    def resumable(self):
+        """
+        Was the last harvest interrupted before completion?
+        """
+        return self.status != 'finished' and self.until_date is not None
+
+    def start(self, from_date, until_date):
+        """
+        Starts a new harvest for the given time window.
+        """
+        self.status = 'running'
+        self.from_date = from_date
+        self.until_date = until_date
+        self.cursor = None
+        self.progress_date = None
+        self.records = 0
+        self.pages = 0
+        self.remaining = None
+        self.started = timezone.now()
+        self.last_checkpoint = self.started
+        self.save()
+
+    def checkpoint(self, cursor, nb_records, progress_date=None, nb_pages=0,
+                   remaining=None):
+        """
+        Records that the harvest has reached `cursor`,
+        processing `nb_records` (and `nb_pages`) since the last checkpoint.
+
+        :param remaining: the number of records left to process, if known
+        """
+        self.status = 'running'
+        self.cursor = cursor
+        self.records += nb_records
+        self.pages += nb_pages
+        if remaining is not None:
+            self.remaining = remaining
+        if progress_date:
+            self.progress_date = progress_date
+        self.last_checkpoint = timezone.now()
+        self.save()
+
+    def records_per_page(self):
+        if not self.pages:
+            return None
+        return self.records / self.pages
+
+    def eta(self):
+        """
+        Estimated time left before the harvest completes, at the rate
+        records have been processed since it started (None if unknown).
+        """
+        if (self.status != 'running' or self.remaining is None or
+                not self.records or self.started is None):
+            return None
+        elapsed = (self.last_checkpoint - self.started).total_seconds()
+        if elapsed <= 0:
+            return None
+        return timedelta(seconds=int(self.remaining * elapsed / self.records))
+
+    def lag(self):
+        """
+        How far behind the harvested source we are: the time elapsed
+        since the end of the window of the last completed harvest
+        (None if no harvest has completed yet).
+        """
+        if self.last_success is None:
+            return None
+        return timezone.now() - self.last_success
+
+    def interrupt(self):
+        self.status = 'interrupted'
+        self.save(update_fields=['status'])
+
+    def finish(self):
+        self.status = 'finished'
+        self.cursor = None
+        self.last_success = self.until_date
+        self.last_checkpoint = timezone.now()
+        self.save()
+
+
 def create_default_stats():
     return AccessStatistics.objects.create().pk
 
@@ -20,8 +20,11 @@
 
 from __future__ import unicode_literals
 
+from multiprocessing.pool import ThreadPool
+
 import requests
 
+from backend.httpclient import http_client
 from django.conf import settings
 from django.utils.http import urlencode
 from django.utils.functional import cached_property
@@ -39,6 +42,14 @@ from papers.baremodels import BareName
 from papers.bibtex import parse_bibtex
 from papers.doi import to_doi
 
+# Number of works requested at once from the ORCID API
+orcid_works_batch_size = 25
+# Number of such batches fetched concurrently
+orcid_concurrent_batches = 4
+# Number of retries of a batch when ORCID asks us to slow down
+# (the requests are also throttled, see HTTP_RATE_LIMITS)
+orcid_works_retries = 5
+
 orcid_type_to_pubtype = {
         'book': 'book',
         'book-chapter': 'book-chapter',
@@ -95,15 +106,27 @@ class OrcidProfile(object):
     An orcid profile as returned by the ORCID public API (in JSON)
     """
 
-    def __init__(self, orcid_id=None, json=None, instance=settings.ORCID_BASE_DOMAIN):
+    def __init__(self, orcid_id=None, json=None, instance=settings.ORCID_BASE_DOMAIN,
+                 cache=None):
         """
         Create a profile by ORCID ID or by providing directly the parsed JSON payload.
+
+        :param cache: if provided (see :class:`backend.orcidcache.OrcidCache`),
+            the documents of the profile are revalidated with conditional
+            requests rather than downloaded again. The new versions are only
+            stored in the cache by :meth:`save_to_cache`, once they have
+            been processed.
         """
         self.json = json
         self.id = orcid_id
         self.instance = instance
         if self.instance not in ['orcid.org', 'sandbox.orcid.org']:
             raise ValueError('Unexpected instance')
+        self.cache = cache
+        #! The paths of the documents which have not changed since cached
+        self.unchanged_elements = set()
+        #! The documents (and their validators) to store in the cache
+        self.fetched_elements = {}
 
         if orcid_id is not None:
             self.fetch()
@@ -130,13 +153,68 @@ class OrcidProfile(object):
         """
         return 'https://pub.{instance}/v2.1/{orcid}/'.format(instance=self.instance, orcid=self.id)
 
-    def request_element(self, path):
+    def request_element(self, path, retries=None):
         """
         Returns the base URL of the profile on the API
+
+        :param retries: the number of retries after a connection error,
+            or when the API is unavailable or rate-limits us
+            (see :class:`backend.httpclient.HttpClient`)
+        :raises requests.exceptions.HTTPError: if the API still returns
+            an error after these retries
         """
         headers = {'Accept': 'application/orcid+json'}
         url = self.api_uri + path
-        return requests.get(url, headers=headers).json()
+        r = http_client.get(url, headers=headers, retries=retries)
+        r.raise_for_status()
+        return r.json()
+
+    def request_cached_element(self, path):
+        """
+        Same as :meth:`request_element`, revalidating the cached version
+        of the document (if any) with a conditional request. Error
+        responses are never recorded for the cache.
+        """
+        if self.cache is None:
+            return self.request_element(path)
+        headers = {'Accept': 'application/orcid+json'}
+        cached = self.cache.get(self.id, path)
+        if cached is not None:
+            document, etag, last_modified = cached
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+        r = http_client.get(self.api_uri + path, headers=headers)
+        if cached is not None and r.status_code == 304:
+            self.unchanged_elements.add(path)
+            return document
+        r.raise_for_status()
+        document = r.json()
+        self.fetched_elements[path] = (document, r.headers.get('ETag'),
+                                       r.headers.get('Last-Modified'))
+        return document
+
+    @property
+    def unchanged(self):
+        """
+        Have the profile and the summary of its works been served
+        from the cache, unchanged since they were last processed?
+        (The works are fetched by :attr:`work_summaries`.)
+        """
+        return set(['', 'works']) <= self.unchanged_elements
+
+    def save_to_cache(self):
+        """
+        Stores the documents fetched for this profile in the cache,
+        once they have been processed.
+        """
+        if self.cache is None:
+            return
+        for path, (document, etag, last_modified) in self.fetched_elements.items():
+            if etag or last_modified:
+                self.cache.put(self.id, path, document, etag, last_modified)
+        self.fetched_elements = {}
 
     def fetch(self):
         """
@@ -144,7 +222,7 @@ class OrcidProfile(object):
         This only fetches the summaries, subsequent requests will be made for works.
         """
         try:
-            parsed = self.request_element('')
+            parsed = self.request_cached_element('')
             if parsed.get('orcid-identifier') is None:
                 # TEMPORARY: also check from the sandbox
                 if self.instance == 'orcid.org':
@@ -167,7 +245,11 @@ class OrcidProfile(object):
         return list(self._work_summaries_generator())
 
     def _work_summaries_generator(self):
-        works_summary = self.request_element('works')
+        try:
+            works_summary = self.request_cached_element('works')
+        except (requests.exceptions.HTTPError, ValueError):
+            raise MetadataSourceException(
+                'The works of the ORCiD {id} could not be fetched'.format(id=self.id))
         for group in works_summary.get('group') or []:
             for summary in group.get('work-summary') or []:
                 yield OrcidWorkSummary(summary)
@@ -259,19 +341,40 @@ class OrcidProfile(object):
                 names.append(parse_comma_name(val))
         return names
 
-    def fetch_works(self, put_codes):
+    def fetch_works(self, put_codes, workers=orcid_concurrent_batches):
         """
         Retrieves the full metadata of the given works in this profile.
+
+        The works are requested by batches, fetched concurrently by
+        `workers` threads (sharing the connections of the HTTP client),
+        and yielded as soon as their batch has been fetched (hence not
+        necessarily in the order of the put codes).
+
+        A batch which cannot be fetched (even after retries) is left out:
+        callers should compare the put codes of the works yielded with
+        the ones they requested.
         """
-        batch_size = 25
-        # TODO
-        i = 0
-        while i < len(put_codes):
-            batch = put_codes[i:(i+batch_size)]
-            i += batch_size
-            works_meta = self.request_element('works/'+','.join([str(c) for c in batch]))
-            for work in works_meta.get('bulk') or []:
-                yield OrcidWork(self, work)
+        batches = [put_codes[i:i+orcid_works_batch_size]
+                   for i in range(0, len(put_codes), orcid_works_batch_size)]
+        if not batches:
+            return
+
+        def fetch_batch(batch):
+            try:
+                return self.request_element(
+                    'works/'+','.join([str(c) for c in batch]),
+                    retries=orcid_works_retries)
+            except (requests.exceptions.RequestException, ValueError) as e:
+                print "Fetching ORCiD works of %s failed: %s" % (self.id, unicode(e))
+                return {}
+
+        pool = ThreadPool(min(workers, len(batches)))
+        try:
+            for works_meta in pool.imap_unordered(fetch_batch, batches):
+                for work in works_meta.get('bulk') or []:
+                    yield OrcidWork(self, work)
+        finally:
+            pool.terminate()
 
     @staticmethod
     def search_by_name(first, last, instance=settings.ORCID_BASE_DOMAIN):
@@ -292,7 +395,7 @@ class OrcidProfile(object):
             }
         url = baseurl+'?'+urlencode(dct)
         try:
-            r = requests.get(url)
+            r = http_client.get(url)
             # the namespace is the same for both the production and the
             # sandbox versions.
             ns = {'ns': 'http://www.orcid.org/ns/orcid'}
@@ -384,6 +487,14 @@ class OrcidWorkSummary(object):
     def put_code(self):
         return self.json.get('put-code')
 
+    @property
+    def last_modified(self):
+        """
+        When the work was last modified in ORCID (a timestamp in
+        milliseconds), if provided.
+        """
+        return jpath('last-modified-date/value', self.json)
+
     def __unicode__(self):
         return self.title or '(no title)'
 
@@ -466,7 +577,7 @@ class OrcidWork(object):
         """
         ORCiD internal id for the work
         """
-        return self.j('put-code')
+        return self.j('work/put-code')
 
     @property
     def api_uri(self):
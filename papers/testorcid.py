@@ -21,8 +21,11 @@
 
 from __future__ import unicode_literals
 
+import re
 import unittest
 
+import requests_mock
+
 from papers.orcid import OrcidProfile
 from papers.orcid import OrcidWorkSummary
 
@@ -264,3 +267,51 @@ class OrcidProfileTest(unittest.TestCase):
         pubtypes = [work.pubtype for work in works]
         self.assertTrue('journal-article' in pubtypes)
 
+    @requests_mock.Mocker()
+    def test_fetch_works_concurrently(self, m):
+        profile = OrcidProfile(json={})
+        profile.id = '0000-0002-8612-8827'
+        rate_limited = []
+
+        def works(request, context):
+            put_codes = request.path.rsplit('/', 1)[1].split(',')
+            if put_codes[0] == '0' and not rate_limited:
+                rate_limited.append(True)
+                context.status_code = 429
+                context.headers['Retry-After'] = '0'
+                return {}
+            return {'bulk': [{'work': {
+                'put-code': int(c),
+                'title': {'title': {'value': 'Work %s' % c}}}}
+                for c in put_codes]}
+        m.get(re.compile(r'https://pub\.[a-z.]*orcid\.org/v2\.1/.*/works/'),
+              json=works)
+
+        works = list(profile.fetch_works(range(60)))
+        self.assertEqual(sorted(work.title for work in works),
+                         sorted('Work %d' % c for c in range(60)))
+        # three batches, one of them retried
+        self.assertEqual(m.call_count, 4)
+
+    @requests_mock.Mocker()
+    def test_fetch_works_failed_batch(self, m):
+        profile = OrcidProfile(json={})
+        profile.id = '0000-0002-8612-8827'
+
+        def works(request, context):
+            put_codes = request.path.rsplit('/', 1)[1].split(',')
+            if put_codes[0] == '25':
+                context.status_code = 503
+                context.headers['Retry-After'] = '0'
+                return {'error': 'unavailable'}
+            return {'bulk': [{'work': {
+                'put-code': int(c),
+                'title': {'title': {'value': 'Work %s' % c}}}}
+                for c in put_codes]}
+        m.get(re.compile(r'https://pub\.[a-z.]*orcid\.org/v2\.1/.*/works/'),
+              json=works)
+
+        # the batch which kept failing is left out
+        works = list(profile.fetch_works(range(60)))
+        self.assertEqual(sorted(work.put_code for work in works),
+                         range(25) + range(50, 60))
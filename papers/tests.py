@@ -28,9 +28,12 @@ import django.test
 from papers.baremodels import BareName
 import papers.doi
 from django.contrib.auth.models import User
+from django.utils import timezone
+from papers.models import HarvestState
 from papers.models import Name
 from papers.models import OaiRecord
 from papers.models import OaiSource
+from papers.models import OaiSourceRegistry
 from papers.models import Paper
 from papers.models import Researcher
 from papers.models import Institution
@@ -159,6 +162,16 @@ class OaiRecordTest(django.test.TestCase):
         OaiRecord.find_duplicate_records(
             paper, 'ftp://dissem.in/paper.pdf', None)
 
+    def test_find_duplicate_records_memo(self):
+        paper = Paper.get_or_create('this is a title', [Name.lookup_name(('Jean', 'Saisrien'))],
+                                    datetime.date(year=2015, month=05, day=04))
+        doi_memo = {}
+        OaiRecord.find_duplicate_records(
+            paper, 'https://doi.org/10.1145/1721837.1721839', None, doi_memo)
+        # the memo is shared with the caller
+        self.assertEqual(doi_memo['https://doi.org/10.1145/1721837.1721839'],
+                         '10.1145/1721837.1721839')
+
 
 def load_tests(loader, tests, ignore):
     tests.addTests(doctest.DocTestSuite(papers.doi))
@@ -282,3 +295,73 @@ class PaperTest(django.test.TestCase):
         self.assertTrue(p1.is_owned_by(other_user, flexible=True))
 
 
+
+
+class HarvestStateTest(django.test.TestCase):
+
+    def test_lifecycle(self):
+        state = HarvestState.get_by_name('test')
+        self.assertFalse(state.resumable)
+
+        start = timezone.now()
+        state.start(from_date=start - datetime.timedelta(days=1),
+                    until_date=start)
+        state.checkpoint('cursor1', 100, date(2018, 1, 2))
+        state.checkpoint('cursor2', 50)
+        state.interrupt()
+
+        state = HarvestState.get_by_name('test')
+        self.assertTrue(state.resumable)
+        self.assertEqual(state.cursor, 'cursor2')
+        self.assertEqual(state.records, 150)
+        self.assertEqual(state.progress_date, date(2018, 1, 2))
+
+        state.finish()
+        state = HarvestState.get_by_name('test')
+        self.assertFalse(state.resumable)
+        self.assertEqual(state.cursor, None)
+        self.assertEqual(state.last_success, start)
+
+
+class OaiSourceRegistryTest(django.test.TestCase):
+
+    def test_lookups(self):
+        source = OaiSource.objects.create(identifier='test_source',
+            name='Test source', default_pubtype='preprint')
+        registry = OaiSourceRegistry()
+        self.assertEqual(registry.get('test_source'), source)
+        self.assertEqual(registry.get_by_id(source.pk), source)
+        with self.assertRaises(OaiSource.DoesNotExist):
+            registry.get('no_such_source')
+
+    def test_new_source(self):
+        registry = OaiSourceRegistry(miss_delay=0)
+        with self.assertRaises(OaiSource.DoesNotExist):
+            registry.get('test_source')
+        OaiSource.objects.create(identifier='test_source',
+            name='Test source', default_pubtype='preprint')
+        self.assertEqual(registry.get('test_source').name, 'Test source')
+
+    def test_frozen(self):
+        registry = OaiSourceRegistry(ttl=0, miss_delay=0)
+        registry.load()
+        registry.freeze()
+        OaiSource.objects.create(identifier='test_source',
+            name='Test source', default_pubtype='preprint')
+        with self.assertNumQueries(0):
+            registry.refresh()
+            with self.assertRaises(OaiSource.DoesNotExist):
+                registry.get('test_source')
+
+    def test_misses_are_rate_limited(self):
+        registry = OaiSourceRegistry(miss_delay=3600)
+        with self.assertRaises(OaiSource.DoesNotExist):
+            registry.get('test_source')
+        OaiSource.objects.create(identifier='test_source',
+            name='Test source', default_pubtype='preprint')
+        with self.assertNumQueries(0):
+            with self.assertRaises(OaiSource.DoesNotExist):
+                registry.get('test_source')
+        # saving a source refreshes the registry explicitly
+        registry.refresh()
+        self.assertEqual(registry.get('test_source').name, 'Test source')
@@ -20,8 +20,11 @@
 
 from __future__ import unicode_literals
 
+from collections import OrderedDict
 import datetime
 import re
+import threading
+import time
 import unicodedata
 
 from lxml.html.clean import Cleaner
@@ -638,3 +641,124 @@ def index_of(elem, choices):
         if code == elem:
             return idx
     return 0
+
+
+# Caching utilities
+
+class LRUCache(object):
+    """
+    A dictionary of bounded size, which evicts its least recently
+    used entries first. It is thread-safe and counts its hits and misses.
+
+    None can be cached (for instance to remember that a lookup failed),
+    so :meth:`lookup` returns whether the key was found.
+
+    Entries can be given tags, so that all the entries with a given tag
+    can be discarded at once, and they can expire after `ttl` seconds.
+
+    >>> cache = LRUCache(2)
+    >>> cache.set('a', 1, tags=['odd'])
+    >>> cache.set('b', None)
+    >>> cache.lookup('a')
+    (True, 1)
+    >>> cache.set('c', 3, tags=['odd'])
+    >>> cache.lookup('b')
+    (False, None)
+    >>> cache.discard_tag('odd')
+    >>> len(cache)
+    0
+    >>> cache.hit_ratio()
+    0.5
+    """
+
+    def __init__(self, max_size, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        # key -> (value, expiry time or None, tags)
+        self.entries = OrderedDict()
+        # tag -> set of keys
+        self.tagged = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _remove(self, key):
+        """
+        Removes an entry (the lock must be held).
+        """
+        value, expiry, tags = self.entries.pop(key)
+        for tag in tags:
+            keys = self.tagged.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tagged[tag]
+        return value, expiry
+
+    def lookup(self, key):
+        """
+        :returns: a pair: whether the key was found, and its value
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or (
+                    entry[1] is not None and entry[1] < time.time()):
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return False, None
+            # mark it as the most recently used
+            del self.entries[key]
+            self.entries[key] = entry
+            self.hits += 1
+            return True, entry[0]
+
+    def set(self, key, value, tags=()):
+        expiry = None
+        if self.ttl is not None:
+            expiry = time.time() + self.ttl
+        tags = tuple(tags)
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, expiry, tags)
+            for tag in tags:
+                self.tagged.setdefault(tag, set()).add(key)
+            while len(self.entries) > self.max_size:
+                self._remove(next(iter(self.entries)))
+
+    def discard(self, key, predicate=None):
+        """
+        Removes the entry for that key, if predicate(value) is true
+        (or no predicate is given).
+        """
+        with self.lock:
+            if key in self.entries and (
+                    predicate is None or predicate(self.entries[key][0])):
+                self._remove(key)
+
+    def discard_tag(self, tag):
+        """
+        Removes the entries with that tag.
+        """
+        with self.lock:
+            for key in list(self.tagged.get(tag, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.tagged.clear()
+
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        if not total:
+            return 0.
+        return float(self.hits) / total
+
+    def report(self):
+        return '%d entries, %d hits, %d misses (hit ratio: %.1f%%)' % (
+            len(self), self.hits, self.misses, 100*self.hit_ratio())
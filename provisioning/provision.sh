@@ -172,7 +172,7 @@ tmux set-option -t $_SNAME set-remain-on-exit on
 # Django development server
 tmux new-window -t $_SNAME -n django -c '/dissemin' -d '/dissemin/.vm_venv/bin/python /dissemin/manage.py runserver 0.0.0.0:8080'
 # Celery backend
-tmux new-window -t $_SNAME -n celery -c '/dissemin' -d '/dissemin/.vm_venv/bin/celery --app=dissemin.celery:app worker -B -l INFO'
+tmux new-window -t $_SNAME -n celery -c '/dissemin' -d '/dissemin/.vm_venv/bin/celery --app=dissemin.celery:app worker -Q interactive,default,bulk -B -l INFO'
 # Super user prompt
 tmux new-window -t $_SNAME -n superuser -c '/dissemin' -d '/dissemin/.vm_venv/bin/python /dissemin/manage.py createsuperuser'
 EOF
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Count
+from django.db.models import Sum
+
+
+def merge_duplicate_aliases(apps, schema_editor):
+    """
+    Merges the aliases with the same name and publisher
+    (they could be created before the uniqueness constraint)
+    """
+    AliasPublisher = apps.get_model('publishers', 'AliasPublisher')
+    duplicates = (AliasPublisher.objects.values('name', 'publisher')
+                  .annotate(nb=Count('id'), total=Sum('count'))
+                  .filter(nb__gt=1))
+    for dup in duplicates:
+        aliases = list(AliasPublisher.objects.filter(
+            name=dup['name'], publisher=dup['publisher']).order_by('id'))
+        kept = aliases[0]
+        kept.count = dup['total']
+        kept.save()
+        AliasPublisher.objects.filter(
+            id__in=[alias.id for alias in aliases[1:]]).delete()
+
+
+def backwards(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('publishers', '0002_update_aliases'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_aliases, backwards),
+        migrations.AlterUniqueTogether(
+            name='aliaspublisher',
+            unique_together=set([('name', 'publisher')]),
+        ),
+    ]
@@ -21,11 +21,19 @@
 
 from __future__ import unicode_literals
 
+from collections import OrderedDict
+import atexit
 from statistics.models import AccessStatistics
+import threading
+import time
 
+from celery.signals import task_postrun
 from django.apps import apps
 from django.core.urlresolvers import reverse
+from django.db import IntegrityError
 from django.db import models
+from django.db import transaction
+from django.db.models import F
 from django.template.defaultfilters import slugify
 from django.utils.functional import cached_property
 from django.utils.translation import ugettext as _
@@ -33,6 +41,11 @@ from search import SearchQuerySet
 
 get_model = apps.get_model
 
+# Number of pending alias increments triggering a flush
+ALIAS_COUNTER_MAX_PENDING = 1000
+# Maximum time (in seconds) between two flushes of alias increments
+ALIAS_COUNTER_FLUSH_INTERVAL = 60
+
 
 OA_STATUS_CHOICES = (
         ('OA', _('Open access'), _('Freely available from the publisher.')),
@@ -284,21 +297,149 @@ class AliasPublisher(models.Model):
     publisher = models.ForeignKey(Publisher)
     name = models.CharField(max_length=512)
     count = models.IntegerField(default=0)
-    unique_together = ('name', 'publisher')
 
     def __unicode__(self):
         return self.name + ' --'+str(self.count)+'--> '+unicode(self.publisher)
 
     @classmethod
     def increment(cls, name, publisher):
-        # TODO it would be more efficient with an update, but it does not really
-        # work
-        if not name:
+        """
+        Counts one more association of that name with that publisher.
+        The increment is buffered in memory (see :class:`AliasCounter`).
+        """
+        if not name or publisher is None:
             return
-        alias, _ = cls.objects.get_or_create(
-            name=name, publisher=publisher)
-        alias.count += 1
-        alias.save()
+        alias_counter.add(name, publisher)
+
+    @classmethod
+    def add_to_count(cls, name, publisher_id, count):
+        """
+        Adds count to the number of associations of that name with that
+        publisher, with an atomic update (creating the alias if needed).
+        """
+        with transaction.atomic():
+            updated = cls.objects.filter(
+                name=name, publisher_id=publisher_id).update(
+                count=F('count')+count)
+            if updated:
+                return
+            try:
+                with transaction.atomic():
+                    cls.objects.create(
+                        name=name, publisher_id=publisher_id, count=count)
+            except IntegrityError:
+                # created concurrently
+                cls.objects.filter(
+                    name=name, publisher_id=publisher_id).update(
+                    count=F('count')+count)
+
+    @classmethod
+    def counts_for(cls, name):
+        """
+        The publishers associated with that name, with their counts
+        (including the increments not flushed yet), most frequent first.
+
+        :returns: a list of (publisher, count) pairs
+        """
+        counts = OrderedDict()
+        for alias in cls.objects.filter(name=name).select_related('publisher'):
+            counts[alias.publisher_id] = [alias.publisher, alias.count]
+        for publisher, count in alias_counter.pending_for(name):
+            counts.setdefault(publisher.pk, [publisher, 0])[1] += count
+        return sorted(map(tuple, counts.values()),
+                      key=lambda pair: -pair[1])
 
     class Meta:
         db_table = 'papers_aliaspublisher'
+        unique_together = ('name', 'publisher')
+
+
+class AliasCounter(object):
+    """
+    Buffers the increments of :class:`AliasPublisher` counts in memory,
+    aggregated by (name, publisher), so that ingesting papers does not
+    write to the aliases table for every publication.
+
+    The increments are flushed to the database when enough of them are
+    pending or when the last flush is old enough, once the transaction
+    of the caller is committed (so that rolling it back does not lose
+    the increments buffered by others). They are also flushed at the end
+    of each Celery task and when the process exits.
+    """
+
+    def __init__(self, max_pending=ALIAS_COUNTER_MAX_PENDING,
+                 flush_interval=ALIAS_COUNTER_FLUSH_INTERVAL):
+        """
+        :param max_pending: the number of increments triggering a flush
+        :param flush_interval: the maximum time (in seconds) between
+            two flushes
+        """
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self.lock = threading.RLock()
+        #! (name, publisher id) -> [publisher, count]
+        self.pending = {}
+        self.nb_pending = 0
+        self.last_flush = time.time()
+        # when the last deferred flush was scheduled (None if there is
+        # none pending)
+        self.flush_scheduled = None
+
+    def add(self, name, publisher, count=1):
+        with self.lock:
+            key = (name, publisher.pk)
+            self.pending.setdefault(key, [publisher, 0])[1] += count
+            self.nb_pending += count
+            now = time.time()
+            if (self.nb_pending >= self.max_pending or
+                    now - self.last_flush >= self.flush_interval):
+                # a scheduled flush is dropped if the savepoint which
+                # scheduled it is rolled back, so we schedule it again
+                # if it has not happened after some time
+                if (self.flush_scheduled is None or
+                        now - self.flush_scheduled >= self.flush_interval):
+                    self.flush_scheduled = now
+                    transaction.on_commit(self.flush)
+
+    def pending_for(self, name):
+        """
+        :returns: the (publisher, count) pairs pending for that name
+        """
+        with self.lock:
+            return [tuple(value) for (alias, pk), value
+                    in self.pending.items() if alias == name]
+
+    def flush(self):
+        """
+        Writes the pending increments to the database.
+        """
+        with self.lock:
+            pending = self.pending
+            self.pending = {}
+            self.nb_pending = 0
+            self.last_flush = time.time()
+            self.flush_scheduled = None
+            for (name, publisher_id), (publisher, count) in pending.items():
+                try:
+                    AliasPublisher.add_to_count(name, publisher_id, count)
+                except IntegrityError:
+                    # the publisher has been deleted in the meantime
+                    pass
+
+    def clear(self):
+        """
+        Forgets the pending increments.
+        """
+        with self.lock:
+            self.pending = {}
+            self.nb_pending = 0
+
+#! Shared buffer of alias increments
+alias_counter = AliasCounter()
+atexit.register(alias_counter.flush)
+
+
+@task_postrun.connect
+def flush_alias_counter(**kwargs):
+    # Celery worker processes can exit without running atexit handlers
+    alias_counter.flush()
@@ -18,8 +18,15 @@
 
 
 from backend.romeo import fetch_journal
+from backend.romeo import find_or_fetch_publisher
+from django.test import TestCase
+from mock import patch
 from papers.models import Paper
 from papers.testpages import RenderingTest
+from publishers.models import AliasCounter
+from publishers.models import AliasPublisher
+from publishers.models import alias_counter
+from publishers.models import Publisher
 
 
 class JournalPageTest(RenderingTest):
@@ -42,3 +49,47 @@ class JournalPageTest(RenderingTest):
         for publi in p.publications:
             self.checkPage('publisher', kwargs={
                            'pk': publi.publisher_id, 'slug': publi.publisher.slug})
+
+
+class AliasPublisherTest(TestCase):
+
+    def setUp(self):
+        self.publisher = Publisher.objects.create(
+            romeo_id='1234', name='Some publisher')
+        alias_counter.clear()
+
+    def tearDown(self):
+        alias_counter.clear()
+
+    def test_buffered_increments(self):
+        counter = AliasCounter(max_pending=3, flush_interval=3600)
+        with patch('publishers.models.transaction.on_commit') as on_commit:
+            counter.add('Some publ.', self.publisher)
+            counter.add('Some publ.', self.publisher)
+            self.assertEqual(counter.pending_for('Some publ.'),
+                             [(self.publisher, 2)])
+            self.assertFalse(on_commit.called)
+            counter.add('Some publ.', self.publisher)
+            # the flush waits for the end of the current transaction
+            on_commit.assert_called_once_with(counter.flush)
+            self.assertFalse(AliasPublisher.objects.exists())
+            counter.add('Some publ.', self.publisher)
+            self.assertEqual(on_commit.call_count, 1)
+        counter.flush()
+        self.assertEqual(counter.pending_for('Some publ.'), [])
+        self.assertEqual(AliasPublisher.objects.get(name='Some publ.').count, 4)
+        counter.add('Some publ.', self.publisher, 2)
+        counter.flush()
+        self.assertEqual(AliasPublisher.objects.get(name='Some publ.').count, 6)
+
+    def test_threshold_reads_through_buffer(self):
+        AliasPublisher.objects.create(name='Some publ.', count=500,
+                                      publisher=self.publisher)
+        self.assertEqual(AliasPublisher.counts_for('Some publ.'),
+                         [(self.publisher, 500)])
+        for i in range(501):
+            AliasPublisher.increment('Some publ.', self.publisher)
+        self.assertEqual(AliasPublisher.counts_for('Some publ.'),
+                         [(self.publisher, 1001)])
+        self.assertEqual(find_or_fetch_publisher('Some publ.'),
+                         (self.publisher, True))